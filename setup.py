@@ -14,12 +14,16 @@ setup(
     packages=find_packages(),
     # CLI Entry Point
     entry_points={
-        'console_scripts': ['ultideploy=ultideploy.cli:main']
+        'console_scripts': ['ultideploy=ultideploy.daemon:launch']
     },
     # Dependencies
     install_requires=[
         "google-api-python-client",
+        "google-auth-httplib2",
         "google-cloud-resource-manager",
         "oauth2client",
     ],
+    extras_require={
+        "perf": ["numpy"],
+    },
 )
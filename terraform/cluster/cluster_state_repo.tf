@@ -4,7 +4,7 @@ resource "google_sourcerepo_repository" "cluster_state" {
 }
 
 resource "google_project_iam_member" "cloudbuild" {
-  member  = "serviceAccount:${data.terraform_remote_state.project.outputs.root_project.number}@cloudbuild.gserviceaccount.com"
+  member  = "serviceAccount:${local.root_project_number}@cloudbuild.gserviceaccount.com"
   project = local.root_project_id
   role    = "roles/source.writer"
 }
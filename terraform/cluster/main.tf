@@ -5,7 +5,9 @@ terraform {
   }
 }
 
+# Only read when the value is not passed in by the deployment tool.
 data "terraform_remote_state" "network" {
+  count   = var.vpc_name == null ? 1 : 0
   backend = "gcs"
 
   config = {
@@ -14,7 +16,9 @@ data "terraform_remote_state" "network" {
   }
 }
 
+# Only read when the value is not passed in by the deployment tool.
 data "terraform_remote_state" "project" {
+  count   = var.root_project_id == null ? 1 : 0
   backend = "gcs"
 
   config = {
@@ -40,7 +44,9 @@ provider "random" {
 }
 
 locals {
-  root_project_id = data.terraform_remote_state.project.outputs.root_project.id
+  root_project_id     = var.root_project_id != null ? var.root_project_id : join("", data.terraform_remote_state.project[*].outputs.root_project.id)
+  root_project_number = var.root_project_number != null ? var.root_project_number : join("", data.terraform_remote_state.project[*].outputs.root_project.number)
+  vpc_name            = var.vpc_name != null ? var.vpc_name : join("", data.terraform_remote_state.network[*].outputs.vpc.name)
 }
 
 data "google_container_engine_versions" "latest_patch" {
@@ -53,7 +59,7 @@ resource "google_container_cluster" "primary" {
   location           = var.gcp_region
   min_master_version = data.google_container_engine_versions.latest_patch.latest_master_version
   name               = "ultimanager"
-  network            = data.terraform_remote_state.network.outputs.vpc.name
+  network            = local.vpc_name
   project            = local.root_project_id
 
   # We can't create a cluster with no node pool defined, but we want to only use
@@ -10,3 +10,21 @@ variable "gcp_region" {
 variable "root_domain" {
   description = "The root domain for the application."
 }
+
+variable "root_project_id" {
+  default     = null
+  description = "The ID of the root project. Read from the project state if not given."
+  type        = string
+}
+
+variable "root_project_number" {
+  default     = null
+  description = "The number of the root project. Read from the project state if not given."
+  type        = string
+}
+
+variable "vpc_name" {
+  default     = null
+  description = "The name of the main VPC network. Read from the network state if not given."
+  type        = string
+}
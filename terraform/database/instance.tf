@@ -5,21 +5,28 @@ terraform {
   }
 }
 
+locals {
+  root_project_id = var.root_project_id != null ? var.root_project_id : join("", data.terraform_remote_state.project[*].outputs.root_project.id)
+  vpc_self_link   = var.vpc_self_link != null ? var.vpc_self_link : join("", data.terraform_remote_state.network[*].outputs.vpc.self_link)
+}
+
 provider "google" {
   version = "~> 2.17"
 
-  project = data.terraform_remote_state.project.outputs.root_project.id
+  project = local.root_project_id
   region  = var.gcp_region
 }
 
 provider "google-beta" {
   version = "~> 2.17"
 
-  project = data.terraform_remote_state.project.outputs.root_project.id
+  project = local.root_project_id
   region  = var.gcp_region
 }
 
+# Only read when the value is not passed in by the deployment tool.
 data "terraform_remote_state" "network" {
+  count   = var.vpc_self_link == null ? 1 : 0
   backend = "gcs"
 
   config = {
@@ -28,7 +35,9 @@ data "terraform_remote_state" "network" {
   }
 }
 
+# Only read when the value is not passed in by the deployment tool.
 data "terraform_remote_state" "project" {
+  count   = var.root_project_id == null ? 1 : 0
   backend = "gcs"
 
   config = {
@@ -44,11 +53,11 @@ resource "google_compute_global_address" "db_private_ip" {
   purpose       = "VPC_PEERING"
   address_type  = "INTERNAL"
   prefix_length = 16
-  network       = data.terraform_remote_state.network.outputs.vpc.self_link
+  network       = local.vpc_self_link
 }
 
 resource "google_service_networking_connection" "db_vpc_connection" {
-  network = data.terraform_remote_state.network.outputs.vpc.self_link
+  network = local.vpc_self_link
   service = "servicenetworking.googleapis.com"
   reserved_peering_ranges = [
   google_compute_global_address.db_private_ip.name]
@@ -67,7 +76,7 @@ resource "google_sql_database_instance" "db" {
 
     ip_configuration {
       ipv4_enabled    = false
-      private_network = data.terraform_remote_state.network.outputs.vpc.self_link
+      private_network = local.vpc_self_link
     }
   }
 }
@@ -2,3 +2,15 @@ variable "gcp_region" {
   default     = "us-east1"
   description = "The region to create GCP resources in."
 }
+
+variable "root_project_id" {
+  default     = null
+  description = "The ID of the root project. Read from the project state if not given."
+  type        = string
+}
+
+variable "vpc_self_link" {
+  default     = null
+  description = "The self link of the main VPC network. Read from the network state if not given."
+  type        = string
+}
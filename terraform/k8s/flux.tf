@@ -1,5 +1,5 @@
 locals {
-  flux_service_account = data.terraform_remote_state.cluster.outputs.flux_service_account.email
+  flux_service_account = local.flux_service_account_email
 }
 
 // Adapted from the output of 'fluxctl install'
@@ -128,7 +128,7 @@ resource "kubernetes_deployment" "flux" {
         container {
           args = [
             "--memcached-service=",
-            "--git-url=${data.terraform_remote_state.cluster.outputs.cluster_state_repo.url}",
+            "--git-url=${local.cluster_state_repo_url}",
             "--git-branch=master",
             "--git-label=flux",
             "--git-user=flux",
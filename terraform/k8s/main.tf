@@ -5,6 +5,15 @@ terraform {
   }
 }
 
+locals {
+  cluster_auth_ca_certificate = var.cluster_auth_ca_certificate != null ? var.cluster_auth_ca_certificate : join("", data.terraform_remote_state.cluster[*].outputs.cluster_auth_ca_certificate)
+  cluster_auth_certificate    = var.cluster_auth_certificate != null ? var.cluster_auth_certificate : join("", data.terraform_remote_state.cluster[*].outputs.cluster_auth_certificate)
+  cluster_auth_key            = var.cluster_auth_key != null ? var.cluster_auth_key : join("", data.terraform_remote_state.cluster[*].outputs.cluster_auth_key)
+  cluster_host                = var.cluster_host != null ? var.cluster_host : join("", data.terraform_remote_state.cluster[*].outputs.cluster_host)
+  cluster_state_repo_url      = var.cluster_state_repo_url != null ? var.cluster_state_repo_url : join("", data.terraform_remote_state.cluster[*].outputs.cluster_state_repo.url)
+  flux_service_account_email  = var.flux_service_account_email != null ? var.flux_service_account_email : join("", data.terraform_remote_state.cluster[*].outputs.flux_service_account.email)
+}
+
 provider "google" {
   version = "~> 2.17"
 }
@@ -12,10 +21,10 @@ provider "google" {
 provider "kubernetes" {
   version = "~> 1.9"
 
-  client_certificate     = data.terraform_remote_state.cluster.outputs.cluster_auth_certificate
-  client_key             = data.terraform_remote_state.cluster.outputs.cluster_auth_key
-  cluster_ca_certificate = data.terraform_remote_state.cluster.outputs.cluster_auth_ca_certificate
-  host                   = data.terraform_remote_state.cluster.outputs.cluster_host
+  client_certificate     = local.cluster_auth_certificate
+  client_key             = local.cluster_auth_key
+  cluster_ca_certificate = local.cluster_auth_ca_certificate
+  host                   = local.cluster_host
   load_config_file       = false
 
   // The token is what lets us use IAM permissions to authorize Kubernetes
@@ -24,7 +33,9 @@ provider "kubernetes" {
   token = data.google_client_config.default.access_token
 }
 
+# Only read when the value is not passed in by the deployment tool.
 data "terraform_remote_state" "cluster" {
+  count   = var.cluster_host == null ? 1 : 0
   backend = "gcs"
 
   config = {
@@ -1,4 +1,6 @@
+# Only read when the value is not passed in by the deployment tool.
 data "terraform_remote_state" "db" {
+  count   = var.db_private_ip_address == null ? 1 : 0
   backend = "gcs"
 
   config = {
@@ -7,15 +9,21 @@ data "terraform_remote_state" "db" {
   }
 }
 
+locals {
+  db_admin_name         = var.db_admin_name != null ? var.db_admin_name : join("", data.terraform_remote_state.db[*].outputs.admin.name)
+  db_admin_password     = var.db_admin_password != null ? var.db_admin_password : join("", data.terraform_remote_state.db[*].outputs.admin.password)
+  db_private_ip_address = var.db_private_ip_address != null ? var.db_private_ip_address : join("", data.terraform_remote_state.db[*].outputs.db.private_ip_address)
+}
+
 resource "kubernetes_secret" "db_creds" {
   metadata {
     name = "db-creds"
   }
 
   data = {
-    host     = data.terraform_remote_state.db.outputs.db.private_ip_address
-    password = data.terraform_remote_state.db.outputs.admin.password
+    host     = local.db_private_ip_address
+    password = local.db_admin_password
     port     = 5432
-    username = data.terraform_remote_state.db.outputs.admin.name
+    username = local.db_admin_name
   }
 }
@@ -1,8 +1,62 @@
+variable "cluster_auth_ca_certificate" {
+  default     = null
+  description = "The cluster's CA certificate. Read from the cluster state if not given."
+  type        = string
+}
+
+variable "cluster_auth_certificate" {
+  default     = null
+  description = "The cluster's client certificate. Read from the cluster state if not given."
+  type        = string
+}
+
+variable "cluster_auth_key" {
+  default     = null
+  description = "The cluster's client key. Read from the cluster state if not given."
+  type        = string
+}
+
+variable "cluster_host" {
+  default     = null
+  description = "The cluster's endpoint. Read from the cluster state if not given."
+  type        = string
+}
+
+variable "cluster_state_repo_url" {
+  default     = null
+  description = "The URL of the cluster state repository. Read from the cluster state if not given."
+  type        = string
+}
+
+variable "db_admin_name" {
+  default     = null
+  description = "The name of the database admin user. Read from the database state if not given."
+  type        = string
+}
+
+variable "db_admin_password" {
+  default     = null
+  description = "The password of the database admin user. Read from the database state if not given."
+  type        = string
+}
+
+variable "db_private_ip_address" {
+  default     = null
+  description = "The private IP address of the database. Read from the database state if not given."
+  type        = string
+}
+
 variable "flux_namespace" {
   default     = "flux"
   description = "The name of the Kubernetes namespace to create Flux resources in."
 }
 
+variable "flux_service_account_email" {
+  default     = null
+  description = "The email of Flux's service account. Read from the cluster state if not given."
+  type        = string
+}
+
 variable "flux_version" {
   default     = "1.15.0"
   description = "The version of Flux to deploy."
@@ -12,4 +66,3 @@ variable "memcached_version" {
   default     = "1.5.15"
   description = "The version of memcached to run alongside Flux."
 }
-
@@ -2,3 +2,9 @@ variable "gcp_region" {
   default     = "us-east1"
   description = "The region to create GCP resources in."
 }
+
+variable "root_project_id" {
+  default     = null
+  description = "The ID of the root project. Read from the project state if not given."
+  type        = string
+}
@@ -5,7 +5,9 @@ terraform {
   }
 }
 
+# Only read when the value is not passed in by the deployment tool.
 data "terraform_remote_state" "project" {
+  count   = var.root_project_id == null ? 1 : 0
   backend = "gcs"
 
   config = {
@@ -14,10 +16,14 @@ data "terraform_remote_state" "project" {
   }
 }
 
+locals {
+  root_project_id = var.root_project_id != null ? var.root_project_id : join("", data.terraform_remote_state.project[*].outputs.root_project.id)
+}
+
 provider "google" {
   version = "~> 2.17"
 
-  project = data.terraform_remote_state.project.outputs.root_project.id
+  project = local.root_project_id
   region  = var.gcp_region
 }
 
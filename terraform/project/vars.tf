@@ -8,12 +8,7 @@ variable "gcp_region" {
 }
 
 variable "project_services" {
-  default = [
-    "container.googleapis.com",
-    "servicenetworking.googleapis.com",
-    "sourcerepo.googleapis.com"
-  ]
-  description = "The APIs that are enabled in the root project."
+  description = "The APIs that are enabled in the root project. Set in 'project_services.auto.tfvars.json', which the deployment tool also reads."
   type        = set(string)
 }
 
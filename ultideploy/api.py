@@ -0,0 +1,520 @@
+import bisect
+import collections
+import json
+import os
+import random
+import socket
+import threading
+import time
+
+import googleapiclient.discovery
+import googleapiclient.discovery_cache
+import googleapiclient.errors
+import googleapiclient.http
+import httplib2
+
+
+# The upper bounds, in seconds, of the buckets that call latencies are
+# counted in. Latencies above the last bound are counted in an overflow
+# bucket.
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# The status recorded for attempts that failed without a response.
+TRANSPORT_ERROR = 'transport-error'
+
+# Setting this environment variable sends every API call to the given
+# endpoint instead of Google, eg a local server started with
+# "ultideploy fake-gcp".
+ENDPOINT_VARIABLE = 'ULTIDEPLOY_API_ENDPOINT'
+
+# The number of calls per second allowed to each API by default, and
+# how many calls can be made at once after an API has been idle. Spacing
+# calls out keeps concurrent callers under the per-minute quotas.
+DEFAULT_RATE_LIMIT = 10.0
+DEFAULT_BURST = 10
+
+# Rate limits for APIs whose default quotas are lower than the default.
+API_RATE_LIMITS = {
+    'iam': 5.0,
+}
+
+# The number of times a call is retried after a retryable error unless
+# the caller asks for a different number.
+NUM_RETRIES = 5
+
+# The first retry waits up to BACKOFF_BASE seconds, doubling with each
+# retry up to BACKOFF_MAX seconds. The actual wait is a random fraction
+# of that so concurrent callers don't retry in lockstep. A longer wait
+# asked for by the server is also capped at BACKOFF_MAX seconds.
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 32.0
+
+# Requests with these HTTP methods don't change anything, so they can be
+# retried even if an earlier attempt may have reached the server.
+IDEMPOTENT_HTTP_METHODS = {'GET', 'HEAD'}
+
+# The reasons given by 403 responses that mean a quota was exceeded
+# rather than that permission was denied.
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+
+class MethodMetrics:
+    """
+    The metrics recorded for calls to a single API method.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.errors = 0
+        self.throttled = 0
+        self.throttle_seconds = 0.0
+        self.backoff_seconds = 0.0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.statuses = collections.Counter()
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def to_dict(self):
+        """
+        Returns:
+            A JSON serializable dictionary of the metrics.
+        """
+        bounds = [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf']
+
+        return {
+            'calls': self.calls,
+            'attempts': self.attempts,
+            'retries': self.retries,
+            'errors': self.errors,
+            'throttled': self.throttled,
+            'throttle_seconds': self.throttle_seconds,
+            'backoff_seconds': self.backoff_seconds,
+            'total_seconds': self.total_seconds,
+            'avg_seconds': self.total_seconds / self.calls if self.calls else 0,
+            'max_seconds': self.max_seconds,
+            'statuses': {
+                str(status): count for status, count in self.statuses.items()
+            },
+            'latency_histogram': dict(zip(bounds, self.latency_buckets)),
+        }
+
+
+class ApiMetrics:
+    """
+    A thread safe collection of metrics for calls to Google APIs, keyed
+    by API method, eg ``cloudresourcemanager.projects.get``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.methods = {}
+
+    def record_call(
+            self,
+            method_id,
+            seconds,
+            statuses,
+            failed,
+            throttle_seconds=0.0,
+            backoff_seconds=0.0,
+    ):
+        """
+        Record a call to an API method.
+
+        Args:
+            method_id:
+                The ID of the API method that was called.
+            seconds:
+                The time the call took, including retries.
+            statuses:
+                A list of the HTTP status of each attempt, with
+                :data:`TRANSPORT_ERROR` for attempts without a response.
+            failed:
+                A boolean indicating if the call raised an error.
+            throttle_seconds:
+                The time the call waited for the API's rate limiter.
+            backoff_seconds:
+                The time the call waited between retries.
+        """
+        with self._lock:
+            metrics = self.methods.setdefault(method_id, MethodMetrics())
+            metrics.calls += 1
+            metrics.attempts += len(statuses)
+            metrics.retries += max(len(statuses) - 1, 0)
+            metrics.errors += int(failed)
+            metrics.throttled += int(throttle_seconds > 0)
+            metrics.throttle_seconds += throttle_seconds
+            metrics.backoff_seconds += backoff_seconds
+            metrics.total_seconds += seconds
+            metrics.max_seconds = max(metrics.max_seconds, seconds)
+            metrics.statuses.update(statuses)
+            metrics.latency_buckets[
+                bisect.bisect_left(LATENCY_BUCKETS, seconds)
+            ] += 1
+
+    def to_dict(self):
+        """
+        Returns:
+            A JSON serializable dictionary mapping method IDs to their
+            metrics.
+        """
+        with self._lock:
+            return {
+                method_id: metrics.to_dict()
+                for method_id, metrics in sorted(self.methods.items())
+            }
+
+    def print_report(self, file=None):
+        """
+        Print a summary of the recorded calls, slowest methods first.
+
+        Args:
+            file:
+                The file to print to. Defaults to stdout.
+        """
+        with self._lock:
+            methods = sorted(
+                self.methods.items(),
+                key=lambda item: item[1].total_seconds,
+                reverse=True,
+            )
+
+        if not methods:
+            return
+
+        total_calls = sum(metrics.calls for _, metrics in methods)
+        print(f"\nGoogle API calls ({total_calls} total):\n", file=file)
+        print(
+            f"  {'Method':<52} {'Calls':>6} {'Retries':>8} {'Avg':>8} "
+            f"{'Max':>8} {'Total':>8} {'Throttle':>9} {'Backoff':>8}  "
+            f"Statuses",
+            file=file,
+        )
+        for method_id, metrics in methods:
+            statuses = ', '.join(
+                f'{status}: {count}'
+                for status, count in sorted(
+                    metrics.statuses.items(), key=lambda item: str(item[0])
+                )
+            )
+            print(
+                f"  {method_id:<52} {metrics.calls:>6} {metrics.retries:>8} "
+                f"{metrics.total_seconds / metrics.calls:>7.3f}s "
+                f"{metrics.max_seconds:>7.3f}s "
+                f"{metrics.total_seconds:>7.2f}s "
+                f"{metrics.throttle_seconds:>8.2f}s "
+                f"{metrics.backoff_seconds:>7.2f}s  {statuses}",
+                file=file,
+            )
+
+    def write_json(self, path):
+        """
+        Write the recorded metrics to a JSON file.
+
+        Args:
+            path:
+                The path of the file to write.
+        """
+        path.parent.mkdir(exist_ok=True, parents=True)
+        with path.open('w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+class RateLimiter:
+    """
+    A thread safe token bucket limiting the rate of calls to an API.
+    """
+
+    def __init__(self, rate, burst):
+        """
+        Args:
+            rate:
+                The number of calls allowed per second.
+            burst:
+                The number of calls that can be made at once after the
+                API has been idle.
+        """
+        self.rate = rate
+        self.burst = burst
+
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def acquire(self):
+        """
+        Wait until a call can be made.
+
+        Returns:
+            The number of seconds spent waiting.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+
+            # Taking the token now, even if it's not available yet,
+            # reserves this caller's place in line.
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait:
+            time.sleep(wait)
+
+        return wait
+
+
+# The metrics recorded by every service built with :func:`build_service`.
+METRICS = ApiMetrics()
+
+# The rate limiter of each API, shared by every service built with
+# :func:`build_service`.
+RATE_LIMITERS = {}
+_rate_limiters_lock = threading.Lock()
+
+# The parsed discovery document of each API version. Parsing a document
+# is most of the time it takes to build a client, so each one is only
+# parsed once per process, or once per daemon.
+DISCOVERY_DOCUMENTS = {}
+_discovery_documents_lock = threading.Lock()
+
+
+class InstrumentedHttpRequest(googleapiclient.http.HttpRequest):
+    """
+    An API request that is rate limited per API, retries errors with
+    jittered exponential backoff, and records its latency, retries, and
+    response statuses in :data:`METRICS`.
+
+    Quota errors are retried for every request, since the server
+    rejected the request without acting on it. Server and connection
+    errors are only retried for reads, because a change that was made
+    before its response was lost must not be made twice.
+    """
+
+    def execute(self, http=None, num_retries=None):
+        if num_retries is None:
+            num_retries = NUM_RETRIES
+
+        limiter = get_rate_limiter(self.methodId.split('.')[0])
+        recording_http = _RecordingHttp(http or self.http)
+
+        start = time.monotonic()
+        throttle_seconds = 0.0
+        backoff_seconds = 0.0
+        failed = True
+        try:
+            for retry in range(num_retries + 1):
+                throttle_seconds += limiter.acquire()
+                try:
+                    response = super().execute(http=recording_http)
+                except Exception as e:
+                    if retry == num_retries or not _is_retryable(
+                            e, self.method in IDEMPOTENT_HTTP_METHODS
+                    ):
+                        raise
+
+                    delay = _backoff_delay(retry, e)
+                    time.sleep(delay)
+                    backoff_seconds += delay
+                else:
+                    failed = False
+
+                    return response
+        finally:
+            METRICS.record_call(
+                self.methodId,
+                time.monotonic() - start,
+                recording_http.statuses,
+                failed,
+                throttle_seconds=throttle_seconds,
+                backoff_seconds=backoff_seconds,
+            )
+
+
+def get_rate_limiter(api_name):
+    """
+    Get the rate limiter shared by all calls to an API.
+
+    Args:
+        api_name:
+            The name of the API, eg ``iam``.
+
+    Returns:
+        The API's :class:`RateLimiter`.
+    """
+    with _rate_limiters_lock:
+        if api_name not in RATE_LIMITERS:
+            rate = API_RATE_LIMITS.get(api_name, DEFAULT_RATE_LIMIT)
+            RATE_LIMITERS[api_name] = RateLimiter(
+                rate, max(DEFAULT_BURST, int(rate))
+            )
+
+        return RATE_LIMITERS[api_name]
+
+
+def set_rate_limit(api_name, rate):
+    """
+    Change the rate calls to an API are limited to.
+
+    Args:
+        api_name:
+            The name of the API, eg ``iam``.
+        rate:
+            The number of calls allowed per second.
+    """
+    if rate <= 0:
+        raise ValueError(f"The rate limit of '{api_name}' must be positive.")
+
+    with _rate_limiters_lock:
+        API_RATE_LIMITS[api_name] = rate
+        RATE_LIMITERS.pop(api_name, None)
+
+
+def build_service(api_name, version, google_credentials):
+    """
+    Build a client for a Google API whose calls are recorded in
+    :data:`METRICS`.
+
+    If ``ULTIDEPLOY_API_ENDPOINT`` is set, the client sends its calls to
+    ``<endpoint>/<api name>/`` instead of the API's real base URL.
+
+    Args:
+        api_name:
+            The name of the API, eg ``cloudresourcemanager``.
+        version:
+            The version of the API, eg ``v1``.
+        google_credentials:
+            The credentials to authenticate calls with.
+
+    Returns:
+        The API client.
+    """
+    client_options = None
+    endpoint = os.environ.get(ENDPOINT_VARIABLE)
+    if endpoint:
+        client_options = {
+            'api_endpoint': f"{endpoint.rstrip('/')}/{api_name}/",
+        }
+
+    document = load_discovery_document(api_name, version)
+    if document is None:
+        # APIs without a bundled document are discovered over the
+        # network.
+        return googleapiclient.discovery.build(
+            api_name,
+            version,
+            client_options=client_options,
+            credentials=google_credentials,
+            requestBuilder=InstrumentedHttpRequest,
+        )
+
+    return googleapiclient.discovery.build_from_document(
+        document,
+        client_options=client_options,
+        credentials=google_credentials,
+        requestBuilder=InstrumentedHttpRequest,
+    )
+
+
+def load_discovery_document(api_name, version):
+    """
+    Load the discovery document bundled with the API client library for
+    an API version, parsing it only the first time.
+
+    Args:
+        api_name:
+            The name of the API, eg ``cloudresourcemanager``.
+        version:
+            The version of the API, eg ``v1``.
+
+    Returns:
+        The parsed discovery document, or ``None`` if the library
+        doesn't include one.
+    """
+    key = (api_name, version)
+    with _discovery_documents_lock:
+        if key not in DISCOVERY_DOCUMENTS:
+            content = googleapiclient.discovery_cache.get_static_doc(
+                api_name, version
+            )
+            DISCOVERY_DOCUMENTS[key] = content and json.loads(content)
+
+        return DISCOVERY_DOCUMENTS[key]
+
+
+def _backoff_delay(retry, error):
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** retry))
+
+    # Respect the server if it says how long to wait, within reason.
+    if isinstance(error, googleapiclient.errors.HttpError):
+        try:
+            retry_after = float(error.resp.get('retry-after', 0))
+        except ValueError:
+            retry_after = 0
+        delay = max(delay, min(retry_after, BACKOFF_MAX))
+
+    return delay
+
+
+def _is_retryable(error, idempotent):
+    # httplib2 raises its own errors for failures such as DNS lookups
+    # that fail during a brief network outage.
+    if isinstance(
+            error,
+            (ConnectionError, socket.timeout, httplib2.HttpLib2Error),
+    ):
+        return idempotent
+    if not isinstance(error, googleapiclient.errors.HttpError):
+        return False
+
+    status = error.resp.status
+    if status == 429:
+        return True
+    if status >= 500:
+        return idempotent
+    if status != 403:
+        return False
+
+    try:
+        details = json.loads(error.content.decode('utf8'))['error']
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return False
+
+    reasons = {
+        item.get('reason') for item in details.get('errors') or []
+        if isinstance(item, dict)
+    }
+
+    return (
+        bool(reasons & RATE_LIMIT_REASONS)
+        or details.get('status') == 'RESOURCE_EXHAUSTED'
+    )
+
+
+class _RecordingHttp:
+    """
+    Wraps an HTTP transport to record the status of each attempt made
+    through it.
+    """
+
+    def __init__(self, http):
+        self._http = http
+        self.statuses = []
+
+    def __getattr__(self, name):
+        return getattr(self._http, name)
+
+    def request(self, *args, **kwargs):
+        try:
+            response, content = self._http.request(*args, **kwargs)
+        except Exception:
+            self.statuses.append(TRANSPORT_ERROR)
+            raise
+
+        self.statuses.append(response.status)
+
+        return response, content
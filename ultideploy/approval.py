@@ -0,0 +1,280 @@
+import fnmatch
+import json
+
+
+DECISION_APPROVE = 'approve'
+DECISION_PROMPT = 'prompt'
+DECISIONS = {DECISION_APPROVE, DECISION_PROMPT}
+
+# The kinds of change a rule can match. Terraform reports replacements
+# as a delete and a create of the same resource.
+CHANGE_KINDS = {'create', 'update', 'delete', 'replace'}
+
+RULE_KEYS = {'actions', 'decision', 'resource_types', 'steps'}
+
+
+class ApprovalPolicy:
+    """
+    Rules deciding which Terraform plans can be applied without asking a
+    person.
+
+    Each changed resource in a plan is matched against the rules in
+    order, and the first matching rule decides whether the change is
+    approved or needs a person. A plan is only approved automatically if
+    every change in it is.
+    """
+
+    def __init__(self, rules=None, default=DECISION_PROMPT, manual_steps=None):
+        """
+        Args:
+            rules:
+                A list of rules. Each rule is a dictionary with the
+                ``actions`` it matches, out of ``create``, ``update``,
+                ``delete``, and ``replace``, and the ``decision`` for
+                matching changes, either ``approve`` or ``prompt``. A
+                rule can be limited to ``resource_types``, which may use
+                shell-style wildcards, and to ``steps``.
+            default:
+                The decision for changes that match no rule.
+            manual_steps:
+                An optional dictionary mapping the names of steps that
+                wait for a person, such as ``link-github``, to the
+                decision for them.
+        """
+        self.rules = rules or []
+        self.default = default
+        self.manual_steps = manual_steps or {}
+
+        _validate(self.rules, self.default, self.manual_steps)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Load a policy from a JSON file.
+
+        Args:
+            path:
+                The path of the file with the ``rules``, ``default``, and
+                ``manual_steps`` of the policy.
+
+        Returns:
+            The loaded policy.
+
+        Raises:
+            ValueError:
+                If the file doesn't contain a valid policy.
+        """
+        with open(path) as f:
+            try:
+                data = json.load(f)
+            except ValueError as e:
+                raise ValueError(f"'{path}' is not valid JSON: {e}")
+
+        if not isinstance(data, dict):
+            raise ValueError(f"'{path}' must contain a JSON object.")
+
+        unknown = set(data) - {'default', 'manual_steps', 'rules'}
+        if unknown:
+            raise ValueError(
+                f"Unknown approval policy keys: {', '.join(sorted(unknown))}"
+            )
+
+        return cls(
+            rules=data.get('rules'),
+            default=data.get('default', DECISION_PROMPT),
+            manual_steps=data.get('manual_steps'),
+        )
+
+    def evaluate(self, step_name, plan):
+        """
+        Decide if a plan can be applied without asking a person.
+
+        Args:
+            step_name:
+                The name of the step applying the plan.
+            plan:
+                The plan as returned by ``terraform show -json``.
+
+        Returns:
+            A two-element tuple containing a boolean indicating if the
+            plan is approved and a list describing the changes that
+            need a person.
+        """
+        needs_person = []
+        for resource in plan.get('resource_changes', []):
+            kind = change_kind(resource['change']['actions'])
+            if kind is None:
+                continue
+
+            decision = self._decide(step_name, resource['type'], kind)
+            if decision != DECISION_APPROVE:
+                needs_person.append(f"{resource['address']} ({kind})")
+
+        return not needs_person, needs_person
+
+    def approves_manual_step(self, step_name):
+        """
+        Args:
+            step_name:
+                The name of a step that waits for a person.
+
+        Returns:
+            A boolean indicating if the step may continue without
+            waiting.
+        """
+        return self.manual_steps.get(step_name) == DECISION_APPROVE
+
+    def _decide(self, step_name, resource_type, kind):
+        for rule in self.rules:
+            if kind not in rule['actions']:
+                continue
+            if 'steps' in rule and step_name not in rule['steps']:
+                continue
+            if 'resource_types' in rule and not any(
+                    fnmatch.fnmatchcase(resource_type, pattern)
+                    for pattern in rule['resource_types']
+            ):
+                continue
+
+            return rule['decision']
+
+        return self.default
+
+
+class Approver:
+    """
+    Get approval for the steps of a deployment, either from an approval
+    policy or by asking a person.
+    """
+
+    def __init__(self, policy=None, interactive=True):
+        """
+        Args:
+            policy:
+                An optional :class:`ApprovalPolicy`. Without one, every
+                change needs a person.
+            interactive:
+                A boolean indicating if a person can be asked. If not,
+                anything the policy doesn't approve stops the deployment
+                instead of waiting for input.
+        """
+        self.policy = policy
+        self.interactive = interactive
+
+    def approve_plan(self, step, plan):
+        """
+        Decide if a step's plan should be applied.
+
+        Args:
+            step:
+                The step applying the plan.
+            plan:
+                The plan as returned by ``terraform show -json``.
+
+        Returns:
+            A boolean indicating if the plan should be applied.
+        """
+        if self.policy is not None:
+            approved, needs_person = self.policy.evaluate(step.name, plan)
+            if approved:
+                step.print_log("The plan was approved by the approval policy.")
+
+                return True
+
+            step.print_log("The approval policy requires a person to approve:")
+            for change in needs_person:
+                step.print_log(f"  - {change}")
+
+        if not self.interactive:
+            step.print_log(
+                "Not applying the plan without a person to approve it."
+            )
+
+            return False
+
+        return step.prompt_yes_no("Would you like to apply the above plan?")
+
+    def confirm_manual_step(self, step, instructions):
+        """
+        Wait for a person to complete a manual step.
+
+        Args:
+            step:
+                The step waiting for a person.
+            instructions:
+                The instructions for the person.
+
+        Returns:
+            A boolean indicating if the deployment should continue.
+        """
+        print(f"\n\n{instructions}")
+
+        if (
+                self.policy is not None
+                and self.policy.approves_manual_step(step.name)
+        ):
+            step.print_log("Continuing as allowed by the approval policy.")
+
+            return True
+
+        if not self.interactive:
+            step.print_log("Stopping since there is no person to do this.")
+
+            return False
+
+        input("\n\nPress enter to continue...")
+
+        return True
+
+
+def change_kind(actions):
+    """
+    Classify the actions Terraform plans for a resource.
+
+    Args:
+        actions:
+            The list of actions, eg ``["delete", "create"]``.
+
+    Returns:
+        One of ``create``, ``update``, ``delete``, or ``replace``, or
+        ``None`` if the resource won't change.
+    """
+    actions = set(actions)
+    if actions == {'create', 'delete'}:
+        return 'replace'
+    if len(actions) == 1:
+        action, = actions
+        if action in CHANGE_KINDS:
+            return action
+
+    return None
+
+
+def _validate(rules, default, manual_steps):
+    if not isinstance(rules, list):
+        raise ValueError("The approval policy's rules must be a list.")
+
+    for rule in rules:
+        unknown = set(rule) - RULE_KEYS
+        if unknown:
+            raise ValueError(
+                f"Unknown keys in approval rule {rule}: "
+                f"{', '.join(sorted(unknown))}"
+            )
+        if not set(rule.get('actions') or ['']) <= CHANGE_KINDS:
+            raise ValueError(
+                f"Approval rule {rule} must list actions out of "
+                f"{', '.join(sorted(CHANGE_KINDS))}."
+            )
+        if rule.get('decision') not in DECISIONS:
+            raise ValueError(
+                f"Approval rule {rule} must have a decision of "
+                f"{' or '.join(sorted(DECISIONS))}."
+            )
+
+    for decision in [default, *manual_steps.values()]:
+        if decision not in DECISIONS:
+            raise ValueError(
+                f"Invalid approval decision '{decision}'. Expected "
+                f"{' or '.join(sorted(DECISIONS))}."
+            )
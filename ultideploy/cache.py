@@ -1,7 +1,28 @@
+import os
 from pathlib import Path
 
 
-CACHE_DIRECTORY = Path.home() / '.ultideploy'
+def cache_directory(environ):
+    """
+    Get the cache directory configured by an environment.
+
+    The cache can be moved with the ``ULTIDEPLOY_CACHE_DIR`` environment
+    variable, eg to keep benchmark runs isolated from the real cache.
+
+    Args:
+        environ:
+            The environment variables, eg ``os.environ``.
+
+    Returns:
+        The path of the cache directory.
+    """
+    if environ.get('ULTIDEPLOY_CACHE_DIR'):
+        return Path(environ['ULTIDEPLOY_CACHE_DIR'])
+
+    return Path(environ.get('HOME') or Path.home()) / '.ultideploy'
+
+
+CACHE_DIRECTORY = cache_directory(os.environ)
 
 CREDENTIALS_CACHE = CACHE_DIRECTORY / 'credentials'
 
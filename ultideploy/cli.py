@@ -1,19 +1,81 @@
 #!/usr/bin/env python3
 import argparse
+import pathlib
 import sys
 
-from ultideploy import cache, commands
+from ultideploy import api, cache, commands
+from ultideploy.steps import InstallIstio
 
 
 def main():
     cache.init_cache()
 
     args = parse_args()
-    args.func(args)
+    for api_name, rate in args.api_rate_limit:
+        api.set_rate_limit(api_name, rate)
+    if args.api_retries is not None:
+        api.NUM_RETRIES = args.api_retries
+
+    try:
+        args.func(args)
+    finally:
+        report_api_metrics(args)
+
+
+def report_api_metrics(args):
+    """
+    Print a summary of the Google API calls made during the run to
+    stderr and write the full metrics to a JSON file.
+
+    The summary goes to stderr so it never mixes with output that
+    commands write to stdout, such as the drift report.
+
+    Args:
+        args:
+            The parsed CLI arguments.
+    """
+    if not api.METRICS.methods:
+        return
+
+    api.METRICS.print_report(file=sys.stderr)
+
+    if args.api_metrics:
+        metrics_path = pathlib.Path(args.api_metrics)
+    else:
+        metrics_path = cache.get_cache_location('metrics', 'api.json')
+    api.METRICS.write_json(metrics_path)
+
+    print(f"\nWrote API metrics to {metrics_path}", file=sys.stderr)
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--api-metrics",
+        help=(
+            "The file to write metrics about the Google API calls made "
+            "during the run to. Defaults to '~/.ultideploy/metrics/api.json'."
+        ),
+    )
+    parser.add_argument(
+        "--api-rate-limit",
+        action='append',
+        default=[],
+        help=(
+            "The number of calls per second allowed to a Google API, given as "
+            "'<api>=<rate>', eg 'iam=20'. Can be given multiple times."
+        ),
+        metavar="API=RATE",
+        type=parse_rate_limit,
+    )
+    parser.add_argument(
+        "--api-retries",
+        help=(
+            "The number of times a Google API call is retried after a quota "
+            f"or server error. Defaults to {api.NUM_RETRIES}."
+        ),
+        type=int,
+    )
     parser.set_defaults(func=default_command)
 
     subparsers = parser.add_subparsers()
@@ -37,10 +99,131 @@ def parse_args():
     )
     bootstrap_parser.set_defaults(func=commands.bootstrap)
 
+    bench_parser = subparsers.add_parser(
+        "bench",
+        description=(
+            "Run an HTTP load test and write the results as Fortio JSON. "
+            "Use '--local' to run against a local stand-in server."
+        ),
+        help="Load test an ingress.",
+    )
+    bench_parser.add_argument(
+        "url",
+        nargs="?",
+        help=(
+            "The URL to load test. With '--local', only the path is used."
+        ),
+    )
+    bench_parser.add_argument(
+        "-c",
+        "--connections",
+        default=8,
+        type=int,
+        help="The number of concurrent connections. Defaults to 8.",
+    )
+    bench_parser.add_argument(
+        "-l",
+        "--labels",
+        help=(
+            "The labels describing the test, eg 'baseline fortio1 echo2'. "
+            "Defaults to 'bench ultideploy <host>'."
+        ),
+    )
+    bench_parser.add_argument(
+        "--local",
+        action="store_true",
+        default=False,
+        help="Run against a local stand-in server instead of a real URL.",
+    )
+    bench_parser.add_argument(
+        "--local-redirect",
+        action="store_true",
+        default=False,
+        help=(
+            "Have the local stand-in server answer like the HTTPS redirect "
+            "service."
+        ),
+    )
+    bench_parser.add_argument(
+        "-o",
+        "--output",
+        default=".",
+        help=(
+            "The file or directory to write the results to. Defaults to "
+            "the current directory."
+        ),
+    )
+    bench_parser.add_argument(
+        "-q",
+        "--qps",
+        default=0,
+        type=float,
+        help=(
+            "The total number of requests per second to send. Defaults to "
+            "0, which sends requests as fast as possible."
+        ),
+    )
+    bench_parser.add_argument(
+        "-t",
+        "--duration",
+        default="30s",
+        help="How long to run the test for, eg '30s' or '1m'. Defaults to 30s.",
+    )
+    bench_parser.add_argument(
+        "--timeout",
+        default=10.0,
+        type=float,
+        help="The number of seconds to wait for each response. Defaults to 10.",
+    )
+    bench_parser.set_defaults(func=commands.bench)
+
+    bench_bootstrap_parser = subparsers.add_parser(
+        "bench-bootstrap",
+        description=(
+            "Time the bootstrap command against a local fake of the Google "
+            "APIs it uses, both from scratch and when everything already "
+            "exists, and report the requests made to each API method."
+        ),
+        help="Benchmark bootstrap against fake Google APIs.",
+    )
+    bench_bootstrap_parser.add_argument(
+        "-n",
+        "--runs",
+        default=3,
+        type=int,
+        help="The number of times to run each scenario. Defaults to 3.",
+    )
+    bench_bootstrap_parser.add_argument(
+        "-o",
+        "--output",
+        help="The file to write the results of every run to as JSON.",
+    )
+    add_fake_gcp_arguments(bench_bootstrap_parser)
+    bench_bootstrap_parser.set_defaults(func=commands.bench_bootstrap)
+
+    daemon_parser = subparsers.add_parser(
+        "daemon",
+        description=(
+            "Run a daemon that keeps modules, API discovery documents, "
+            "credentials, and initialized Terraform working directories "
+            "warm. While it is running, other invocations of the CLI run "
+            "their commands in it. Set ULTIDEPLOY_NO_DAEMON=1 to bypass it."
+        ),
+        help="Run commands from a warm, long-running process.",
+    )
+    daemon_parser.set_defaults(func=commands.daemon)
+
     deploy_parser = subparsers.add_parser(
         "deploy",
         help="Deploy the UltiManager infrastructure."
     )
+    deploy_parser.add_argument(
+        "--approval-policy",
+        help=(
+            "A JSON file with the rules deciding which Terraform changes "
+            "are applied without asking."
+        ),
+    )
     deploy_parser.add_argument(
         "-d",
         "--destroy",
@@ -48,6 +231,40 @@ def parse_args():
         default=False,
         help="Destroy the resources that are currently deployed."
     )
+    deploy_parser.add_argument(
+        "--istio-clusters",
+        help=(
+            "A JSON file listing additional clusters to install Istio in "
+            "alongside the cluster created by the deployment."
+        ),
+    )
+    deploy_parser.add_argument(
+        "--non-interactive",
+        action='store_true',
+        default=False,
+        help=(
+            "Never wait for input. Changes that the approval policy doesn't "
+            "approve stop the deployment."
+        ),
+    )
+    deploy_parser.add_argument(
+        "--pass-outputs",
+        action='store_true',
+        default=False,
+        help=(
+            "Pass the outputs of earlier steps to later steps as Terraform "
+            "variables instead of reading them from the remote state."
+        ),
+    )
+    deploy_parser.add_argument(
+        "--skip-preflight",
+        action='store_true',
+        default=False,
+        help=(
+            "Don't check that the required tools are installed and new "
+            "enough before deploying."
+        ),
+    )
     deploy_parser.add_argument(
         "organization_id",
         help=(
@@ -58,9 +275,353 @@ def parse_args():
     )
     deploy_parser.set_defaults(func=commands.deploy)
 
+    drift_parser = subparsers.add_parser(
+        "drift",
+        description=(
+            "Plan every Terraform configuration concurrently without "
+            "applying anything and print a JSON report of the drift. Exits "
+            "with 0 if nothing drifted, 2 if anything drifted, and 1 if a "
+            "plan failed."
+        ),
+        help="Check the deployed infrastructure for drift.",
+    )
+    drift_parser.add_argument(
+        "organization_id",
+        help=(
+            "The ID of the main UltiManager organization in GCP. This can be "
+            "discovered with 'gcloud organizations list'"
+        ),
+        metavar="organization-id"
+    )
+    drift_parser.add_argument(
+        "-o",
+        "--output",
+        help="The file to write the report to. Defaults to stdout.",
+    )
+    drift_parser.set_defaults(func=commands.drift)
+
+    fake_gcp_parser = subparsers.add_parser(
+        "fake-gcp",
+        description=(
+            "Serve a local fake of the Google APIs used by bootstrap. Set "
+            "ULTIDEPLOY_API_ENDPOINT to the printed endpoint to run other "
+            "commands against it."
+        ),
+        help="Serve fake Google APIs locally.",
+    )
+    fake_gcp_parser.add_argument(
+        "-p",
+        "--port",
+        default=8085,
+        type=int,
+        help="The port to listen on. Defaults to 8085.",
+    )
+    add_fake_gcp_arguments(fake_gcp_parser)
+    fake_gcp_parser.set_defaults(func=commands.fake_gcp)
+
+    perf_parser = subparsers.add_parser(
+        "perf",
+        help="Analyze Fortio load test results."
+    )
+    perf_parser.set_defaults(func=default_command)
+    perf_subparsers = perf_parser.add_subparsers()
+
+    perf_convert_parser = perf_subparsers.add_parser(
+        "convert",
+        description=(
+            "Convert a directory of Fortio JSON results into CSV, or into "
+            "a compact binary columnar format."
+        ),
+        help="Convert Fortio results to CSV or a columnar format.",
+    )
+    perf_convert_parser.add_argument(
+        "directory",
+        help="The directory containing the Fortio JSON results.",
+    )
+    perf_convert_parser.add_argument(
+        "-f",
+        "--format",
+        choices=["csv", "npz"],
+        default="csv",
+        help="The output format. Defaults to 'csv'.",
+    )
+    perf_convert_parser.add_argument(
+        "-g",
+        "--group",
+        action="store_true",
+        default=False,
+        help=(
+            "Aggregate results by label, QPS, and client count by merging "
+            "their duration histograms."
+        ),
+    )
+    perf_convert_parser.add_argument(
+        "-o",
+        "--output",
+        help="The file to write to. Defaults to stdout for CSV output.",
+    )
+    perf_convert_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="The number of processes to parse results with.",
+    )
+    perf_convert_parser.set_defaults(func=commands.perf_convert)
+
+    perf_compare_parser = perf_subparsers.add_parser(
+        "compare",
+        description=(
+            "Compare two directories of Fortio JSON results, aligned by "
+            "label, QPS, and client count. Exits with a non-zero status if "
+            "latency or throughput regressed past the thresholds."
+        ),
+        help="Compare two sets of Fortio results.",
+    )
+    perf_compare_parser.add_argument(
+        "baseline",
+        help="The directory containing the baseline results.",
+    )
+    perf_compare_parser.add_argument(
+        "candidate",
+        help="The directory containing the candidate results.",
+    )
+    perf_compare_parser.add_argument(
+        "--latency-threshold",
+        default=10.0,
+        type=float,
+        help=(
+            "The percent increase in a latency metric considered a "
+            "regression. Defaults to 10."
+        ),
+    )
+    perf_compare_parser.add_argument(
+        "--throughput-threshold",
+        default=5.0,
+        type=float,
+        help=(
+            "The percent decrease in throughput considered a regression. "
+            "Defaults to 5."
+        ),
+    )
+    perf_compare_parser.add_argument(
+        "--metrics",
+        type=lambda value: value.split(","),
+        help=(
+            "A comma separated list of the metrics to compare. Defaults to "
+            "avg, the percentiles, and actual_qps."
+        ),
+    )
+    perf_compare_parser.add_argument(
+        "--iterations",
+        default=2000,
+        type=int,
+        help="The number of bootstrap resamples. Defaults to 2000.",
+    )
+    perf_compare_parser.add_argument(
+        "--confidence",
+        default=0.95,
+        type=float,
+        help="The confidence level of the intervals. Defaults to 0.95.",
+    )
+    perf_compare_parser.add_argument(
+        "--seed",
+        type=int,
+        help="A seed for the bootstrap resampling.",
+    )
+    perf_compare_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="The number of processes to parse results with.",
+    )
+    perf_compare_parser.set_defaults(func=commands.perf_compare)
+
+    perf_ingest_parser = perf_subparsers.add_parser(
+        "ingest",
+        description=(
+            "Ingest a directory of Fortio JSON results into the local "
+            "history store. Only new or changed files are parsed."
+        ),
+        help="Add Fortio results to the local history store.",
+    )
+    perf_ingest_parser.add_argument(
+        "directory",
+        help="The directory containing the Fortio JSON results.",
+    )
+    perf_ingest_parser.add_argument(
+        "--database",
+        help="The history store to use. Defaults to one in the cache.",
+    )
+    perf_ingest_parser.add_argument(
+        "--istio-version",
+        default=InstallIstio.ISTIO_VERSION,
+        help=(
+            "The Istio version the results were measured against. Defaults "
+            "to the version that is deployed."
+        ),
+    )
+    perf_ingest_parser.set_defaults(func=commands.perf_ingest)
+
+    perf_trend_parser = perf_subparsers.add_parser(
+        "trend",
+        description=(
+            "Show a metric for a label across the most recent runs in the "
+            "local history store."
+        ),
+        help="Show the history of a metric for a label.",
+    )
+    perf_trend_parser.add_argument(
+        "label",
+        help="The label of the runs to show.",
+    )
+    perf_trend_parser.add_argument(
+        "--clients",
+        type=int,
+        help="Only show runs with this many clients.",
+    )
+    perf_trend_parser.add_argument(
+        "--database",
+        help="The history store to use. Defaults to one in the cache.",
+    )
+    perf_trend_parser.add_argument(
+        "--istio-version",
+        help="Only show runs against this Istio version.",
+    )
+    perf_trend_parser.add_argument(
+        "--last",
+        default=30,
+        type=int,
+        help="The number of most recent runs to show. Defaults to 30.",
+    )
+    perf_trend_parser.add_argument(
+        "-m",
+        "--metric",
+        default="p99",
+        help="The metric to show. Defaults to 'p99'.",
+    )
+    perf_trend_parser.add_argument(
+        "--qps",
+        help="Only show runs with this requested QPS.",
+    )
+    perf_trend_parser.set_defaults(func=commands.perf_trend)
+
+    timings_parser = subparsers.add_parser(
+        "timings",
+        description=(
+            "Report the slowest resources and the critical path through the "
+            "Terraform graph of each step's recorded applies."
+        ),
+        help="Show where Terraform applies spend their time.",
+    )
+    timings_parser.add_argument(
+        "-d",
+        "--destroy",
+        action="store_true",
+        default=False,
+        help="Report on recorded destroys instead of applies.",
+    )
+    timings_parser.add_argument(
+        "-s",
+        "--step",
+        help="Only report on this step, eg 'cluster'.",
+    )
+    timings_parser.add_argument(
+        "--top",
+        default=10,
+        type=int,
+        help="The number of slowest resources to show. Defaults to 10.",
+    )
+    timings_parser.set_defaults(func=commands.timings)
+
     return parser.parse_args()
 
 
+def add_fake_gcp_arguments(parser):
+    """
+    Add the arguments configuring the fake Google APIs to a parser.
+
+    Args:
+        parser:
+            The parser to add the arguments to.
+    """
+    parser.add_argument(
+        "--error-rate",
+        default=0.0,
+        type=float,
+        help="The fraction of requests to fail. Defaults to 0.",
+    )
+    parser.add_argument(
+        "--error-status",
+        default=503,
+        type=int,
+        help="The HTTP status of failed requests. Defaults to 503.",
+    )
+    parser.add_argument(
+        "--latency",
+        default=0.0,
+        type=float,
+        help=(
+            "The number of seconds to wait before answering each request. "
+            "Defaults to 0."
+        ),
+    )
+    parser.add_argument(
+        "--operation-delay",
+        default=0.0,
+        type=float,
+        help=(
+            "The number of seconds long running operations take to "
+            "complete. Defaults to 0."
+        ),
+    )
+    parser.add_argument(
+        "--page-size",
+        default=100,
+        type=int,
+        help="The maximum number of items in each page. Defaults to 100.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="A seed for choosing which requests fail.",
+    )
+    parser.add_argument(
+        "--service-accounts",
+        default=0,
+        type=int,
+        help=(
+            "The number of unrelated service accounts each project starts "
+            "with. Defaults to 0."
+        ),
+    )
+
+
+def parse_rate_limit(value):
+    """
+    Parse a rate limit given on the command line.
+
+    Args:
+        value:
+            The rate limit, eg ``iam=20``.
+
+    Returns:
+        A two-element tuple containing the name of the API and the
+        number of calls per second allowed to it.
+    """
+    api_name, _, rate = value.partition('=')
+    try:
+        rate = float(rate)
+    except ValueError:
+        rate = 0
+
+    if not api_name or rate <= 0:
+        raise argparse.ArgumentTypeError(
+            f"'{value}' is not a positive rate limit like 'iam=20'."
+        )
+
+    return api_name, rate
+
+
 def default_command(_):
     print("\nError: A subcommand is required.")
     sys.exit(1)
@@ -1,2 +1,7 @@
 from .bootstrap import bootstrap
+from .daemon import daemon
 from .deploy import deploy
+from .drift import drift
+from .fake_gcp import bench_bootstrap, fake_gcp
+from .perf import bench, perf_compare, perf_convert, perf_ingest, perf_trend
+from .timings import timings
@@ -1,8 +1,6 @@
 import sys
 
-import googleapiclient.discovery
-
-from ultideploy import constants, credentials, resources
+from ultideploy import api, constants, credentials, resources
 
 
 def bootstrap(args):
@@ -12,10 +10,8 @@ def bootstrap(args):
         f"organizations/{args.organization_id}", google_credentials
     )
 
-    projects_service = googleapiclient.discovery.build(
-        'cloudresourcemanager',
-        'v1',
-        credentials=google_credentials
+    projects_service = api.build_service(
+        'cloudresourcemanager', 'v1', google_credentials
     )
 
     print(f"Looking for existing '{constants.TERRAFORM_ADMIN_PROJECT_ID}' project...")
@@ -0,0 +1,13 @@
+from ultideploy.daemon import SOCKET_PATH, serve
+
+
+def daemon(args):
+    """
+    Run the daemon that other invocations of the CLI hand their commands
+    to.
+
+    Args:
+        args:
+            The parsed CLI arguments.
+    """
+    serve(SOCKET_PATH)
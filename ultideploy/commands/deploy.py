@@ -1,9 +1,24 @@
+import getpass
+import hashlib
+import json
 import os
 import pathlib
 import sys
 
-from ultideploy import constants, credentials, resources
-from ultideploy.steps import InstallIstio, LinkGithub, TerraformStep
+from ultideploy import (
+    approval,
+    constants,
+    credentials,
+    preflight,
+    resources,
+    runqueue,
+)
+from ultideploy.steps import (
+    EnableProjectServices,
+    InstallIstio,
+    LinkGithub,
+    TerraformStep,
+)
 
 
 PROJECT_ROOT = pathlib.Path(__file__).parents[2]
@@ -14,6 +29,49 @@ TERRAFORM_K8S_CONFIG = PROJECT_ROOT / 'terraform' / 'k8s'
 TERRAFORM_NETWORK_CONFIG = PROJECT_ROOT / 'terraform' / 'network'
 TERRAFORM_PROJECT_CONFIG = PROJECT_ROOT / 'terraform' / 'project'
 
+# The exit status of a deployment stopped by a step, eg because a plan
+# wasn't approved, so it's never mistaken for a finished deployment.
+STOPPED_EXIT_STATUS = 3
+
+# The tools run by a deployment. Destroying only runs Terraform since
+# Istio is removed along with its cluster.
+DEPLOY_TOOLS = ['terraform', 'gcloud', 'kubectl', 'helm']
+DESTROY_TOOLS = ['terraform']
+
+# The Terraform variables of each step that can be passed the outputs of
+# previous steps instead of reading the previous steps' remote state.
+STEP_INPUTS = {
+    "network": {
+        "project": {"root_project_id": "root_project_id"},
+    },
+    "database": {
+        "network": {"vpc_self_link": "vpc_self_link"},
+        "project": {"root_project_id": "root_project_id"},
+    },
+    "cluster": {
+        "network": {"vpc_name": "vpc_name"},
+        "project": {
+            "root_project_id": "root_project_id",
+            "root_project_number": "root_project_number",
+        },
+    },
+    "k8s": {
+        "cluster": {
+            "cluster_auth_ca_certificate": "cluster_auth_ca_certificate",
+            "cluster_auth_certificate": "cluster_auth_certificate",
+            "cluster_auth_key": "cluster_auth_key",
+            "cluster_host": "cluster_host",
+            "cluster_state_repo_url": "cluster_state_repo_url",
+            "flux_service_account_email": "flux_service_account_email",
+        },
+        "database": {
+            "db_admin_name": "admin_name",
+            "db_admin_password": "admin_password",
+            "db_private_ip_address": "db_private_ip_address",
+        },
+    },
+}
+
 
 def deploy(args):
     """
@@ -23,42 +81,80 @@ def deploy(args):
         args:
             The parsed CLI arguments.
     """
-    google_creds = credentials.google_service_account_credentials(
-        constants.TERRAFORM_SERVICE_ACCOUNT_ID
-    )
-    billing_account = resources.get_billing_account(google_creds)
+    if not args.skip_preflight:
+        tools = DESTROY_TOOLS if args.destroy else DEPLOY_TOOLS
+        if not preflight.print_report(preflight.check_tools(tools)):
+            sys.exit(1)
+        print()
 
-    subprocess_env = os.environ.copy()
-    subprocess_env['GOOGLE_APPLICATION_CREDENTIALS'] = credentials.google_service_account_credentials_path(
-        constants.TERRAFORM_SERVICE_ACCOUNT_ID
+    approver = load_approver(args.approval_policy, args.non_interactive)
+    istio_clusters = load_istio_clusters(args.istio_clusters)
+
+    # Runs for the same organization take turns, since they would fight
+    # over Terraform's state locks and the clusters.
+    queue = runqueue.RunQueue.for_name(args.organization_id)
+    exit_status = queue.run(
+        run_inputs(args, istio_clusters),
+        lambda: run_deployment(args, approver, istio_clusters),
+        # A person answering prompts could decide differently for each
+        # run, so only unattended runs share a result.
+        coalesce=args.non_interactive,
     )
-    subprocess_env['TF_VAR_billing_account'] = billing_account.get('name')
-    subprocess_env['TF_VAR_dns_project_id'] = constants.DNS_PROJECT_ID
-    subprocess_env['TF_VAR_organization_id'] = args.organization_id
-    subprocess_env['TF_VAR_root_domain'] = constants.ROOT_DOMAIN
+    if exit_status:
+        sys.exit(exit_status)
+
+
+def run_deployment(args, approver, istio_clusters):
+    """
+    Run the steps of a deployment, or of a destroy.
+
+    Args:
+        args:
+            The parsed CLI arguments.
+        approver:
+            The :class:`ultideploy.approval.Approver` deciding which
+            changes are applied.
+        istio_clusters:
+            The descriptors of additional clusters to install Istio in.
+    """
+    subprocess_env = terraform_environment(args.organization_id)
+
+    step_inputs = STEP_INPUTS if args.pass_outputs else {}
 
     steps = [
+        EnableProjectServices(
+            TERRAFORM_PROJECT_CONFIG, "project", env=subprocess_env
+        ),
         TerraformStep(
             "project",
             TERRAFORM_PROJECT_CONFIG,
+            approver=approver,
             env=subprocess_env,
-            outputs=["root_project.id"],
+            outputs=["root_project.id", "root_project.number"],
         ),
-        LinkGithub(),
+        LinkGithub(approver=approver),
         TerraformStep(
             "network",
             TERRAFORM_NETWORK_CONFIG,
+            approver=approver,
             env=subprocess_env,
+            inputs=step_inputs.get("network"),
+            outputs=["vpc.name", "vpc.self_link"],
         ),
         TerraformStep(
             "database",
             TERRAFORM_DATABASE_CONFIG,
+            approver=approver,
             env=subprocess_env,
+            inputs=step_inputs.get("database"),
+            outputs=["admin.name", "admin.password", "db.private_ip_address"],
         ),
         TerraformStep(
             "cluster",
             TERRAFORM_CLUSTER_CONFIG,
+            approver=approver,
             env=subprocess_env,
+            inputs=step_inputs.get("cluster"),
             outputs=[
                 "api_domain",
                 "cluster_address.address",
@@ -68,11 +164,19 @@ def deploy(args):
                 "cluster_host",
                 "cluster_name",
                 "cluster_region",
+                "cluster_state_repo_url",
+                "flux_service_account.email",
                 "root_domain",
             ]
         ),
-        InstallIstio(),
-        TerraformStep("k8s", TERRAFORM_K8S_CONFIG, subprocess_env),
+        InstallIstio(clusters=istio_clusters),
+        TerraformStep(
+            "k8s",
+            TERRAFORM_K8S_CONFIG,
+            approver=approver,
+            env=subprocess_env,
+            inputs=step_inputs.get("k8s"),
+        ),
     ]
 
     if args.destroy:
@@ -87,6 +191,146 @@ def deploy(args):
 
         if not should_continue:
             print(f"\n\nStep '{step.name}' stopped execution. Exiting.")
-            sys.exit(0)
+            sys.exit(STOPPED_EXIT_STATUS)
 
         step_results[step.name] = results or {}
+
+
+def configuration_digest():
+    """
+    Compute a digest of the Terraform configurations and Istio values
+    that a deployment applies.
+
+    Returns:
+        The hex digest of the configuration files.
+    """
+    digest = hashlib.sha256()
+
+    terraform_root = PROJECT_ROOT / 'terraform'
+    for root, dirs, files in os.walk(terraform_root):
+        dirs[:] = sorted(d for d in dirs if d != '.terraform')
+        for file_name in sorted(files):
+            path = pathlib.Path(root) / file_name
+            digest.update(str(path.relative_to(terraform_root)).encode())
+            digest.update(path.read_bytes())
+
+    for path in sorted((PROJECT_ROOT / 'istio').glob('*.yaml')):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+
+    return digest.hexdigest()
+
+
+def load_approver(policy_path, non_interactive):
+    """
+    Build the approver deciding which changes are applied without asking
+    a person.
+
+    Args:
+        policy_path:
+            The path of an approval policy file, or ``None`` to ask a
+            person about every change.
+        non_interactive:
+            A boolean indicating if the deployment should stop rather
+            than wait for a person.
+
+    Returns:
+        The :class:`ultideploy.approval.Approver` to give the steps.
+    """
+    policy = None
+    if policy_path:
+        try:
+            policy = approval.ApprovalPolicy.from_file(policy_path)
+        except (OSError, ValueError) as e:
+            print(f"\nError: Could not load the approval policy: {e}")
+            sys.exit(1)
+
+    return approval.Approver(policy, interactive=not non_interactive)
+
+
+def load_istio_clusters(path):
+    """
+    Load the descriptors of additional clusters to install Istio in.
+
+    Args:
+        path:
+            The path of a JSON file containing a list of cluster
+            descriptors, or ``None``.
+
+    Returns:
+        The list of cluster descriptors, which is empty if no file was
+        given.
+    """
+    if not path:
+        return []
+
+    with open(path) as f:
+        clusters = json.load(f)
+
+    if not isinstance(clusters, list):
+        print(f"\nError: '{path}' must contain a list of clusters.")
+        sys.exit(1)
+
+    return clusters
+
+
+def run_inputs(args, istio_clusters):
+    """
+    Describe everything that determines what a deployment does, so that
+    queued deployments with identical inputs can be coalesced.
+
+    Args:
+        args:
+            The parsed CLI arguments.
+        istio_clusters:
+            The descriptors of additional clusters to install Istio in.
+
+    Returns:
+        A JSON serializable dictionary of the deployment's inputs.
+    """
+    approval_policy = None
+    if args.approval_policy:
+        approval_policy = pathlib.Path(args.approval_policy).read_text()
+
+    return {
+        'approval_policy': approval_policy,
+        'configuration': configuration_digest(),
+        'destroy': args.destroy,
+        'istio_clusters': istio_clusters,
+        'non_interactive': args.non_interactive,
+        'organization_id': args.organization_id,
+        'pass_outputs': args.pass_outputs,
+        'user': getpass.getuser(),
+    }
+
+
+def terraform_environment(organization_id):
+    """
+    Build the environment that Terraform is run with.
+
+    Args:
+        organization_id:
+            The ID of the main UltiManager organization in GCP.
+
+    Returns:
+        A copy of the current environment with the Terraform service
+        account's credentials and the variables shared by every
+        Terraform configuration.
+    """
+    google_creds = credentials.google_service_account_credentials(
+        constants.TERRAFORM_SERVICE_ACCOUNT_ID
+    )
+    billing_account = resources.get_billing_account(google_creds)
+
+    subprocess_env = os.environ.copy()
+    subprocess_env['GOOGLE_APPLICATION_CREDENTIALS'] = str(
+        credentials.google_service_account_credentials_path(
+            constants.TERRAFORM_SERVICE_ACCOUNT_ID
+        )
+    )
+    subprocess_env['TF_VAR_billing_account'] = billing_account.get('name')
+    subprocess_env['TF_VAR_dns_project_id'] = constants.DNS_PROJECT_ID
+    subprocess_env['TF_VAR_organization_id'] = organization_id
+    subprocess_env['TF_VAR_root_domain'] = constants.ROOT_DOMAIN
+
+    return subprocess_env
@@ -0,0 +1,188 @@
+import concurrent.futures
+import contextlib
+import datetime
+import json
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+
+from .deploy import (
+    TERRAFORM_CLUSTER_CONFIG,
+    TERRAFORM_DATABASE_CONFIG,
+    TERRAFORM_K8S_CONFIG,
+    TERRAFORM_NETWORK_CONFIG,
+    TERRAFORM_PROJECT_CONFIG,
+    terraform_environment,
+)
+from ultideploy.steps import terraform_step
+
+
+# The Terraform configurations checked for drift, in deployment order.
+TERRAFORM_CONFIGS = {
+    "project": TERRAFORM_PROJECT_CONFIG,
+    "network": TERRAFORM_NETWORK_CONFIG,
+    "database": TERRAFORM_DATABASE_CONFIG,
+    "cluster": TERRAFORM_CLUSTER_CONFIG,
+    "k8s": TERRAFORM_K8S_CONFIG,
+}
+
+# The exit codes of "terraform plan -detailed-exitcode".
+PLAN_NO_CHANGES = 0
+PLAN_HAS_CHANGES = 2
+
+# Plans also list resources that won't change or data sources that will
+# only be read.
+IGNORED_ACTIONS = {'no-op', 'read'}
+
+STATUS_DRIFTED = 'drifted'
+STATUS_ERROR = 'error'
+STATUS_IN_SYNC = 'in-sync'
+
+
+def drift(args):
+    """
+    Check every Terraform configuration for drift from the deployed
+    infrastructure without applying anything.
+
+    The configurations are planned concurrently and a JSON report is
+    written to stdout or the given output file. The exit status is 0 if
+    nothing drifted, 2 if any configuration drifted, and 1 if any plan
+    failed.
+
+    Args:
+        args:
+            The parsed CLI arguments.
+    """
+    # Progress messages go to stderr so stdout only carries the report.
+    with contextlib.redirect_stdout(sys.stderr):
+        subprocess_env = terraform_environment(args.organization_id)
+
+    started = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(TERRAFORM_CONFIGS)
+    ) as executor:
+        futures = {
+            name: executor.submit(
+                check_drift, name, configuration_directory, subprocess_env
+            )
+            for name, configuration_directory in TERRAFORM_CONFIGS.items()
+        }
+        stacks = {name: future.result() for name, future in futures.items()}
+
+    statuses = {stack['status'] for stack in stacks.values()}
+    report = {
+        'checked_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'duration': round(time.monotonic() - started, 3),
+        'drifted': STATUS_DRIFTED in statuses,
+        'error': STATUS_ERROR in statuses,
+        'stacks': stacks,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if report['error']:
+        sys.exit(1)
+    if report['drifted']:
+        sys.exit(2)
+
+
+def check_drift(name, configuration_directory, env):
+    """
+    Plan a Terraform configuration and report whether it has drifted.
+
+    The configuration is only initialized if it has not been initialized
+    for its current configuration and dependency lock file. Plans
+    neither take the state lock nor prompt for input.
+
+    Args:
+        name:
+            The name of the configuration.
+        configuration_directory:
+            The directory containing the configuration.
+        env:
+            The environment to run Terraform with.
+
+    Returns:
+        A dictionary describing the configuration's status, how long the
+        check took, and the resources that would change.
+    """
+    started = time.monotonic()
+    print(f"[{name}] Checking for drift...", file=sys.stderr)
+
+    def result(status, **details):
+        duration = round(time.monotonic() - started, 3)
+        print(f"[{name}] {status} ({duration}s)", file=sys.stderr)
+
+        return {'status': status, 'duration': duration, **details}
+
+    try:
+        if not terraform_step.is_initialized(configuration_directory):
+            _run_terraform(
+                ['init', '-input=false'], configuration_directory, env
+            )
+            terraform_step.mark_initialized(configuration_directory)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            plan_file = pathlib.Path(temp_dir) / 'plan'
+
+            plan = subprocess.run(
+                [
+                    'terraform',
+                    'plan',
+                    '-detailed-exitcode',
+                    '-input=false',
+                    '-lock=false',
+                    '-no-color',
+                    '-out',
+                    plan_file,
+                ],
+                cwd=configuration_directory,
+                encoding='utf8',
+                env=env,
+                stderr=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+            )
+
+            if plan.returncode == PLAN_NO_CHANGES:
+                return result(STATUS_IN_SYNC, changes=[])
+
+            if plan.returncode != PLAN_HAS_CHANGES:
+                return result(STATUS_ERROR, error=plan.stderr.strip())
+
+            shown = _run_terraform(
+                ['show', '-json', plan_file], configuration_directory, env
+            )
+    except subprocess.CalledProcessError as e:
+        return result(STATUS_ERROR, error=(e.stderr or '').strip())
+    except OSError as e:
+        return result(STATUS_ERROR, error=str(e))
+
+    changes = [
+        {
+            'address': resource['address'],
+            'actions': resource['change']['actions'],
+        }
+        for resource in json.loads(shown).get('resource_changes', [])
+        if not set(resource['change']['actions']) <= IGNORED_ACTIONS
+    ]
+
+    return result(STATUS_DRIFTED, changes=changes)
+
+
+def _run_terraform(args, configuration_directory, env):
+    return subprocess.run(
+        ['terraform', *args],
+        check=True,
+        cwd=configuration_directory,
+        encoding='utf8',
+        env=env,
+        stderr=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    ).stdout
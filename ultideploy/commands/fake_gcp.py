@@ -0,0 +1,171 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from ultideploy import api
+from ultideploy.fake_gcp import FakeGcpServer
+
+
+# The scenarios run by each iteration of the bootstrap benchmark. A
+# fresh bootstrap creates everything, and a rerun against the same
+# server and cache finds everything already in place.
+BENCH_SCENARIOS = ['fresh', 'rerun']
+
+BENCH_ORGANIZATION_ID = '123456789012'
+
+
+def fake_gcp(args):
+    """
+    Serve the fake Google APIs until interrupted.
+
+    Args:
+        args:
+            The parsed CLI arguments.
+    """
+    server = _build_server(args, port=args.port)
+
+    print(f"Serving fake Google APIs on {server.endpoint}")
+    print(
+        f"Run commands against it with "
+        f"{api.ENDPOINT_VARIABLE}={server.endpoint}\n"
+    )
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    _print_request_counts(server.reset_request_counts())
+
+
+def bench_bootstrap(args):
+    """
+    Time the bootstrap command against the fake Google APIs.
+
+    Each run starts a new fake server and cache, bootstraps from scratch,
+    and then bootstraps again with everything already in place. Every
+    bootstrap runs in its own process so runs can't share state.
+
+    Args:
+        args:
+            The parsed CLI arguments.
+    """
+    runs = {scenario: [] for scenario in BENCH_SCENARIOS}
+
+    for index in range(args.runs):
+        print(f"Run {index + 1} of {args.runs}...")
+
+        server = _build_server(args)
+        server.start()
+        try:
+            with tempfile.TemporaryDirectory() as cache_dir:
+                for scenario in BENCH_SCENARIOS:
+                    runs[scenario].append(
+                        _run_bootstrap(server, cache_dir, scenario)
+                    )
+        finally:
+            server.stop()
+
+    print(
+        f"\n{'Scenario':<10} {'Runs':>5} {'Failed':>7} {'Requests':>9} "
+        f"{'Min':>8} {'Median':>8} {'Max':>8}"
+    )
+    for scenario, results in runs.items():
+        seconds = [result['seconds'] for result in results]
+        failed = sum(not result['succeeded'] for result in results)
+        print(
+            f"{scenario:<10} {len(results):>5} {failed:>7} "
+            f"{statistics.median_low(r['requests'] for r in results):>9} "
+            f"{min(seconds):>7.3f}s {statistics.median(seconds):>7.3f}s "
+            f"{max(seconds):>7.3f}s"
+        )
+
+    for scenario, results in runs.items():
+        print(f"\nRequests per method ({scenario}, last run):")
+        _print_request_counts(results[-1]['methods'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(
+                {
+                    'settings': {
+                        'latency': args.latency,
+                        'error_rate': args.error_rate,
+                        'error_status': args.error_status,
+                        'operation_delay': args.operation_delay,
+                        'page_size': args.page_size,
+                        'service_accounts': args.service_accounts,
+                    },
+                    'runs': runs,
+                },
+                f,
+                indent=2,
+            )
+
+        print(f"\nWrote results to {args.output}")
+
+    if any(not result['succeeded']
+           for results in runs.values() for result in results):
+        sys.exit(1)
+
+
+def _build_server(args, port=0):
+    return FakeGcpServer(
+        port=port,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        operation_delay=args.operation_delay,
+        page_size=args.page_size,
+        service_accounts=args.service_accounts,
+        seed=args.seed,
+    )
+
+
+def _run_bootstrap(server, cache_dir, scenario):
+    server.reset_request_counts()
+
+    env = dict(os.environ)
+    env[api.ENDPOINT_VARIABLE] = server.endpoint
+    env['ULTIDEPLOY_CACHE_DIR'] = cache_dir
+
+    started = time.monotonic()
+    process = subprocess.run(
+        [
+            sys.executable,
+            '-m',
+            'ultideploy.cli',
+            'bootstrap',
+            BENCH_ORGANIZATION_ID,
+        ],
+        encoding='utf8',
+        env=env,
+        stderr=subprocess.STDOUT,
+        stdout=subprocess.PIPE,
+    )
+    seconds = time.monotonic() - started
+
+    methods = server.reset_request_counts()
+
+    if process.returncode != 0:
+        # The last line of the output is the error that stopped bootstrap.
+        error = (process.stdout.strip().splitlines() or [''])[-1]
+        print(f"  The {scenario} bootstrap failed: {error}")
+
+    return {
+        'succeeded': process.returncode == 0,
+        'seconds': round(seconds, 3),
+        'requests': sum(methods.values()),
+        'methods': dict(sorted(methods.items())),
+    }
+
+
+def _print_request_counts(counts):
+    for method_id, count in sorted(counts.items()):
+        print(f"  {method_id:<52} {count:>5}")
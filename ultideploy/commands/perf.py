@@ -0,0 +1,283 @@
+import asyncio
+import json
+import pathlib
+import sys
+import time
+import urllib.parse
+
+from ultideploy import cache
+
+
+def bench(args):
+    """
+    Run a load test and write the results as Fortio JSON.
+
+    Args:
+        args:
+            The parsed CLI arguments.
+    """
+    _import_results()
+    from ultideploy.perf import bench as load_test
+
+    if not args.url and not args.local:
+        print("\nError: A URL is required unless '--local' is given.")
+        sys.exit(1)
+
+    try:
+        load_test.parse_duration(args.duration)
+    except ValueError as e:
+        print(f"\nError: {e}")
+        sys.exit(1)
+
+    result = asyncio.run(_run_bench(args, load_test))
+
+    histogram = result['DurationHistogram']
+    print(
+        f"{histogram['Count']} requests in {args.duration} "
+        f"({result['ActualQPS']:.1f} qps) against {result['URL']}"
+    )
+    for percentile in histogram['Percentiles']:
+        print(
+            f"  p{percentile['Percentile']:g}: "
+            f"{percentile['Value'] * 1000:.3f} ms"
+        )
+    print(f"  Response codes: {result['RetCodes']}")
+
+    output = pathlib.Path(args.output)
+    if output.is_dir():
+        output = output / (
+            f"{'_'.join(result['Labels'].split())}_"
+            f"{time.strftime('%Y%m%d%H%M%S')}.json"
+        )
+
+    with output.open('w') as f:
+        json.dump(result, f, indent=2)
+
+    print(f"\nWrote results to {output}")
+
+
+async def _run_bench(args, load_test):
+    if not args.local:
+        return await load_test.run_load_test(
+            args.url,
+            args.qps,
+            args.duration,
+            args.connections,
+            args.labels or _default_labels(args.url),
+            timeout=args.timeout,
+        )
+
+    server, base_url = await load_test.serve_stand_in(
+        redirect=args.local_redirect
+    )
+    path = urllib.parse.urlsplit(args.url).path if args.url else '/'
+    url = base_url + (path or '/')
+
+    async with server:
+        return await load_test.run_load_test(
+            url,
+            args.qps,
+            args.duration,
+            args.connections,
+            args.labels or _default_labels(url),
+            timeout=args.timeout,
+        )
+
+
+def _default_labels(url):
+    # Fortio results are labeled with a label, driver, and target.
+    return f"bench ultideploy {urllib.parse.urlsplit(url).hostname}"
+
+
+def perf_convert(args):
+    """
+    Convert a directory of Fortio results into CSV or a binary columnar
+    table.
+
+    Args:
+        args:
+            The parsed CLI arguments.
+    """
+    results = _import_results()
+
+    paths = results.find_result_files(args.directory)
+
+    if args.group:
+        table = results.merge_results(paths, workers=args.workers)
+        print(
+            f"Merged {len(paths)} results into {len(table)} groups.",
+            file=sys.stderr,
+        )
+    else:
+        table = results.load_results(paths, workers=args.workers)
+        print(f"Loaded {len(table)} results.", file=sys.stderr)
+
+    if args.format == 'npz':
+        if not args.output:
+            print("\nError: An output file is required for the 'npz' format.")
+            sys.exit(1)
+
+        table.save(args.output)
+    elif args.output:
+        with open(args.output, 'w') as f:
+            table.write_csv(f)
+    else:
+        table.write_csv(sys.stdout)
+
+
+def perf_compare(args):
+    """
+    Compare two sets of Fortio results and exit with a non-zero status
+    if latency or throughput regressed past the configured thresholds.
+
+    Args:
+        args:
+            The parsed CLI arguments.
+    """
+    results = _import_results()
+    from ultideploy.perf import compare
+
+    known_metrics = compare.LATENCY_METRICS + compare.THROUGHPUT_METRICS
+    unknown_metrics = sorted(set(args.metrics or []) - set(known_metrics))
+    if unknown_metrics:
+        print(
+            f"\nError: Unknown metric(s): {', '.join(unknown_metrics)}. "
+            f"Choose from: {', '.join(known_metrics)}"
+        )
+        sys.exit(2)
+
+    baseline = results.load_results(
+        results.find_result_files(args.baseline), workers=args.workers
+    )
+    candidate = results.load_results(
+        results.find_result_files(args.candidate), workers=args.workers
+    )
+
+    comparisons, unmatched = compare.compare_results(
+        baseline,
+        candidate,
+        latency_threshold=args.latency_threshold / 100,
+        throughput_threshold=args.throughput_threshold / 100,
+        metrics=args.metrics,
+        iterations=args.iterations,
+        confidence=args.confidence,
+        seed=args.seed,
+    )
+
+    for group in unmatched:
+        print(f"Warning: {_format_group(group)} is only in one result set.")
+
+    print(
+        f"{'Group':<40} {'Metric':<10} {'Baseline':>12} {'Candidate':>12} "
+        f"{'Delta':>8}  {args.confidence:.0%} CI"
+    )
+    for comparison in comparisons:
+        # Changes from a zero baseline are absolute rather than relative.
+        change_format = '+.1%' if comparison.relative else '+.3g'
+        delta = format(comparison.delta, change_format)
+        print(
+            f"{_format_group(comparison.group):<40} "
+            f"{comparison.metric:<10} "
+            f"{comparison.baseline_mean:>12.6g} "
+            f"{comparison.candidate_mean:>12.6g} "
+            f"{delta:>8}  "
+            f"[{comparison.ci_low:{change_format}}, "
+            f"{comparison.ci_high:{change_format}}]"
+            f"{'  REGRESSION' if comparison.regressed else ''}"
+        )
+
+    regressions = [c for c in comparisons if c.regressed]
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed.")
+        sys.exit(1)
+
+    print("\nNo regressions found.")
+
+
+def perf_ingest(args):
+    """
+    Ingest a directory of Fortio results into the local history store.
+
+    Args:
+        args:
+            The parsed CLI arguments.
+    """
+    _import_results()
+    from ultideploy.perf import store
+
+    with store.ResultStore(_store_path(args)) as result_store:
+        ingested, skipped = result_store.ingest(
+            args.directory, istio_version=args.istio_version
+        )
+
+    print(f"Ingested {ingested} results. {skipped} were already up to date.")
+
+
+def perf_trend(args):
+    """
+    Print a metric for a label across the most recent stored runs.
+
+    Args:
+        args:
+            The parsed CLI arguments.
+    """
+    _import_results()
+    from ultideploy.perf import store
+
+    with store.ResultStore(_store_path(args)) as result_store:
+        try:
+            rows = result_store.trend(
+                args.label,
+                metric=args.metric,
+                qps=args.qps,
+                clients=args.clients,
+                istio_version=args.istio_version,
+                last=args.last,
+            )
+        except ValueError as e:
+            print(f"\nError: {e}")
+            sys.exit(1)
+
+    if not rows:
+        print(f"No stored runs match the label '{args.label}'.")
+        return
+
+    print(
+        f"{'Start Time':<32} {'QPS':>8} {'Clients':>8} {'Istio':>8} "
+        f"{args.metric:>12}"
+    )
+    for start_time, qps, clients, istio_version, value in rows:
+        # Metrics that were NaN in the results are stored as NULL.
+        value = '-' if value is None else format(value, '.6g')
+        print(
+            f"{start_time or '-':<32} {qps:>8} {clients:>8} "
+            f"{istio_version or '-':>8} {value:>12}"
+        )
+
+
+def _store_path(args):
+    if args.database:
+        return pathlib.Path(args.database)
+
+    return cache.get_cache_location('perf', 'history.sqlite3')
+
+
+def _format_group(group):
+    label, qps, clients = group
+
+    return f"{label} qps={qps} c={clients}"
+
+
+def _import_results():
+    # NumPy is an optional dependency that is only needed for the perf
+    # tooling.
+    try:
+        from ultideploy.perf import results
+    except ImportError as e:
+        print(
+            f"\nError: The perf tools require NumPy ({e}). Install them "
+            f"with \"pip install -e .[perf]\"."
+        )
+        sys.exit(1)
+
+    return results
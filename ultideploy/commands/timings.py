@@ -0,0 +1,57 @@
+import sys
+
+from ultideploy import timings as apply_timings
+
+
+def timings(args):
+    """
+    Report the slowest resources and the critical path of each step's
+    recorded Terraform applies.
+
+    Args:
+        args:
+            The parsed CLI arguments.
+    """
+    step_names = [args.step] if args.step else apply_timings.recorded_steps()
+
+    reported = False
+    for step_name in step_names:
+        runs = apply_timings.load_runs(step_name, destroy=args.destroy)
+        if not runs:
+            continue
+
+        reported = True
+        latest = runs[-1]
+
+        print(
+            f"\n{step_name}: {len(runs)} recorded run(s), latest took "
+            f"{_format_seconds(latest['finished'] - latest['started'])}"
+        )
+
+        print(
+            f"\n  {'Resource':<60} {'Median':>8} {'Latest':>8} {'Runs':>5}"
+        )
+        for address, median, last, count in apply_timings.slowest_resources(
+                runs, limit=args.top
+        ):
+            print(
+                f"  {address:<60} {_format_seconds(median):>8} "
+                f"{_format_seconds(last):>8} {count:>5}"
+            )
+
+        path, total = apply_timings.critical_path(latest)
+        print(f"\n  Critical path of latest run ({_format_seconds(total)}):")
+        for address in path:
+            print(f"    {address}")
+
+    if not reported:
+        print("No Terraform timings have been recorded yet.")
+        sys.exit(1)
+
+
+def _format_seconds(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    if minutes:
+        return f"{minutes}m{seconds}s"
+
+    return f"{seconds}s"
@@ -12,6 +12,11 @@ TERRAFORM_ADMIN_PROJECT_SERVICES = [
     "storage-api",
 ]
 
+# The file in the project configuration listing the APIs that are
+# enabled in the root project. Terraform loads it on its own, so running
+# Terraform directly enables the same services.
+PROJECT_SERVICES_FILE_NAME = 'project_services.auto.tfvars.json'
+
 TERRAFORM_SERVICE_ACCOUNT_ID = 'terraform'
 TERRAFORM_SERVICE_ACCOUNT_NAME = 'Terraform'
 
@@ -1,20 +1,103 @@
+import fcntl
+import functools
+import json
+import os
+import subprocess
+
+import google.auth.credentials
 from google.oauth2 import service_account
 from oauth2client.client import GoogleCredentials
 
-from ultideploy import cache
+from ultideploy import api, cache
+
+
+CLOUD_PLATFORM_SCOPE = 'https://www.googleapis.com/auth/cloud-platform'
 
 
 def default_google_credentials():
+    # Calls to a local stand-in for the APIs are not authenticated.
+    if os.environ.get(api.ENDPOINT_VARIABLE):
+        return google.auth.credentials.AnonymousCredentials()
+
     return GoogleCredentials.get_application_default()
 
 
 def google_service_account_credentials(service_account_name):
     file = google_service_account_credentials_path(service_account_name)
 
-    return service_account.Credentials.from_service_account_file(file)
+    return _load_service_account_credentials(str(file), file.stat().st_mtime_ns)
 
 
 def google_service_account_credentials_path(service_account_name):
     return cache.get_cache_location(
         'credentials', f'{service_account_name}.json'
     )
+
+
+def gcloud_environment(service_account_name, env=None):
+    """
+    Get an environment that runs ``gcloud`` as a service account using
+    a private configuration directory.
+
+    Each service account gets its own ``gcloud`` configuration
+    directory in the cache, so the user's global ``gcloud`` account is
+    never modified and concurrent runs don't interfere with each other.
+    The service account is only activated in the directory when it has
+    not been activated yet or its key has changed since.
+
+    Args:
+        service_account_name:
+            The name of the service account whose cached key should be
+            used.
+        env:
+            An optional base environment. Defaults to a copy of the
+            current process' environment.
+
+    Returns:
+        A copy of the environment with ``CLOUDSDK_CONFIG`` and
+        ``GOOGLE_APPLICATION_CREDENTIALS`` pointing at the service
+        account's configuration and key.
+    """
+    key_path = google_service_account_credentials_path(service_account_name)
+    config_path = cache.get_cache_location('gcloud', service_account_name)
+    config_path.mkdir(exist_ok=True, parents=True)
+
+    subprocess_env = dict(env if env is not None else os.environ)
+    subprocess_env['CLOUDSDK_CONFIG'] = str(config_path)
+    subprocess_env['GOOGLE_APPLICATION_CREDENTIALS'] = str(key_path)
+
+    with (config_path / '.lock').open('w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        marker = config_path / '.activated'
+        if marker.is_file() and marker.stat().st_mtime >= key_path.stat().st_mtime:
+            return subprocess_env
+
+        with key_path.open() as f:
+            service_account_email = json.load(f)['client_email']
+
+        subprocess.run(
+            [
+                'gcloud',
+                'auth',
+                'activate-service-account',
+                service_account_email,
+                '--key-file',
+                key_path,
+            ],
+            check=True,
+            env=subprocess_env,
+        )
+        marker.touch()
+
+    return subprocess_env
+
+
+@functools.lru_cache(maxsize=None)
+def _load_service_account_credentials(path, mtime_ns):
+    # The credentials are shared and already scoped so API clients don't
+    # each fetch their own access token. They are reloaded if the key
+    # file changes.
+    return service_account.Credentials.from_service_account_file(
+        path, scopes=[CLOUD_PLATFORM_SCOPE]
+    )
@@ -0,0 +1,438 @@
+import json
+import os
+import pathlib
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import time
+import traceback
+
+# Only lightweight modules are imported here so that handing a command to
+# the daemon stays cheap.
+from ultideploy import cache
+
+
+SOCKET_PATH = pathlib.Path(
+    os.environ.get(
+        'ULTIDEPLOY_DAEMON_SOCKET', cache.CACHE_DIRECTORY / 'daemon.sock'
+    )
+)
+
+# Setting this environment variable runs commands in-process even if the
+# daemon is running.
+NO_DAEMON_VARIABLE = 'ULTIDEPLOY_NO_DAEMON'
+
+# How often the daemon reaps finished commands and refreshes tokens.
+MAINTENANCE_SECONDS = 1
+
+# Access tokens are refreshed in the daemon once they are this close to
+# expiring, so that commands inherit a valid token.
+TOKEN_REFRESH_MARGIN = 300
+
+# The Google APIs whose clients commands build. Their discovery
+# documents are parsed once in the daemon instead of in every command.
+PREWARM_APIS = [
+    ('cloudbilling', 'v1'),
+    ('cloudresourcemanager', 'v1'),
+    ('iam', 'v1'),
+    ('serviceusage', 'v1'),
+    ('storage', 'v1'),
+]
+
+# The CLI's global options that take a value, which have to be skipped
+# to find the subcommand without importing the CLI.
+GLOBAL_OPTIONS_WITH_VALUES = {
+    '--api-metrics',
+    '--api-rate-limit',
+    '--api-retries',
+}
+
+# Sent instead of a process ID when the daemon won't run a command, so
+# the client runs it in-process instead.
+_REFUSED = -1
+
+_LENGTH = struct.Struct('!I')
+_INT = struct.Struct('!i')
+
+# The standard input, output, and error of the client are passed to the
+# daemon.
+_STANDARD_FDS = [0, 1, 2]
+
+
+def launch():
+    """
+    Run the CLI in the daemon if it's running, or in-process otherwise.
+    """
+    argv = sys.argv[1:]
+
+    if (
+            not os.environ.get(NO_DAEMON_VARIABLE)
+            and _subcommand(argv) != 'daemon'
+    ):
+        exit_code = run_in_daemon(argv)
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    from ultideploy import cli
+    cli.main()
+
+
+def run_in_daemon(argv, socket_path=SOCKET_PATH):
+    """
+    Run a command in the daemon with the current process' working
+    directory, environment, and standard streams.
+
+    Args:
+        argv:
+            The command line arguments of the command.
+        socket_path:
+            The path of the daemon's socket.
+
+    Returns:
+        The exit code of the command, or ``None`` if the daemon isn't
+        running or can't run the command.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(str(socket_path))
+    except (ConnectionRefusedError, FileNotFoundError):
+        client.close()
+
+        return None
+
+    with client:
+        request = json.dumps({
+            'argv': argv,
+            'cwd': os.getcwd(),
+            'env': dict(os.environ),
+        }).encode()
+        socket.send_fds(
+            client, [_LENGTH.pack(len(request)) + request], _STANDARD_FDS
+        )
+
+        try:
+            command_pid = _recv_int(client)
+        except ConnectionError:
+            # The daemon went away before the command started, so it's
+            # safe to run it here instead.
+            return None
+
+        if command_pid == _REFUSED:
+            return None
+
+        # The command isn't in the terminal's foreground process group,
+        # so interrupts have to be forwarded to it.
+        previous_handler = signal.signal(
+            signal.SIGINT,
+            lambda signum, frame: os.kill(command_pid, signal.SIGINT),
+        )
+        try:
+            return _recv_int(client)
+        except ConnectionError:
+            print("\nError: The daemon stopped responding.", file=sys.stderr)
+
+            return 1
+        finally:
+            signal.signal(signal.SIGINT, previous_handler)
+
+
+def serve(socket_path=SOCKET_PATH):
+    """
+    Warm up and run the daemon until it's interrupted.
+
+    Each command is run in a process forked from the daemon, so it
+    starts with the modules, API discovery documents, credentials, and
+    access tokens the daemon has already loaded. Commands whose
+    environment points at a different cache or API endpoint than the
+    daemon's are refused, since the daemon's modules and credentials
+    were loaded for its own settings.
+
+    Args:
+        socket_path:
+            The path of the socket to listen on.
+    """
+    socket_path.parent.mkdir(exist_ok=True, parents=True)
+    if _is_listening(socket_path):
+        print(f"\nError: A daemon is already listening on {socket_path}.")
+        sys.exit(1)
+
+    prewarm()
+
+    if socket_path.exists():
+        socket_path.unlink()
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    previous_umask = os.umask(0o177)
+    try:
+        server.bind(str(socket_path))
+    finally:
+        os.umask(previous_umask)
+    server.listen()
+    server.settimeout(MAINTENANCE_SECONDS)
+
+    print(f"Listening on {socket_path}")
+
+    # Stop cleanly when the daemon is terminated by a service manager.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        while True:
+            _reap_commands()
+            _refresh_credentials()
+
+            try:
+                connection, _ = server.accept()
+            except socket.timeout:
+                continue
+
+            with connection:
+                _handle_connection(server, connection)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if socket_path.exists():
+            socket_path.unlink()
+
+
+def prewarm():
+    """
+    Load what commands would otherwise load from scratch: the CLI's
+    modules, the discovery documents API clients are built from, and the
+    Terraform service account's credentials and access token. Terraform
+    configurations that aren't initialized for their current
+    configuration and dependency lock file are initialized, so deploys
+    can skip ``terraform init``.
+    """
+    start = time.monotonic()
+
+    # Importing the CLI imports the modules of every command.
+    from ultideploy import api, cli, constants, credentials  # noqa: F401
+    from ultideploy.commands.drift import TERRAFORM_CONFIGS
+    from ultideploy.steps import terraform_step
+
+    for api_name, version in PREWARM_APIS:
+        api.load_discovery_document(api_name, version)
+
+    _refresh_credentials()
+
+    key_path = credentials.google_service_account_credentials_path(
+        constants.TERRAFORM_SERVICE_ACCOUNT_ID
+    )
+    env = dict(os.environ, GOOGLE_APPLICATION_CREDENTIALS=str(key_path))
+    for name, configuration_directory in TERRAFORM_CONFIGS.items():
+        if terraform_step.is_initialized(configuration_directory):
+            continue
+
+        print(f"Initializing the '{name}' Terraform configuration...")
+        try:
+            subprocess.run(
+                ['terraform', 'init', '-input=false'],
+                check=True,
+                cwd=configuration_directory,
+                env=env,
+                stdout=subprocess.DEVNULL,
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"Warning: Could not initialize '{name}': {e}")
+        else:
+            terraform_step.mark_initialized(configuration_directory)
+
+    print(f"Warmed up in {time.monotonic() - start:.1f}s.")
+
+
+def _handle_connection(server, connection):
+    try:
+        request, fds = _recv_request(connection)
+    except (OSError, ValueError) as e:
+        print(f"Discarding invalid request: {e}", file=sys.stderr)
+        return
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    if _settings(request['env']) != _settings(os.environ):
+        print(
+            "Refusing a command whose cache or API endpoint differs from "
+            "the daemon's.",
+            file=sys.stderr,
+        )
+        for fd in fds:
+            os.close(fd)
+        connection.sendall(_INT.pack(_REFUSED))
+
+        return
+
+    if os.fork():
+        for fd in fds:
+            os.close(fd)
+
+        return
+
+    exit_code = 1
+    try:
+        server.close()
+        connection.sendall(_INT.pack(os.getpid()))
+        exit_code = _run_command(request, fds)
+        connection.sendall(_INT.pack(exit_code))
+    finally:
+        os._exit(exit_code)
+
+
+def _run_command(request, fds):
+    for target_fd, fd in zip(_STANDARD_FDS, fds):
+        os.dup2(fd, target_fd)
+        os.close(fd)
+
+    sys.stdin = os.fdopen(0, 'r', closefd=False)
+    sys.stdout = os.fdopen(1, 'w', buffering=1, closefd=False)
+    sys.stderr = os.fdopen(2, 'w', buffering=1, closefd=False)
+
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+    sys.argv = ['ultideploy', *request['argv']]
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    from ultideploy import cli
+
+    try:
+        cli.main()
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+
+        print(e.code, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except OSError:
+                pass
+
+    return 0
+
+
+def _refresh_credentials():
+    import google_auth_httplib2
+    import httplib2
+
+    from ultideploy import constants, credentials
+
+    key_path = credentials.google_service_account_credentials_path(
+        constants.TERRAFORM_SERVICE_ACCOUNT_ID
+    )
+    if not key_path.is_file():
+        return
+
+    google_credentials = credentials.google_service_account_credentials(
+        constants.TERRAFORM_SERVICE_ACCOUNT_ID
+    )
+    expiry = google_credentials.expiry
+    if (
+            google_credentials.valid
+            and expiry is not None
+            and expiry.timestamp() - time.time() > TOKEN_REFRESH_MARGIN
+    ):
+        return
+
+    # A throwaway connection is used so that commands don't inherit an
+    # open connection from the daemon.
+    http = httplib2.Http()
+    try:
+        google_credentials.refresh(google_auth_httplib2.Request(http))
+    except Exception as e:
+        print(f"Warning: Could not refresh access token: {e}", file=sys.stderr)
+    finally:
+        http.close()
+
+
+def _settings(environ):
+    from ultideploy import api
+
+    # The settings that modules read when they're imported or that the
+    # daemon's warm credentials depend on.
+    return (
+        cache.cache_directory(environ),
+        environ.get(api.ENDPOINT_VARIABLE) or None,
+    )
+
+
+def _subcommand(argv):
+    arguments = iter(argv)
+    for argument in arguments:
+        if argument in GLOBAL_OPTIONS_WITH_VALUES:
+            next(arguments, None)
+        elif not argument.startswith('-'):
+            return argument
+
+    return None
+
+
+def _is_listening(socket_path):
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(str(socket_path))
+    except (ConnectionRefusedError, FileNotFoundError):
+        return False
+    finally:
+        probe.close()
+
+    return True
+
+
+def _reap_commands():
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+
+        if not pid:
+            return
+
+
+def _recv_request(connection):
+    data, fds, _, _ = socket.recv_fds(
+        connection, 1024 * 1024, len(_STANDARD_FDS)
+    )
+    if len(fds) != len(_STANDARD_FDS):
+        for fd in fds:
+            os.close(fd)
+        raise ValueError("Expected the client's standard streams.")
+
+    while len(data) < _LENGTH.size:
+        data += _recv_exact(connection, _LENGTH.size - len(data))
+
+    length, = _LENGTH.unpack(data[:_LENGTH.size])
+    body = data[_LENGTH.size:]
+    if len(body) < length:
+        body += _recv_exact(connection, length - len(body))
+
+    return json.loads(body), fds
+
+
+def _recv_int(connection):
+    value, = _INT.unpack(_recv_exact(connection, _INT.size))
+
+    return value
+
+
+def _recv_exact(connection, size):
+    data = b''
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionResetError("Connection closed.")
+        data += chunk
+
+    return data
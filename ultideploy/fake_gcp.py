@@ -0,0 +1,646 @@
+import base64
+import collections
+import copy
+import datetime
+import http.server
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+from ultideploy import constants
+
+
+# The number of items returned in each page of a list call unless the
+# caller asks for fewer.
+DEFAULT_PAGE_SIZE = 100
+
+# The projects that exist before anything is created.
+SEEDED_PROJECTS = [constants.DNS_PROJECT_ID]
+
+BILLING_ACCOUNT = {
+    'name': 'billingAccounts/000000-000000-000000',
+    'displayName': 'Fake Billing Account',
+    'open': True,
+}
+
+# Maps HTTP statuses to the status names used in Google API errors.
+ERROR_STATUSES = {
+    400: 'INVALID_ARGUMENT',
+    403: 'PERMISSION_DENIED',
+    404: 'NOT_FOUND',
+    409: 'ALREADY_EXISTS',
+    429: 'RESOURCE_EXHAUSTED',
+    500: 'INTERNAL',
+    503: 'UNAVAILABLE',
+}
+
+Route = collections.namedtuple(
+    'Route', ['http_method', 'api', 'pattern', 'method_id', 'handler']
+)
+
+# The API methods used by bootstrap. Paths are relative to the base URL
+# of each API.
+ROUTES = [
+    Route(
+        'GET', 'cloudresourcemanager',
+        re.compile(r'/v1/organizations/(?P<organization_id>[^/:]+)'),
+        'cloudresourcemanager.organizations.get', '_get_organization',
+    ),
+    Route(
+        'POST', 'cloudresourcemanager',
+        re.compile(r'/v1/(?P<resource>organizations/[^/:]+):getIamPolicy'),
+        'cloudresourcemanager.organizations.getIamPolicy', '_get_iam_policy',
+    ),
+    Route(
+        'POST', 'cloudresourcemanager',
+        re.compile(r'/v1/(?P<resource>organizations/[^/:]+):setIamPolicy'),
+        'cloudresourcemanager.organizations.setIamPolicy', '_set_iam_policy',
+    ),
+    Route(
+        'GET', 'cloudresourcemanager',
+        re.compile(r'/v1/projects'),
+        'cloudresourcemanager.projects.list', '_list_projects',
+    ),
+    Route(
+        'POST', 'cloudresourcemanager',
+        re.compile(r'/v1/projects'),
+        'cloudresourcemanager.projects.create', '_create_project',
+    ),
+    Route(
+        'POST', 'cloudresourcemanager',
+        re.compile(r'/v1/projects/(?P<project_id>[^/:]+):getIamPolicy'),
+        'cloudresourcemanager.projects.getIamPolicy', '_get_project_iam_policy',
+    ),
+    Route(
+        'POST', 'cloudresourcemanager',
+        re.compile(r'/v1/projects/(?P<project_id>[^/:]+):setIamPolicy'),
+        'cloudresourcemanager.projects.setIamPolicy', '_set_project_iam_policy',
+    ),
+    Route(
+        'GET', 'cloudresourcemanager',
+        re.compile(r'/v1/(?P<name>operations/[^/]+)'),
+        'cloudresourcemanager.operations.get', '_get_operation',
+    ),
+    Route(
+        'GET', 'cloudbilling',
+        re.compile(r'/v1/billingAccounts'),
+        'cloudbilling.billingAccounts.list', '_list_billing_accounts',
+    ),
+    Route(
+        'PUT', 'cloudbilling',
+        re.compile(r'/v1/projects/(?P<project_id>[^/]+)/billingInfo'),
+        'cloudbilling.projects.updateBillingInfo', '_update_billing_info',
+    ),
+    Route(
+        'GET', 'serviceusage',
+        re.compile(r'/v1/projects/(?P<project>[^/]+)/services'),
+        'serviceusage.services.list', '_list_services',
+    ),
+    Route(
+        'POST', 'serviceusage',
+        re.compile(r'/v1/projects/(?P<project>[^/]+)/services:batchEnable'),
+        'serviceusage.services.batchEnable', '_batch_enable_services',
+    ),
+    Route(
+        'GET', 'serviceusage',
+        re.compile(r'/v1/(?P<name>operations/[^/]+)'),
+        'serviceusage.operations.get', '_get_operation',
+    ),
+    Route(
+        'GET', 'iam',
+        re.compile(r'/v1/projects/(?P<project_id>[^/]+)/serviceAccounts'),
+        'iam.projects.serviceAccounts.list', '_list_service_accounts',
+    ),
+    Route(
+        'POST', 'iam',
+        re.compile(r'/v1/projects/(?P<project_id>[^/]+)/serviceAccounts'),
+        'iam.projects.serviceAccounts.create', '_create_service_account',
+    ),
+    Route(
+        'POST', 'iam',
+        re.compile(
+            r'/v1/(?P<name>projects/(?P<project_id>[^/]+)/serviceAccounts/'
+            r'(?P<email>[^/]+))/keys'
+        ),
+        'iam.projects.serviceAccounts.keys.create', '_create_key',
+    ),
+    Route(
+        'GET', 'storage',
+        re.compile(r'/b/(?P<bucket>[^/]+)'),
+        'storage.buckets.get', '_get_bucket',
+    ),
+    Route(
+        'POST', 'storage',
+        re.compile(r'/b'),
+        'storage.buckets.insert', '_insert_bucket',
+    ),
+]
+
+
+class ApiError(Exception):
+    """
+    An error returned to the caller of a fake API method.
+    """
+
+    def __init__(self, status, message, reason=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.reason = reason
+
+
+class FakeGcpServer(http.server.ThreadingHTTPServer):
+    """
+    A local stand-in for the subset of the Cloud Resource Manager,
+    Billing, Service Usage, IAM, and Storage APIs that bootstrap uses.
+
+    Requests are routed by the first segment of their path, which is the
+    name of the API, so clients built by :func:`ultideploy.api.build_service`
+    with ``ULTIDEPLOY_API_ENDPOINT`` set to :attr:`endpoint` are served
+    by it. State is kept in memory, long running operations complete
+    after a configurable delay, and list calls are paginated.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+            self,
+            host='127.0.0.1',
+            port=0,
+            latency=0.0,
+            error_rate=0.0,
+            error_status=503,
+            operation_delay=0.0,
+            page_size=DEFAULT_PAGE_SIZE,
+            service_accounts=0,
+            seed=None,
+    ):
+        """
+        Args:
+            host:
+                The address to listen on.
+            port:
+                The port to listen on. Defaults to a free port.
+            latency:
+                The number of seconds to wait before answering each
+                request.
+            error_rate:
+                The fraction of requests to fail with ``error_status``.
+            error_status:
+                The HTTP status of injected errors.
+            operation_delay:
+                The number of seconds long running operations take to
+                complete.
+            page_size:
+                The maximum number of items returned in each page of a
+                list call.
+            service_accounts:
+                The number of unrelated service accounts each project
+                starts with, to exercise pagination.
+            seed:
+                An optional seed for injecting errors.
+        """
+        super().__init__((host, port), _Handler)
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.operation_delay = operation_delay
+        self.page_size = page_size
+        self.service_accounts = service_accounts
+
+        self.request_counts = collections.Counter()
+
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._thread = None
+
+        self._buckets = {}
+        self._operations = {}
+        self._organizations = {}
+        self._policies = {}
+        self._projects = {}
+        self._service_accounts = {}
+        self._services = {}
+
+        for project_id in SEEDED_PROJECTS:
+            self._add_project(project_id, {'type': 'organization', 'id': '0'})
+
+    @property
+    def endpoint(self):
+        """
+        The URL to set ``ULTIDEPLOY_API_ENDPOINT`` to.
+        """
+        host, port = self.server_address[:2]
+
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """
+        Serve requests from a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop serving requests and close the server's socket.
+        """
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+
+        self.server_close()
+
+    def reset_request_counts(self):
+        """
+        Forget the requests counted so far.
+
+        Returns:
+            A counter of the requests made to each API method since the
+            counts were last reset.
+        """
+        with self._lock:
+            counts = self.request_counts
+            self.request_counts = collections.Counter()
+
+        return counts
+
+    def handle_api_request(self, http_method, path, body):
+        """
+        Answer a request to one of the fake APIs.
+
+        Args:
+            http_method:
+                The HTTP method of the request.
+            path:
+                The path and query string of the request.
+            body:
+                The decoded JSON body of the request.
+
+        Returns:
+            A two-element tuple containing the HTTP status and JSON
+            serializable body of the response.
+        """
+        url = urllib.parse.urlsplit(path)
+        api_name, _, method_path = url.path.lstrip('/').partition('/')
+        method_path = '/' + urllib.parse.unquote(method_path)
+        query = {
+            key: values[0]
+            for key, values in urllib.parse.parse_qs(url.query).items()
+        }
+
+        route, match = _find_route(http_method, api_name, method_path)
+        method_id = route.method_id if route else f'{http_method} {url.path}'
+
+        with self._lock:
+            self.request_counts[method_id] += 1
+            fail = self._random.random() < self.error_rate
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        try:
+            if fail:
+                # Injected 403s and 429s look like exceeded quotas, so
+                # clients can tell them from real permission errors.
+                raise ApiError(
+                    self.error_status,
+                    "Injected error.",
+                    reason=(
+                        'rateLimitExceeded'
+                        if self.error_status in (403, 429) else None
+                    ),
+                )
+            if route is None:
+                raise ApiError(404, f"Unknown method: {http_method} {path}")
+
+            with self._lock:
+                return 200, getattr(self, route.handler)(
+                    query, body, **match.groupdict()
+                )
+        except ApiError as e:
+            error = {
+                'code': e.status,
+                'message': e.message,
+                'status': ERROR_STATUSES.get(e.status, 'UNKNOWN'),
+            }
+            if e.reason:
+                error['errors'] = [{
+                    'domain': 'usageLimits',
+                    'message': e.message,
+                    'reason': e.reason,
+                }]
+
+            return e.status, {'error': error}
+
+    def _get_organization(self, query, body, organization_id):
+        # Every organization exists.
+        return self._organizations.setdefault(organization_id, {
+            'name': f'organizations/{organization_id}',
+            'displayName': f'{organization_id}.example.com',
+            'lifecycleState': 'ACTIVE',
+        })
+
+    def _get_iam_policy(self, query, body, resource):
+        policy = self._policies.setdefault(
+            resource, {'version': 1, 'bindings': []}
+        )
+
+        return {**copy.deepcopy(policy), 'etag': self._etag(resource)}
+
+    def _set_iam_policy(self, query, body, resource):
+        self._policies[resource] = {
+            'version': 1,
+            'bindings': copy.deepcopy(body['policy'].get('bindings', [])),
+        }
+
+        return self._get_iam_policy(query, body, resource)
+
+    def _get_project_iam_policy(self, query, body, project_id):
+        self._project(project_id)
+
+        return self._get_iam_policy(query, body, f'projects/{project_id}')
+
+    def _set_project_iam_policy(self, query, body, project_id):
+        self._project(project_id)
+
+        return self._set_iam_policy(query, body, f'projects/{project_id}')
+
+    def _list_projects(self, query, body):
+        projects = list(self._projects.values())
+
+        # Only the "id:<project ID>" filter used by bootstrap is supported.
+        project_filter = query.get('filter', '')
+        if project_filter.startswith('id:'):
+            projects = [
+                project for project in projects
+                if project['projectId'] == project_filter[len('id:'):]
+            ]
+
+        return self._page(projects, 'projects', query)
+
+    def _create_project(self, query, body):
+        project_id = body['projectId']
+        if project_id in self._projects:
+            raise ApiError(409, f"Project '{project_id}' already exists.")
+
+        project = self._add_project(project_id, body['parent'], body['name'])
+
+        return self._start_operation(
+            f'operations/cp.{next(self._ids)}', project
+        )
+
+    def _get_operation(self, query, body, name):
+        if name not in self._operations:
+            raise ApiError(404, f"Operation '{name}' not found.")
+
+        done_at, response = self._operations[name]
+        if time.monotonic() < done_at:
+            return {'name': name, 'done': False}
+
+        return {'name': name, 'done': True, 'response': response}
+
+    def _list_billing_accounts(self, query, body):
+        return self._page([BILLING_ACCOUNT], 'billingAccounts', query)
+
+    def _update_billing_info(self, query, body, project_id):
+        self._project(project_id)
+
+        return {
+            'name': f'projects/{project_id}/billingInfo',
+            'projectId': project_id,
+            'billingAccountName': body['billingAccountName'],
+            'billingEnabled': True,
+        }
+
+    def _list_services(self, query, body, project):
+        project = self._project(project)
+        parent = f"projects/{project['projectNumber']}"
+
+        services = [
+            _service(parent, name)
+            for name in sorted(self._services[project['projectId']])
+        ]
+
+        return self._page(services, 'services', query)
+
+    def _batch_enable_services(self, query, body, project):
+        project = self._project(project)
+        parent = f"projects/{project['projectNumber']}"
+
+        self._services[project['projectId']].update(body['serviceIds'])
+
+        return self._start_operation(
+            f'operations/acf.{next(self._ids)}',
+            {
+                'services': [
+                    _service(parent, name) for name in body['serviceIds']
+                ],
+            },
+        )
+
+    def _list_service_accounts(self, query, body, project_id):
+        self._project(project_id)
+
+        return self._page(
+            list(self._service_accounts[project_id].values()),
+            'accounts',
+            query,
+        )
+
+    def _create_service_account(self, query, body, project_id):
+        self._project(project_id)
+
+        account_id = body['accountId']
+        email = f'{account_id}@{project_id}.iam.gserviceaccount.com'
+        if email in self._service_accounts[project_id]:
+            raise ApiError(409, f"Service account '{email}' already exists.")
+
+        return self._add_service_account(
+            project_id,
+            account_id,
+            body.get('serviceAccount', {}).get('displayName', ''),
+        )
+
+    def _create_key(self, query, body, name, project_id, email):
+        self._project(project_id)
+        if email not in self._service_accounts[project_id]:
+            raise ApiError(404, f"Service account '{email}' not found.")
+
+        key_id = f'{next(self._ids):040x}'
+        # The key has the shape of a real key file but can't sign anything.
+        key_file = {
+            'type': 'service_account',
+            'project_id': project_id,
+            'private_key_id': key_id,
+            'private_key': '',
+            'client_email': email,
+            'client_id': self._service_accounts[project_id][email]['uniqueId'],
+            'token_uri': 'https://oauth2.googleapis.com/token',
+        }
+
+        return {
+            'name': f'{name}/keys/{key_id}',
+            'keyAlgorithm': body.get('keyAlgorithm'),
+            'privateKeyType': body.get('privateKeyType'),
+            'privateKeyData': base64.b64encode(
+                json.dumps(key_file).encode()
+            ).decode(),
+        }
+
+    def _get_bucket(self, query, body, bucket):
+        if bucket not in self._buckets:
+            raise ApiError(404, f"Bucket '{bucket}' not found.")
+
+        return self._buckets[bucket]
+
+    def _insert_bucket(self, query, body):
+        project = self._project(query.get('project', ''))
+
+        name = body['name']
+        if name in self._buckets:
+            raise ApiError(409, f"Bucket '{name}' already exists.")
+
+        self._buckets[name] = {
+            **body,
+            'kind': 'storage#bucket',
+            'id': name,
+            'projectNumber': project['projectNumber'],
+            'timeCreated': _now(),
+        }
+
+        return self._buckets[name]
+
+    def _add_project(self, project_id, parent, name=None):
+        project = {
+            'projectNumber': str(100000000000 + next(self._ids)),
+            'projectId': project_id,
+            'name': name or project_id,
+            'parent': parent,
+            'lifecycleState': 'ACTIVE',
+            'createTime': _now(),
+        }
+        self._projects[project_id] = project
+        self._services[project_id] = set()
+        self._service_accounts[project_id] = {}
+
+        for index in range(self.service_accounts):
+            self._add_service_account(
+                project_id, f'unrelated-{index}', f'Unrelated {index}'
+            )
+
+        return project
+
+    def _add_service_account(self, project_id, account_id, display_name):
+        email = f'{account_id}@{project_id}.iam.gserviceaccount.com'
+        account = {
+            'name': f'projects/{project_id}/serviceAccounts/{email}',
+            'projectId': project_id,
+            'uniqueId': str(next(self._ids)),
+            'email': email,
+            'displayName': display_name,
+        }
+        self._service_accounts[project_id][email] = account
+
+        return account
+
+    def _project(self, key):
+        # Projects can be referred to by ID or by number.
+        for project in self._projects.values():
+            if key in (project['projectId'], project['projectNumber']):
+                return project
+
+        raise ApiError(404, f"Project '{key}' not found.")
+
+    def _start_operation(self, name, response):
+        self._operations[name] = (
+            time.monotonic() + self.operation_delay, response
+        )
+
+        return {'name': name, 'done': self.operation_delay <= 0}
+
+    def _page(self, items, key, query):
+        page_size = self.page_size
+        if query.get('pageSize'):
+            page_size = min(int(query['pageSize']), page_size)
+
+        offset = int(query.get('pageToken') or 0)
+        page = {key: items[offset:offset + page_size]}
+        if offset + page_size < len(items):
+            page['nextPageToken'] = str(offset + page_size)
+
+        return page
+
+    def _etag(self, resource):
+        bindings = self._policies[resource]['bindings']
+
+        return base64.b64encode(
+            json.dumps(bindings, sort_keys=True).encode()
+        ).decode()[:12]
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    # Keep connections alive like the real APIs do.
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._handle()
+
+    do_POST = do_PUT = do_PATCH = do_DELETE = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length) if length else b''
+
+        try:
+            body = json.loads(data) if data else {}
+        except ValueError:
+            status, response = 400, {
+                'error': {'code': 400, 'message': "Invalid JSON body."},
+            }
+        else:
+            status, response = self.server.handle_api_request(
+                self.command, self.path, body
+            )
+
+        encoded = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+
+def _find_route(http_method, api_name, method_path):
+    for route in ROUTES:
+        if route.http_method != http_method or route.api != api_name:
+            continue
+
+        match = route.pattern.fullmatch(method_path)
+        if match:
+            return route, match
+
+    return None, None
+
+
+def _service(parent, name):
+    return {
+        'name': f'{parent}/services/{name}',
+        'parent': parent,
+        'config': {'name': name},
+        'state': 'ENABLED',
+    }
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
@@ -0,0 +1,280 @@
+import hashlib
+import json
+import os
+import re
+import subprocess
+import threading
+
+from ultideploy import cache
+
+
+# The name of the value used to record a release's digest on the release
+# itself.
+DIGEST_VALUE = 'ultideployDigest'
+
+
+def chart_digest(chart_directory, values_files=None, set_values=None):
+    """
+    Compute a digest of everything that determines a release's content.
+
+    Args:
+        chart_directory:
+            The path to the chart directory. Every file in the directory
+            contributes to the digest.
+        values_files:
+            An optional list of paths to values files passed to Helm.
+        set_values:
+            An optional dictionary of values passed to Helm with
+            ``--set``.
+
+    Returns:
+        The hex digest of the chart, values files, and set values.
+    """
+    digest = hashlib.sha256()
+
+    for path in sorted(p for p in chart_directory.rglob('*') if p.is_file()):
+        digest.update(str(path.relative_to(chart_directory)).encode())
+        digest.update(path.read_bytes())
+
+    for path in values_files or []:
+        digest.update(path.read_bytes())
+
+    for key, value in sorted((set_values or {}).items()):
+        digest.update(f'{key}={value}'.encode())
+
+    return digest.hexdigest()
+
+
+def release_digests(namespace, env, cwd=None):
+    """
+    Get the digests recorded on the deployed releases in a namespace.
+
+    Args:
+        namespace:
+            The namespace to list releases in.
+        env:
+            The environment to run ``helm`` with.
+        cwd:
+            An optional working directory to run ``helm`` from.
+
+    Returns:
+        A dictionary mapping release names to their recorded digest.
+        Releases that are not in the ``deployed`` state or that have no
+        recorded digest are omitted.
+    """
+    list_result = subprocess.run(
+        ['helm', 'list', '--namespace', namespace, '--output', 'json'],
+        check=True,
+        cwd=cwd,
+        encoding='utf8',
+        env=env,
+        stdout=subprocess.PIPE,
+    )
+    releases = json.loads(list_result.stdout or '[]')
+
+    digests = {}
+    for release in releases:
+        if release.get('status') != 'deployed':
+            continue
+
+        values_result = subprocess.run(
+            [
+                'helm',
+                'get',
+                'values',
+                release['name'],
+                '--namespace',
+                namespace,
+                '--output',
+                'json',
+            ],
+            check=True,
+            cwd=cwd,
+            encoding='utf8',
+            env=env,
+            stdout=subprocess.PIPE,
+        )
+        values = json.loads(values_result.stdout or 'null') or {}
+
+        if DIGEST_VALUE in values:
+            digests[release['name']] = values[DIGEST_VALUE]
+
+    return digests
+
+
+def upgrade_install(
+        release,
+        chart_directory,
+        namespace,
+        env,
+        values_files=None,
+        set_values=None,
+        deployed_digests=None,
+        cwd=None,
+        output=None,
+):
+    """
+    Install or upgrade a release unless its digest is unchanged.
+
+    Args:
+        release:
+            The name of the release.
+        chart_directory:
+            The path to the chart to install.
+        namespace:
+            The namespace to install the release in.
+        env:
+            The environment to run ``helm`` with.
+        values_files:
+            An optional list of paths to values files.
+        set_values:
+            An optional dictionary of values to pass with ``--set``.
+        deployed_digests:
+            An optional dictionary of the digests recorded on deployed
+            releases as returned by :func:`release_digests`.
+        cwd:
+            An optional working directory to run ``helm`` from.
+        output:
+            An optional file to write progress and the output of
+            ``helm`` to instead of the terminal.
+
+    Returns:
+        A boolean indicating if the release was upgraded.
+    """
+    values_files = values_files or []
+    set_values = set_values or {}
+
+    digest = chart_digest(chart_directory, values_files, set_values)
+    if (deployed_digests or {}).get(release) == digest:
+        print(
+            f"Release '{release}' is up to date ({digest[:12]}). Skipping.",
+            file=output,
+        )
+
+        return False
+
+    subprocess.run(
+        [
+            'helm',
+            'upgrade',
+            '--install',
+            '--namespace',
+            namespace,
+            *_values_args(values_files, set_values),
+            '--set-string',
+            f'{DIGEST_VALUE}={digest}',
+            release,
+            chart_directory,
+        ],
+        check=True,
+        cwd=cwd,
+        env=env,
+        stderr=subprocess.STDOUT if output else None,
+        stdout=output,
+    )
+
+    return True
+
+
+def render_chart(
+        release,
+        chart_directory,
+        namespace,
+        env,
+        values_files=None,
+        set_values=None,
+        cwd=None,
+):
+    """
+    Render a chart's manifests, reusing a cached rendering if the chart
+    and values are unchanged.
+
+    Args:
+        release:
+            The name of the release to render.
+        chart_directory:
+            The path to the chart to render.
+        namespace:
+            The namespace the release is installed in.
+        env:
+            The environment to run ``helm`` with.
+        values_files:
+            An optional list of paths to values files.
+        set_values:
+            An optional dictionary of values to pass with ``--set``.
+        cwd:
+            An optional working directory to run ``helm`` from.
+
+    Returns:
+        The rendered manifests as a string.
+    """
+    values_files = values_files or []
+    set_values = set_values or {}
+
+    digest = chart_digest(chart_directory, values_files, set_values)
+    cache_dir = cache.get_cache_location('helm', release)
+    rendered_path = cache_dir / f'{digest}.yaml'
+
+    if rendered_path.is_file():
+        return rendered_path.read_text()
+
+    result = subprocess.run(
+        [
+            'helm',
+            'template',
+            '--namespace',
+            namespace,
+            *_values_args(values_files, set_values),
+            release,
+            chart_directory,
+        ],
+        check=True,
+        cwd=cwd,
+        encoding='utf8',
+        env=env,
+        stdout=subprocess.PIPE,
+    )
+
+    # Only the rendering for the current digest is worth keeping. Charts
+    # may be rendered for several clusters at once, so the rendering is
+    # replaced atomically.
+    cache_dir.mkdir(exist_ok=True, parents=True)
+    for stale in cache_dir.glob('*.yaml'):
+        stale.unlink(missing_ok=True)
+    temp_path = cache_dir / f'{digest}.{threading.get_ident()}.tmp'
+    temp_path.write_text(result.stdout)
+    os.replace(temp_path, rendered_path)
+
+    return result.stdout
+
+
+def count_crd_groups(rendered, group_suffix):
+    """
+    Count the custom resource definitions in rendered manifests that
+    belong to a family of API groups.
+
+    Args:
+        rendered:
+            The rendered manifests to search.
+        group_suffix:
+            The suffix of the API groups to count, eg ``istio.io``.
+
+    Returns:
+        The number of matching custom resource definitions.
+    """
+    pattern = re.compile(
+        rf'^\s*group:\s*["\']?[\w.-]*\.{re.escape(group_suffix)}["\']?\s*$',
+        re.MULTILINE,
+    )
+
+    return len(pattern.findall(rendered))
+
+
+def _values_args(values_files, set_values):
+    args = []
+    for path in values_files:
+        args += ['-f', path]
+    for key, value in set_values.items():
+        args += ['--set', f'{key}={value}']
+
+    return args
@@ -0,0 +1,678 @@
+import base64
+import copy
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+
+import google_auth_httplib2
+import httplib2
+
+from ultideploy import cache
+
+
+# Annotation used to record the hash of the content an object was last
+# applied with.
+CONTENT_HASH_ANNOTATION = 'ultimanager.com/content-hash'
+
+# Cached kubeconfigs are regenerated once their token is this close to
+# expiring, unless the caller needs the token for longer.
+TOKEN_EXPIRY_MARGIN = datetime.timedelta(minutes=10)
+
+# Entries in a cluster's discovery and HTTP cache older than this are
+# pruned.
+KUBE_CACHE_TTL = datetime.timedelta(hours=6)
+
+# The caches of clusters that haven't been used for this long are
+# removed entirely.
+KUBE_CACHE_MAX_UNUSED = datetime.timedelta(days=30)
+
+LOAD_BALANCER_POLL_SECONDS = 5
+
+
+def manifest_list(manifests):
+    """
+    Wrap a collection of manifests in a single Kubernetes ``List``.
+
+    Args:
+        manifests:
+            An iterable of dictionaries, each representing a Kubernetes
+            object.
+
+    Returns:
+        A dictionary representing a ``List`` containing every provided
+        manifest. This can be fed directly to ``kubectl`` as a single
+        document.
+    """
+    return {
+        'apiVersion': 'v1',
+        'kind': 'List',
+        'items': list(manifests),
+    }
+
+
+def apply_manifests(manifests, env, cwd=None, output=None):
+    """
+    Apply a set of manifests with a single ``kubectl apply`` call.
+
+    The manifests are rendered in memory and streamed to ``kubectl``
+    over stdin so no intermediate files are written.
+
+    Args:
+        manifests:
+            An iterable of dictionaries representing the Kubernetes
+            objects to apply.
+        env:
+            The environment to run ``kubectl`` with. This must contain
+            the ``KUBECONFIG`` of the target cluster.
+        cwd:
+            An optional working directory to run ``kubectl`` from.
+        output:
+            An optional file to write the output of ``kubectl`` to
+            instead of the terminal.
+    """
+    subprocess.run(
+        kubectl_command(env, 'apply', '-f', '-'),
+        check=True,
+        cwd=cwd,
+        encoding='utf8',
+        env=env,
+        input=json.dumps(manifest_list(manifests)),
+        stderr=subprocess.STDOUT if output else None,
+        stdout=output,
+    )
+
+
+def cluster_cache_key(project_id, region, cluster_name):
+    """
+    Get the key identifying a cluster's entries in the cache.
+
+    Args:
+        project_id:
+            The ID of the project containing the cluster.
+        region:
+            The region the cluster is located in.
+        cluster_name:
+            The name of the cluster.
+
+    Returns:
+        A string uniquely identifying the cluster that is safe to use as
+        a file name.
+    """
+    return f'{project_id}_{region}_{cluster_name}'
+
+
+def content_hash(manifest):
+    """
+    Compute a stable hash of a manifest's content.
+
+    Any existing content hash annotation is ignored so that the hash of
+    a stamped manifest is the same as the hash of the original.
+
+    Args:
+        manifest:
+            The dictionary representing the Kubernetes object to hash.
+
+    Returns:
+        The hex digest of the manifest's content.
+    """
+    manifest = copy.deepcopy(manifest)
+    annotations = manifest.get('metadata', {}).get('annotations', {})
+    annotations.pop(CONTENT_HASH_ANNOTATION, None)
+
+    serialized = json.dumps(manifest, separators=(',', ':'), sort_keys=True)
+
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+def stamp_content_hash(manifest):
+    """
+    Create a copy of a manifest annotated with the hash of its content.
+
+    Args:
+        manifest:
+            The dictionary representing the Kubernetes object to stamp.
+
+    Returns:
+        A new dictionary with the content hash annotation added to its
+        metadata.
+    """
+    digest = content_hash(manifest)
+
+    stamped = copy.deepcopy(manifest)
+    metadata = stamped.setdefault('metadata', {})
+    metadata.setdefault('annotations', {})[CONTENT_HASH_ANNOTATION] = digest
+
+    return stamped
+
+
+def object_key(manifest):
+    """
+    Get the key identifying a Kubernetes object in the applied hash
+    index.
+
+    Args:
+        manifest:
+            The dictionary representing the Kubernetes object.
+
+    Returns:
+        A string built from the object's kind, namespace, and name.
+    """
+    metadata = manifest.get('metadata', {})
+
+    return '/'.join([
+        manifest['kind'],
+        metadata.get('namespace', ''),
+        metadata['name'],
+    ])
+
+
+def get_manifests(manifests, env, cwd=None):
+    """
+    Fetch the live versions of a set of objects with a single
+    ``kubectl get`` call.
+
+    Args:
+        manifests:
+            An iterable of dictionaries identifying the objects to
+            fetch.
+        env:
+            The environment to run ``kubectl`` with.
+        cwd:
+            An optional working directory to run ``kubectl`` from.
+
+    Returns:
+        A list of the live objects. Objects that don't exist in the
+        cluster are omitted.
+    """
+    result = subprocess.run(
+        kubectl_command(
+            env, 'get', '--ignore-not-found', '-o', 'json', '-f', '-'
+        ),
+        check=True,
+        cwd=cwd,
+        encoding='utf8',
+        env=env,
+        input=json.dumps(manifest_list(manifests)),
+        stdout=subprocess.PIPE,
+    )
+
+    if not result.stdout.strip():
+        return []
+
+    live = json.loads(result.stdout)
+    if live.get('kind') == 'List':
+        return live.get('items', [])
+
+    return [live]
+
+
+def apply_changed_manifests(
+        manifests, env, cluster_key, cwd=None, output=None
+):
+    """
+    Apply only the manifests whose content changed since they were last
+    applied to a cluster.
+
+    Each manifest is stamped with a hash of its content. Manifests whose
+    hash matches the local index of last-applied hashes are checked
+    against the cluster with a single ``kubectl get`` and skipped if the
+    live object still carries the same hash. Everything else is applied
+    in one batch.
+
+    Args:
+        manifests:
+            An iterable of dictionaries representing the Kubernetes
+            objects to apply.
+        env:
+            The environment to run ``kubectl`` with.
+        cluster_key:
+            The key identifying the target cluster in the cache.
+        cwd:
+            An optional working directory to run ``kubectl`` from.
+        output:
+            An optional file to write progress and the output of
+            ``kubectl`` to instead of the terminal.
+
+    Returns:
+        A two-element tuple containing the lists of applied and skipped
+        manifests.
+    """
+    stamped = [stamp_content_hash(manifest) for manifest in manifests]
+    applied_hashes = load_applied_hashes(cluster_key)
+
+    candidates = [
+        manifest for manifest in stamped
+        if applied_hashes.get(object_key(manifest)) == _get_hash(manifest)
+    ]
+
+    unchanged_keys = set()
+    if candidates:
+        live_hashes = {
+            object_key(live): _get_hash(live)
+            for live in get_manifests(candidates, env=env, cwd=cwd)
+        }
+
+        for manifest in candidates:
+            live_key = _live_object_key(manifest, live_hashes)
+            if live_key and live_hashes[live_key] == _get_hash(manifest):
+                unchanged_keys.add(object_key(manifest))
+
+    changed = [m for m in stamped if object_key(m) not in unchanged_keys]
+    skipped = [m for m in stamped if object_key(m) in unchanged_keys]
+
+    if skipped:
+        print(f"Skipping {len(skipped)} unchanged object(s):", file=output)
+        for manifest in skipped:
+            print(f"  - {object_key(manifest)}", file=output)
+
+    if changed:
+        apply_manifests(changed, env=env, cwd=cwd, output=output)
+
+        for manifest in changed:
+            applied_hashes[object_key(manifest)] = _get_hash(manifest)
+        save_applied_hashes(cluster_key, applied_hashes)
+
+    return changed, skipped
+
+
+def load_applied_hashes(cluster_key):
+    """
+    Load the index of last-applied content hashes for a cluster.
+
+    Args:
+        cluster_key:
+            The key identifying the cluster in the cache.
+
+    Returns:
+        A dictionary mapping object keys to their last-applied content
+        hash.
+    """
+    index_path = _applied_hashes_path(cluster_key)
+    if not index_path.is_file():
+        return {}
+
+    with index_path.open() as f:
+        return json.load(f)
+
+
+def save_applied_hashes(cluster_key, applied_hashes):
+    """
+    Persist the index of last-applied content hashes for a cluster.
+
+    Args:
+        cluster_key:
+            The key identifying the cluster in the cache.
+        applied_hashes:
+            A dictionary mapping object keys to their last-applied
+            content hash.
+    """
+    index_path = _applied_hashes_path(cluster_key)
+    index_path.parent.mkdir(exist_ok=True, parents=True)
+
+    with index_path.open('w') as f:
+        json.dump(applied_hashes, f, indent=2, sort_keys=True)
+
+
+def _live_object_key(manifest, live_keys):
+    key = object_key(manifest)
+    if key in live_keys:
+        return key
+    if manifest['metadata'].get('namespace'):
+        return None
+
+    # Objects without a namespace are either cluster scoped or were
+    # fetched from kubectl's default namespace, which the live object
+    # names. Only one namespace was queried, so at most one object
+    # can match.
+    kind, _, name = key.split('/')
+    matches = [
+        live_key for live_key in live_keys
+        if live_key.startswith(f'{kind}/') and live_key.endswith(f'/{name}')
+        and live_key.count('/') == 2
+    ]
+
+    return matches[0] if len(matches) == 1 else None
+
+
+def _applied_hashes_path(cluster_key):
+    return cache.get_cache_location('clusters', cluster_key) / 'applied-hashes.json'
+
+
+def _get_hash(manifest):
+    annotations = manifest.get('metadata', {}).get('annotations') or {}
+
+    return annotations.get(CONTENT_HASH_ANNOTATION)
+
+
+def cluster_kubeconfig(
+        cluster_key,
+        host,
+        ca_certificate,
+        google_credentials,
+        min_validity=TOKEN_EXPIRY_MARGIN,
+):
+    """
+    Get the path to a kubeconfig for a cluster, generating it if
+    necessary.
+
+    The kubeconfig is built in-process from the cluster's endpoint and
+    CA certificate and authenticates with a static access token, so
+    ``kubectl`` never needs to call out to ``gcloud``. The file is
+    cached per cluster and only regenerated when the cluster's details
+    change or the token expires within ``min_validity``.
+
+    Args:
+        cluster_key:
+            The key identifying the cluster in the cache.
+        host:
+            The address of the cluster's API server.
+        ca_certificate:
+            The PEM encoded CA certificate of the cluster.
+        google_credentials:
+            The service account credentials used to generate an access
+            token for the cluster.
+        min_validity:
+            How long the token must stay valid, which should cover the
+            longest the caller will use the kubeconfig for.
+
+    Returns:
+        The path to the kubeconfig file.
+    """
+    cluster_dir = cache.get_cache_location('clusters', cluster_key)
+    config_path = cluster_dir / 'kubeconfig'
+    meta_path = cluster_dir / 'kubeconfig-meta.json'
+
+    cluster_digest = hashlib.sha256(f'{host}\n{ca_certificate}'.encode()).hexdigest()
+
+    if config_path.is_file() and meta_path.is_file():
+        with meta_path.open() as f:
+            meta = json.load(f)
+
+        expiry = datetime.datetime.fromisoformat(meta['expiry'])
+        remaining = expiry - datetime.datetime.utcnow()
+        if meta['cluster'] == cluster_digest and remaining > min_validity:
+            return config_path
+
+    scoped_credentials = google_credentials.with_scopes(
+        ['https://www.googleapis.com/auth/cloud-platform']
+    )
+    scoped_credentials.refresh(google_auth_httplib2.Request(httplib2.Http()))
+
+    kubeconfig = {
+        'apiVersion': 'v1',
+        'kind': 'Config',
+        'clusters': [
+            {
+                'name': cluster_key,
+                'cluster': {
+                    'certificate-authority-data': base64.b64encode(
+                        ca_certificate.encode()
+                    ).decode(),
+                    'server': f'https://{host}',
+                },
+            },
+        ],
+        'contexts': [
+            {
+                'name': cluster_key,
+                'context': {
+                    'cluster': cluster_key,
+                    'user': cluster_key,
+                },
+            },
+        ],
+        'current-context': cluster_key,
+        'users': [
+            {
+                'name': cluster_key,
+                'user': {
+                    'token': scoped_credentials.token,
+                },
+            },
+        ],
+    }
+
+    cluster_dir.mkdir(exist_ok=True, parents=True)
+
+    # The kubeconfig contains a bearer token, so only the owner may read
+    # it.
+    fd = os.open(config_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(kubeconfig, f, indent=2)
+
+    with meta_path.open('w') as f:
+        json.dump({
+            'cluster': cluster_digest,
+            'expiry': scoped_credentials.expiry.isoformat(),
+        }, f)
+
+    return config_path
+
+
+def kube_cache_environment(cluster_key, env):
+    """
+    Configure an environment to use a cluster's managed discovery and
+    HTTP cache.
+
+    Every ``kubectl`` and ``helm`` call made with the returned
+    environment shares the same cache directory, so repeated calls skip
+    the full API discovery sweep. Expired entries in the cluster's cache
+    are pruned and the caches of clusters that haven't been used
+    recently are evicted.
+
+    Args:
+        cluster_key:
+            The key identifying the cluster in the cache.
+        env:
+            The environment to configure.
+
+    Returns:
+        A copy of the environment with ``KUBECACHEDIR`` pointing at the
+        cluster's cache directory.
+    """
+    cache_dir = cache.get_cache_location('clusters', cluster_key) / 'kube-cache'
+    cache_dir.mkdir(exist_ok=True, parents=True)
+
+    # Record when the cache was last used so unused caches can be
+    # evicted.
+    os.utime(cache_dir)
+
+    evict_kube_caches(KUBE_CACHE_MAX_UNUSED)
+    prune_kube_cache(cache_dir, KUBE_CACHE_TTL)
+
+    subprocess_env = env.copy()
+    subprocess_env['KUBECACHEDIR'] = str(cache_dir)
+
+    return subprocess_env
+
+
+def kubectl_command(env, *args):
+    """
+    Build a ``kubectl`` command line that uses the managed cache.
+
+    ``KUBECACHEDIR`` is only honored by recent versions of ``kubectl``,
+    so the cache directory is also passed explicitly.
+
+    Args:
+        env:
+            The environment the command will be run with.
+        *args:
+            The arguments to pass to ``kubectl``.
+
+    Returns:
+        A list containing the full command.
+    """
+    command = ['kubectl']
+    if env.get('KUBECACHEDIR'):
+        command += ['--cache-dir', env['KUBECACHEDIR']]
+
+    return command + list(args)
+
+
+def prune_kube_cache(cache_dir, ttl):
+    """
+    Remove expired entries from a discovery and HTTP cache.
+
+    Args:
+        cache_dir:
+            The cache directory to prune.
+        ttl:
+            A :class:`datetime.timedelta` giving the maximum age of a
+            cache entry.
+    """
+    cutoff = time.time() - ttl.total_seconds()
+
+    for path in sorted(cache_dir.rglob('*'), reverse=True):
+        if path.is_file() and path.stat().st_mtime < cutoff:
+            path.unlink()
+        elif path.is_dir() and not any(path.iterdir()):
+            path.rmdir()
+
+
+def evict_kube_caches(max_unused):
+    """
+    Remove the caches of clusters that haven't been used recently.
+
+    Args:
+        max_unused:
+            A :class:`datetime.timedelta` giving how long a cluster's
+            cache may go unused before it is removed.
+    """
+    clusters_dir = cache.get_cache_location('clusters', '')
+    if not clusters_dir.is_dir():
+        return
+
+    cutoff = time.time() - max_unused.total_seconds()
+
+    for cache_dir in clusters_dir.glob('*/kube-cache'):
+        if cache_dir.stat().st_mtime < cutoff:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def wait_for_rollout(env, namespace, deployment, timeout):
+    """
+    Wait for a deployment to finish rolling out.
+
+    Args:
+        env:
+            The environment to run ``kubectl`` with.
+        namespace:
+            The namespace containing the deployment.
+        deployment:
+            The name of the deployment.
+        timeout:
+            The maximum number of seconds to wait.
+
+    Returns:
+        A two-element tuple containing a boolean indicating if the
+        rollout finished and the output of ``kubectl``.
+    """
+    return _run_wait(kubectl_command(
+        env,
+        'rollout',
+        'status',
+        f'deployment/{deployment}',
+        '--namespace',
+        namespace,
+        f'--timeout={max(int(timeout), 1)}s',
+    ), env)
+
+
+def wait_for_condition(env, namespace, resource, condition, timeout):
+    """
+    Wait for an object to report a condition.
+
+    Args:
+        env:
+            The environment to run ``kubectl`` with.
+        namespace:
+            The namespace containing the object.
+        resource:
+            The object to wait for, eg ``certificate/api-cert``.
+        condition:
+            The name of the condition to wait for, eg ``Ready``.
+        timeout:
+            The maximum number of seconds to wait.
+
+    Returns:
+        A two-element tuple containing a boolean indicating if the
+        condition was reported and the output of ``kubectl``.
+    """
+    return _run_wait(kubectl_command(
+        env,
+        'wait',
+        f'--for=condition={condition}',
+        resource,
+        '--namespace',
+        namespace,
+        f'--timeout={max(int(timeout), 1)}s',
+    ), env)
+
+
+def wait_for_load_balancer_ip(env, namespace, service, address, timeout):
+    """
+    Wait for a ``LoadBalancer`` service to be bound to an address.
+
+    Args:
+        env:
+            The environment to run ``kubectl`` with.
+        namespace:
+            The namespace containing the service.
+        service:
+            The name of the service.
+        address:
+            The IP address the service is expected to be bound to.
+        timeout:
+            The maximum number of seconds to wait.
+
+    Returns:
+        A two-element tuple containing a boolean indicating if the
+        service was bound to the address and a description of the
+        service's last observed addresses.
+    """
+    deadline = time.time() + timeout
+    ips = []
+
+    while True:
+        result = subprocess.run(
+            kubectl_command(
+                env,
+                'get',
+                'service',
+                service,
+                '--namespace',
+                namespace,
+                '--output',
+                'jsonpath={.status.loadBalancer.ingress[*].ip}',
+            ),
+            encoding='utf8',
+            env=env,
+            stderr=subprocess.STDOUT,
+            stdout=subprocess.PIPE,
+        )
+
+        if result.returncode == 0:
+            ips = result.stdout.split()
+            if address in ips:
+                return True, f"Bound to {address}."
+
+        if time.time() + LOAD_BALANCER_POLL_SECONDS > deadline:
+            return False, f"Expected {address}, found {ips or 'no addresses'}."
+
+        time.sleep(LOAD_BALANCER_POLL_SECONDS)
+
+
+def _run_wait(command, env):
+    result = subprocess.run(
+        command,
+        encoding='utf8',
+        env=env,
+        stderr=subprocess.STDOUT,
+        stdout=subprocess.PIPE,
+    )
+
+    return result.returncode == 0, result.stdout.strip()
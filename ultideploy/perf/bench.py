@@ -0,0 +1,313 @@
+import asyncio
+import collections
+import datetime
+import re
+import ssl
+import time
+import urllib.parse
+
+from ultideploy.perf.histogram import Histogram
+from ultideploy.perf.results import PERCENTILES
+
+
+# Matches durations in the format accepted by Fortio, eg "30s" or "1m".
+DURATION_PATTERN = re.compile(r'^(?:(\d+)h)?(?:(\d+)m)?(?:(\d+(?:\.\d+)?)s)?$')
+
+# Fortio records requests that fail without a response with this code.
+ERROR_CODE = -1
+
+# Responses with these status codes never have a body, even without a
+# Content-Length header (RFC 9112, section 6.3).
+BODILESS_STATUSES = {204, 304}
+
+USER_AGENT = 'ultideploy-bench'
+
+
+def parse_duration(duration):
+    """
+    Parse a duration such as ``30s`` or ``1m30s``.
+
+    Args:
+        duration:
+            The duration to parse.
+
+    Returns:
+        The duration in seconds.
+    """
+    match = DURATION_PATTERN.match(duration)
+    if not duration or not match:
+        raise ValueError(f"Invalid duration: {duration}")
+
+    hours, minutes, seconds = match.groups()
+
+    return (
+        int(hours or 0) * 3600
+        + int(minutes or 0) * 60
+        + float(seconds or 0)
+    )
+
+
+async def run_load_test(
+        url,
+        qps,
+        duration,
+        connections,
+        labels,
+        timeout=10.0,
+):
+    """
+    Generate load against a URL and collect the results.
+
+    Each connection is kept alive and sends one request at a time. In
+    fixed-QPS mode the requested rate is split evenly between the
+    connections; with a QPS of zero or less, every connection sends
+    requests as fast as it can.
+
+    Args:
+        url:
+            The URL to send ``GET`` requests to.
+        qps:
+            The total number of requests per second to send, or zero
+            for maximum throughput.
+        duration:
+            A Fortio style duration string giving how long to generate
+            load for.
+        connections:
+            The number of concurrent connections to use.
+        labels:
+            A description of the test, stored in the result's labels.
+        timeout:
+            The number of seconds to wait for each response.
+
+    Returns:
+        A dictionary containing the results in the format of a Fortio
+        JSON result.
+    """
+    target = urllib.parse.urlsplit(url)
+    duration_seconds = parse_duration(duration)
+    rate = qps / connections if qps > 0 else 0
+
+    histogram = Histogram()
+    codes = collections.Counter()
+
+    start_time = datetime.datetime.now(datetime.timezone.utc)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + duration_seconds
+
+    await asyncio.gather(*[
+        _connection_worker(target, rate, deadline, timeout, histogram, codes)
+        for _ in range(connections)
+    ])
+
+    actual_duration = loop.time() - started
+    requested_qps = f'{qps:g}' if qps > 0 else 'max'
+
+    return {
+        'RunType': 'HTTP',
+        'Labels': f'{labels} Q{requested_qps} T{duration} C{connections}',
+        'StartTime': start_time.isoformat(),
+        'RequestedQPS': requested_qps,
+        'RequestedDuration': duration,
+        'ActualQPS': histogram.count / actual_duration,
+        'ActualDuration': int(actual_duration * 1e9),
+        'NumThreads': connections,
+        'Version': USER_AGENT,
+        'DurationHistogram': histogram.to_fortio(PERCENTILES),
+        'Exactly': 0,
+        'RetCodes': {str(code): count for code, count in sorted(codes.items())},
+        'URL': url,
+        'SocketCount': connections,
+        'AbortOn': 0,
+    }
+
+
+async def serve_stand_in(redirect=False):
+    """
+    Start a local HTTP server to run load tests against without a
+    cluster.
+
+    Args:
+        redirect:
+            A boolean indicating if the server should answer like the
+            HTTPS redirect service instead of with a plain ``200``.
+
+    Returns:
+        A two-element tuple containing the running
+        :class:`asyncio.Server` and the base URL it serves on.
+    """
+    async def handle(reader, writer):
+        try:
+            await _serve_connection(reader, writer, redirect)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    host, port = server.sockets[0].getsockname()[:2]
+
+    return server, f'http://{host}:{port}'
+
+
+async def _connection_worker(target, rate, deadline, timeout, histogram, codes):
+    loop = asyncio.get_running_loop()
+    interval = 1 / rate if rate else 0
+    next_request = loop.time()
+    connection = None
+
+    method = 'GET'
+    path = target.path or '/'
+    if target.query:
+        path += f'?{target.query}'
+    request = (
+        f'{method} {path} HTTP/1.1\r\n'
+        f'Host: {target.netloc}\r\n'
+        f'User-Agent: {USER_AGENT}\r\n'
+        f'\r\n'
+    ).encode()
+
+    try:
+        while True:
+            if interval:
+                delay = next_request - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                next_request += interval
+
+            if loop.time() >= deadline:
+                break
+
+            request_start = time.perf_counter()
+            try:
+                if connection is None:
+                    connection = await asyncio.wait_for(
+                        _open_connection(target), timeout
+                    )
+
+                reader, writer = connection
+                writer.write(request)
+                code, keep_alive = await asyncio.wait_for(
+                    _read_response(reader, method), timeout
+                )
+            except (
+                    OSError,
+                    ValueError,
+                    asyncio.IncompleteReadError,
+                    asyncio.TimeoutError,
+            ):
+                code, keep_alive = ERROR_CODE, False
+
+            histogram.record(time.perf_counter() - request_start)
+            codes[code] += 1
+
+            if not keep_alive and connection is not None:
+                connection[1].close()
+                connection = None
+    finally:
+        if connection is not None:
+            connection[1].close()
+
+
+async def _open_connection(target):
+    if target.scheme == 'https':
+        return await asyncio.open_connection(
+            target.hostname,
+            target.port or 443,
+            ssl=ssl.create_default_context(),
+        )
+
+    return await asyncio.open_connection(target.hostname, target.port or 80)
+
+
+async def _read_response(reader, method='GET'):
+    while True:
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by server.")
+
+        code = int(status_line.split()[1])
+        headers = await _read_headers(reader)
+
+        # Interim responses, such as 100 Continue, precede the real one.
+        if not 100 <= code < 200 or code == 101:
+            break
+
+    keep_alive = headers.get('connection', '').lower() != 'close'
+
+    # These responses never have a body, whatever their headers say.
+    if method == 'HEAD' or code in BODILESS_STATUSES or 100 <= code < 200:
+        return code, keep_alive
+
+    # A transfer encoding takes precedence over a content length.
+    transfer_encoding = headers.get('transfer-encoding', '').lower()
+    if transfer_encoding:
+        if transfer_encoding.split(',')[-1].strip() != 'chunked':
+            # Without chunking the body ends when the connection closes.
+            await reader.read()
+
+            return code, False
+
+        while True:
+            size_line = await reader.readline()
+            if not size_line:
+                raise asyncio.IncompleteReadError(b'', None)
+
+            chunk_size = int(size_line.split(b';')[0], 16)
+            if not chunk_size:
+                break
+
+            await reader.readexactly(chunk_size + 2)
+
+        # The last chunk is followed by optional trailers and a blank
+        # line.
+        await _read_headers(reader)
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    else:
+        # Without a length the body ends when the connection closes.
+        await reader.read()
+        keep_alive = False
+
+    return code, keep_alive
+
+
+async def _read_headers(reader):
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            return headers
+
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+
+async def _serve_connection(reader, writer, redirect):
+    while True:
+        request_line = await reader.readline()
+        if not request_line:
+            return
+
+        _, path, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = await _read_headers(reader)
+
+        if redirect:
+            host = headers.get('host', 'localhost')
+            response = (
+                f'HTTP/1.1 301 Moved Permanently\r\n'
+                f'Location: https://{host}{path}\r\n'
+                f'Content-Length: 0\r\n'
+                f'\r\n'
+            )
+        else:
+            response = (
+                'HTTP/1.1 200 OK\r\n'
+                'Content-Type: text/plain\r\n'
+                'Content-Length: 2\r\n'
+                '\r\n'
+                'OK'
+            )
+
+        writer.write(response.encode())
+        await writer.drain()
@@ -0,0 +1,178 @@
+import numpy as np
+
+from ultideploy.perf.results import GROUP_COLUMNS, PERCENTILE_COLUMNS
+
+
+# Metrics where a higher value is a regression.
+LATENCY_METRICS = ('avg', *PERCENTILE_COLUMNS)
+
+# Metrics where a lower value is a regression.
+THROUGHPUT_METRICS = ('actual_qps',)
+
+
+class MetricComparison:
+    """
+    The comparison of a single metric between two sets of runs.
+    """
+
+    def __init__(
+            self,
+            group,
+            metric,
+            baseline_mean,
+            candidate_mean,
+            delta,
+            ci_low,
+            ci_high,
+            regressed,
+            relative=True,
+    ):
+        self.group = group
+        self.metric = metric
+        self.baseline_mean = baseline_mean
+        self.candidate_mean = candidate_mean
+        self.delta = delta
+        self.ci_low = ci_low
+        self.ci_high = ci_high
+        self.regressed = regressed
+        self.relative = relative
+
+
+def bootstrap_delta(baseline, candidate, iterations, confidence, rng):
+    """
+    Compute the relative change in the mean of a metric along with a
+    bootstrap confidence interval.
+
+    A relative change is undefined when the baseline's mean, or the mean
+    of any resample of it, is zero, eg for a metric that was zero in
+    every baseline run. The absolute change is computed instead.
+
+    Args:
+        baseline:
+            An array of the metric's value in each baseline run.
+        candidate:
+            An array of the metric's value in each candidate run.
+        iterations:
+            The number of bootstrap resamples to draw.
+        confidence:
+            The confidence level of the interval, eg ``0.95``.
+        rng:
+            The :class:`numpy.random.Generator` to resample with.
+
+    Returns:
+        A four-element tuple containing the change of the candidate's
+        mean from the baseline's mean, the lower and upper bounds of its
+        confidence interval, and a boolean indicating if the change is
+        relative rather than absolute.
+    """
+    baseline_mean = baseline.mean()
+
+    # Resample every iteration at once, one row per iteration.
+    baseline_means = rng.choice(
+        baseline, size=(iterations, len(baseline))
+    ).mean(axis=1)
+    candidate_means = rng.choice(
+        candidate, size=(iterations, len(candidate))
+    ).mean(axis=1)
+
+    delta = candidate.mean() - baseline_mean
+    deltas = candidate_means - baseline_means
+
+    relative = bool(baseline_mean != 0 and np.all(baseline_means != 0))
+    if relative:
+        delta /= baseline_mean
+        deltas /= baseline_means
+
+    tail = (1 - confidence) / 2 * 100
+    ci_low, ci_high = np.percentile(deltas, [tail, 100 - tail])
+
+    return delta, ci_low, ci_high, relative
+
+
+def compare_results(
+        baseline,
+        candidate,
+        latency_threshold,
+        throughput_threshold,
+        metrics=None,
+        iterations=2000,
+        confidence=0.95,
+        seed=None,
+):
+    """
+    Compare two sets of Fortio results.
+
+    Runs are aligned by label, QPS, and client count. A metric regresses
+    when its change is past the threshold and the confidence interval of
+    the change excludes zero.
+
+    Args:
+        baseline:
+            A :class:`ResultTable` of the baseline runs.
+        candidate:
+            A :class:`ResultTable` of the candidate runs.
+        latency_threshold:
+            The relative increase in a latency metric that is considered
+            a regression, eg ``0.1`` for 10%.
+        throughput_threshold:
+            The relative decrease in throughput that is considered a
+            regression.
+        metrics:
+            The names of the metrics to compare. Defaults to every
+            latency and throughput metric.
+        iterations:
+            The number of bootstrap resamples to draw.
+        confidence:
+            The confidence level of the intervals.
+        seed:
+            An optional seed for the bootstrap resampling.
+
+    Returns:
+        A two-element tuple containing a list of
+        :class:`MetricComparison` instances and a list of the groups
+        that are only present in one of the result sets.
+    """
+    metrics = metrics or LATENCY_METRICS + THROUGHPUT_METRICS
+    rng = np.random.default_rng(seed)
+
+    baseline_groups = baseline.group_indices(GROUP_COLUMNS)
+    candidate_groups = candidate.group_indices(GROUP_COLUMNS)
+
+    unmatched = sorted(set(baseline_groups) ^ set(candidate_groups))
+
+    comparisons = []
+    for group in sorted(set(baseline_groups) & set(candidate_groups)):
+        for metric in metrics:
+            baseline_values = baseline[metric][baseline_groups[group]]
+            candidate_values = candidate[metric][candidate_groups[group]]
+
+            delta, ci_low, ci_high, relative = bootstrap_delta(
+                baseline_values,
+                candidate_values,
+                iterations,
+                confidence,
+                rng,
+            )
+
+            # Thresholds are relative, so an absolute change regresses
+            # as soon as its confidence interval excludes zero.
+            if metric in THROUGHPUT_METRICS:
+                threshold = throughput_threshold if relative else 0
+                regressed = delta < -threshold and ci_high < 0
+            else:
+                threshold = latency_threshold if relative else 0
+                regressed = delta > threshold and ci_low > 0
+
+            comparisons.append(MetricComparison(
+                group,
+                metric,
+                baseline_values.mean(),
+                candidate_values.mean(),
+                delta,
+                ci_low,
+                ci_high,
+                regressed,
+                relative=relative,
+            ))
+
+    return comparisons, unmatched
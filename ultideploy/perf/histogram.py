@@ -0,0 +1,187 @@
+import math
+
+import numpy as np
+
+
+# Every histogram shares the same log-spaced bin edges, from 1µs to
+# 1000s with 100 bins per decade, so histograms can be merged by adding
+# their bin counts and use a fixed amount of memory no matter how many
+# values or results are merged into them.
+BIN_EDGES = np.logspace(-6, 3, 9 * 100 + 1)
+
+
+class Histogram:
+    """
+    A mergeable histogram of request durations, in seconds.
+    """
+
+    def __init__(self):
+        self.counts = np.zeros(len(BIN_EDGES) - 1)
+        self.count = 0
+        self.sum = 0.0
+        self.sum_squares = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    @property
+    def avg(self):
+        return self.sum / self.count if self.count else math.nan
+
+    @property
+    def stddev(self):
+        if not self.count:
+            return math.nan
+
+        variance = self.sum_squares / self.count - self.avg ** 2
+
+        return math.sqrt(max(variance, 0.0))
+
+    def record(self, value):
+        """
+        Record a single duration.
+
+        Args:
+            value:
+                The duration to record, in seconds.
+        """
+        self.counts[_bin_index(value)] += 1
+        self.count += 1
+        self.sum += value
+        self.sum_squares += value * value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def add_fortio(self, histogram):
+        """
+        Merge a histogram from a Fortio result.
+
+        The counts of each Fortio bucket are spread over the bins it
+        overlaps, assuming values are uniformly distributed within the
+        bucket.
+
+        Args:
+            histogram:
+                The ``DurationHistogram`` object of a Fortio result.
+        """
+        count = histogram.get('Count', 0)
+        if not count:
+            return
+
+        for bucket in histogram.get('Data') or []:
+            self._add_range(bucket['Start'], bucket['End'], bucket['Count'])
+
+        avg = histogram['Avg']
+        stddev = histogram.get('StdDev', 0.0)
+
+        self.count += count
+        self.sum += histogram.get('Sum', avg * count)
+        self.sum_squares += (stddev ** 2 + avg ** 2) * count
+        self.min = min(self.min, histogram['Min'])
+        self.max = max(self.max, histogram['Max'])
+
+    def merge(self, other):
+        """
+        Merge another histogram into this one.
+
+        Args:
+            other:
+                The histogram to merge.
+        """
+        self.counts += other.counts
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_squares += other.sum_squares
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percentile):
+        """
+        Estimate a percentile of the recorded durations.
+
+        The value is interpolated linearly within the bin containing
+        the percentile and clamped to the observed minimum and maximum.
+
+        Args:
+            percentile:
+                The percentile to compute, between 0 and 100.
+
+        Returns:
+            The estimated duration at the percentile, in seconds.
+        """
+        total = self.counts.sum()
+        if not total:
+            return math.nan
+        if percentile <= 0:
+            return self.min
+        if percentile >= 100:
+            return self.max
+
+        target = total * percentile / 100
+        cumulative = np.cumsum(self.counts)
+        index = min(
+            int(np.searchsorted(cumulative, target)), len(self.counts) - 1
+        )
+
+        previous = cumulative[index - 1] if index else 0.0
+        fraction = (target - previous) / self.counts[index]
+        lower = max(BIN_EDGES[index], self.min)
+        upper = min(BIN_EDGES[index + 1], self.max)
+
+        return lower + fraction * max(upper - lower, 0.0)
+
+    def to_fortio(self, percentiles):
+        """
+        Convert the histogram into a Fortio ``DurationHistogram``.
+
+        Args:
+            percentiles:
+                The percentiles to include in the output.
+
+        Returns:
+            A dictionary in the format of a Fortio result's
+            ``DurationHistogram``.
+        """
+        data = []
+        cumulative = 0
+        total = self.counts.sum()
+
+        for index in np.flatnonzero(self.counts):
+            count = self.counts[index]
+            cumulative += count
+            data.append({
+                'Start': max(float(BIN_EDGES[index]), self.min),
+                'End': min(float(BIN_EDGES[index + 1]), self.max),
+                'Percent': 100 * cumulative / total,
+                'Count': int(round(count)),
+            })
+
+        return {
+            'Count': self.count,
+            'Min': self.min if self.count else 0,
+            'Max': self.max if self.count else 0,
+            'Sum': self.sum,
+            'Avg': self.avg if self.count else 0,
+            'StdDev': self.stddev if self.count else 0,
+            'Data': data,
+            'Percentiles': [
+                {'Percentile': p, 'Value': self.percentile(p)}
+                for p in percentiles
+            ] if self.count else [],
+        }
+
+    def _add_range(self, start, end, count):
+        first = _bin_index(start)
+        last = _bin_index(end)
+
+        if first == last or end <= start:
+            self.counts[first] += count
+            return
+
+        bounds = np.concatenate(([start], BIN_EDGES[first + 1:last + 1], [end]))
+        self.counts[first:last + 1] += count * np.diff(bounds) / (end - start)
+
+
+def _bin_index(value):
+    index = int(np.searchsorted(BIN_EDGES, value, side='right')) - 1
+
+    return min(max(index, 0), len(BIN_EDGES) - 2)
@@ -0,0 +1,430 @@
+import concurrent.futures
+import json
+import math
+import os
+
+import numpy as np
+
+from ultideploy.perf.histogram import Histogram
+
+
+# The percentiles reported by Fortio that are extracted from each result.
+PERCENTILES = (50, 75, 90, 99, 99.9)
+PERCENTILE_COLUMNS = tuple(f'p{p:g}' for p in PERCENTILES)
+
+# Columns identifying the configuration a result was produced with.
+KEY_COLUMNS = ('label', 'qps', 'duration', 'clients')
+
+# Columns results are grouped by when aggregating repeated runs.
+GROUP_COLUMNS = ('label', 'qps', 'clients')
+
+METRIC_COLUMNS = (
+    'min', 'max', 'avg', *PERCENTILE_COLUMNS, 'actual_qps', 'count',
+)
+
+COLUMNS = KEY_COLUMNS + METRIC_COLUMNS
+
+# The index of each column in a row.
+COLUMN_INDEX = {name: index for index, name in enumerate(COLUMNS)}
+
+# Below this number of files, starting worker processes costs more than
+# it saves.
+PARALLEL_THRESHOLD = 64
+
+COLUMN_TYPES = {
+    'label': np.str_,
+    'qps': np.str_,
+    'duration': np.str_,
+    'clients': np.int64,
+    'count': np.int64,
+}
+
+# The CSV header written by Istio's ``convert_perf_results.py``. Labels
+# are written as-is, so the first three columns assume labels made up of
+# a label, driver, and target.
+CSV_HEADER = (
+    'Label,Driver,Target,qps,duration,clients,min,max,avg,'
+    + ','.join(PERCENTILE_COLUMNS)
+)
+
+
+def find_result_files(directory):
+    """
+    Find the Fortio result files in a directory.
+
+    Args:
+        directory:
+            The directory to search.
+
+    Returns:
+        A sorted list of the paths of the JSON files in the directory.
+    """
+    with os.scandir(directory) as entries:
+        return sorted(
+            entry.path for entry in entries
+            if entry.is_file() and entry.name.endswith('.json')
+        )
+
+
+def parse_result(data):
+    """
+    Convert a Fortio result into a row of the result table.
+
+    Args:
+        data:
+            The parsed contents of a Fortio JSON result.
+
+    Returns:
+        A tuple containing the value of each column in ``COLUMNS``.
+    """
+    labels = ','.join(
+        label for label in data['Labels'].split()
+        if label[0] not in ('Q', 'T', 'C')
+    )
+
+    histogram = data['DurationHistogram']
+    percentiles = {
+        entry['Percentile']: entry['Value']
+        for entry in histogram.get('Percentiles') or []
+    }
+
+    return (
+        labels,
+        str(data['RequestedQPS']),
+        str(data['RequestedDuration']),
+        int(data['NumThreads']),
+        histogram['Min'],
+        histogram['Max'],
+        histogram['Avg'],
+        *[percentiles.get(p, math.nan) for p in PERCENTILES],
+        data.get('ActualQPS', math.nan),
+        histogram.get('Count', 0),
+    )
+
+
+def load_results(paths, workers=None):
+    """
+    Load a set of Fortio result files into a columnar table.
+
+    Files are parsed in a process pool, in chunks to keep the overhead
+    of passing results between processes low.
+
+    Args:
+        paths:
+            The paths of the result files to load.
+        workers:
+            The number of processes to parse files with. Defaults to
+            the number of CPUs.
+
+    Returns:
+        A :class:`ResultTable` with one row per result file.
+    """
+    paths = list(paths)
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or len(paths) < PARALLEL_THRESHOLD:
+        return ResultTable.from_rows(_parse_files(paths))
+
+    chunk_size = max(1, math.ceil(len(paths) / (workers * 4)))
+    chunks = [
+        paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)
+    ]
+
+    rows = []
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        for chunk_rows in executor.map(_parse_files, chunks):
+            rows.extend(chunk_rows)
+
+    return ResultTable.from_rows(rows)
+
+
+def merge_results(paths, keys=GROUP_COLUMNS, workers=None):
+    """
+    Compute true aggregate statistics for repeated runs by merging their
+    duration histograms.
+
+    Results are streamed through fixed-size histograms, one per group,
+    so memory use doesn't grow with the number of runs merged. Chunks of
+    files are merged in a process pool and the partial histograms are
+    then merged together.
+
+    Args:
+        paths:
+            The paths of the result files to merge.
+        keys:
+            The names of the columns identifying a group of runs.
+        workers:
+            The number of processes to merge files with. Defaults to the
+            number of CPUs.
+
+    Returns:
+        A :class:`ResultTable` with one row per group and an additional
+        ``runs`` column containing the number of runs merged.
+    """
+    paths = list(paths)
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or len(paths) < PARALLEL_THRESHOLD:
+        groups = _merge_files(paths, keys)
+    else:
+        chunk_size = max(1, math.ceil(len(paths) / (workers * 4)))
+        chunks = [
+            paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)
+        ]
+
+        groups = {}
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            for partial in executor.map(_merge_files, chunks, [keys] * len(chunks)):
+                _merge_groups(groups, partial)
+
+    columns = {key: [] for key in (*keys, *METRIC_COLUMNS, 'runs')}
+    for key, group in sorted(groups.items()):
+        histogram = group['histogram']
+
+        for name, value in zip(keys, key):
+            columns[name].append(value)
+
+        columns['min'].append(histogram.min)
+        columns['max'].append(histogram.max)
+        columns['avg'].append(histogram.avg)
+        for name, percentile in zip(PERCENTILE_COLUMNS, PERCENTILES):
+            columns[name].append(histogram.percentile(percentile))
+        columns['actual_qps'].append(group['actual_qps'] / group['runs'])
+        columns['count'].append(histogram.count)
+        columns['runs'].append(group['runs'])
+
+    return ResultTable({
+        name: np.array(
+            values,
+            dtype=COLUMN_TYPES.get(name, np.int64 if name == 'runs' else np.float64),
+        )
+        for name, values in columns.items()
+    })
+
+
+class ResultTable:
+    """
+    A columnar table of Fortio results backed by NumPy arrays.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns['label'])
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Build a table from a sequence of rows.
+
+        Args:
+            rows:
+                A sequence of tuples containing the value of each column
+                in ``COLUMNS``.
+
+        Returns:
+            A new table containing the rows.
+        """
+        values = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+
+        return cls({
+            name: np.array(column, dtype=COLUMN_TYPES.get(name, np.float64))
+            for name, column in zip(COLUMNS, values)
+        })
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a table saved with :meth:`save`.
+
+        Args:
+            path:
+                The path of the saved table.
+
+        Returns:
+            The loaded table.
+        """
+        with np.load(path) as data:
+            return cls({name: data[name] for name in data.files})
+
+    def save(self, path):
+        """
+        Save the table in a compressed binary columnar format.
+
+        Args:
+            path:
+                The path to save the table to. By convention this ends
+                in ``.npz``.
+        """
+        np.savez_compressed(path, **self.columns)
+
+    def group_indices(self, keys=GROUP_COLUMNS):
+        """
+        Find the rows that share the same values for a set of columns.
+
+        Args:
+            keys:
+                The names of the columns to group by.
+
+        Returns:
+            A dictionary mapping tuples of key values to arrays of the
+            indices of the rows in each group.
+        """
+        groups = {}
+        key_rows = zip(*(self.columns[key].tolist() for key in keys))
+        for index, key in enumerate(key_rows):
+            groups.setdefault(key, []).append(index)
+
+        return {key: np.array(indices) for key, indices in groups.items()}
+
+    def group_by(self, keys=GROUP_COLUMNS):
+        """
+        Aggregate the rows that share the same values for a set of
+        columns.
+
+        Minimums and maximums are combined exactly, the average is
+        weighted by request count, and the remaining metrics are
+        averaged across runs. Averaged percentiles are only an
+        approximation; use :func:`merge_results` to compute exact
+        aggregate percentiles from the runs' histograms.
+
+        Args:
+            keys:
+                The names of the columns to group by.
+
+        Returns:
+            A new table with one row per group and an additional
+            ``runs`` column containing the number of rows in each group.
+        """
+        if not len(self):
+            return ResultTable({
+                **{key: self.columns[key] for key in keys},
+                **{name: self.columns[name] for name in METRIC_COLUMNS},
+                'runs': np.zeros(0, dtype=np.int64),
+            })
+
+        codes = []
+        for key in keys:
+            uniques, inverse = np.unique(self.columns[key], return_inverse=True)
+            codes.append((inverse, len(uniques)))
+
+        combined = np.ravel_multi_index(
+            [inverse for inverse, _ in codes], [size for _, size in codes]
+        )
+        _, first_index, groups = np.unique(
+            combined, return_index=True, return_inverse=True
+        )
+        group_count = len(first_index)
+        runs = np.bincount(groups, minlength=group_count)
+
+        columns = {key: self.columns[key][first_index] for key in keys}
+
+        minimums = np.full(group_count, np.inf)
+        np.minimum.at(minimums, groups, self.columns['min'])
+        columns['min'] = minimums
+
+        maximums = np.full(group_count, -np.inf)
+        np.maximum.at(maximums, groups, self.columns['max'])
+        columns['max'] = maximums
+
+        counts = np.bincount(
+            groups, weights=self.columns['count'], minlength=group_count
+        )
+        weighted_sums = np.bincount(
+            groups,
+            weights=self.columns['avg'] * self.columns['count'],
+            minlength=group_count,
+        )
+        with np.errstate(invalid='ignore', divide='ignore'):
+            columns['avg'] = weighted_sums / counts
+
+        for name in (*PERCENTILE_COLUMNS, 'actual_qps'):
+            columns[name] = np.bincount(
+                groups, weights=self.columns[name], minlength=group_count
+            ) / runs
+
+        columns['count'] = counts.astype(np.int64)
+        columns['runs'] = runs
+
+        return ResultTable(columns)
+
+    def write_csv(self, file):
+        """
+        Write the table as CSV in the format produced by Istio's
+        ``convert_perf_results.py``.
+
+        Args:
+            file:
+                The file-like object to write to.
+        """
+        include_runs = 'runs' in self.columns
+        header = CSV_HEADER + (',runs' if include_runs else '')
+        file.write(header + '\n')
+
+        columns = [
+            'label', 'qps', 'duration', 'clients', 'min', 'max', 'avg',
+            *PERCENTILE_COLUMNS,
+        ]
+        if include_runs:
+            columns.append('runs')
+
+        # ``duration`` is not part of the default grouping, so grouped
+        # tables may not have it.
+        arrays = [
+            self.columns.get(name, np.full(len(self), ''))
+            for name in columns
+        ]
+        for row in zip(*arrays):
+            file.write(','.join(_format_value(value) for value in row) + '\n')
+
+
+def _format_value(value):
+    if isinstance(value, (float, np.floating)):
+        return repr(float(value))
+
+    return str(value)
+
+
+def _parse_files(paths):
+    rows = []
+    for path in paths:
+        with open(path) as f:
+            rows.append(parse_result(json.load(f)))
+
+    return rows
+
+
+def _merge_files(paths, keys):
+    groups = {}
+    for path in paths:
+        with open(path) as f:
+            data = json.load(f)
+
+        row = parse_result(data)
+        key = tuple(row[COLUMN_INDEX[name]] for name in keys)
+
+        group = groups.setdefault(key, {
+            'actual_qps': 0.0,
+            'histogram': Histogram(),
+            'runs': 0,
+        })
+        group['actual_qps'] += row[COLUMN_INDEX['actual_qps']]
+        group['histogram'].add_fortio(data['DurationHistogram'])
+        group['runs'] += 1
+
+    return groups
+
+
+def _merge_groups(groups, partial):
+    for key, group in partial.items():
+        if key not in groups:
+            groups[key] = group
+            continue
+
+        groups[key]['actual_qps'] += group['actual_qps']
+        groups[key]['histogram'].merge(group['histogram'])
+        groups[key]['runs'] += group['runs']
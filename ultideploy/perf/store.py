@@ -0,0 +1,263 @@
+import datetime
+import json
+import os
+import re
+import sqlite3
+
+from ultideploy.perf.results import COLUMNS, METRIC_COLUMNS, parse_result
+
+
+# Maps metric names to the columns they are stored in. Metric names
+# like "p99.9" are not valid column names.
+METRIC_STORE_COLUMNS = {
+    name: name.replace('.', '_') for name in METRIC_COLUMNS
+}
+
+# Start times are stored as UTC in this format, so ordering them as text
+# orders them chronologically.
+START_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+# Matches start times that are already normalized.
+NORMALIZED_START_TIME_GLOB = '????-??-??T??:??:??.??????Z'
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    run_id INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    start_time TEXT,
+    istio_version TEXT,
+    label TEXT NOT NULL,
+    qps TEXT NOT NULL,
+    duration TEXT NOT NULL,
+    clients INTEGER NOT NULL,
+    {', '.join(f'{column} REAL' for column in METRIC_STORE_COLUMNS.values())},
+    histogram TEXT
+);
+
+CREATE INDEX IF NOT EXISTS runs_by_label ON runs (
+    label, qps, clients, istio_version, start_time
+);
+
+CREATE INDEX IF NOT EXISTS runs_by_time ON runs (start_time);
+"""
+
+
+class ResultStore:
+    """
+    An indexed SQLite store of Fortio results.
+    """
+
+    def __init__(self, path):
+        """
+        Open a result store, creating it if it doesn't exist.
+
+        Args:
+            path:
+                The path of the SQLite database.
+        """
+        path.parent.mkdir(exist_ok=True, parents=True)
+
+        self.connection = sqlite3.connect(str(path))
+        self.connection.executescript(SCHEMA)
+
+        # Runs ingested before start times were normalized keep their
+        # original offsets, which don't sort chronologically.
+        self.connection.create_function(
+            'normalize_start_time', 1, normalize_start_time
+        )
+        with self.connection:
+            self.connection.execute(
+                'UPDATE runs SET start_time = normalize_start_time(start_time) '
+                'WHERE start_time NOT GLOB ?',
+                (NORMALIZED_START_TIME_GLOB,),
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def ingest(self, directory, istio_version=None):
+        """
+        Ingest the Fortio results in a directory.
+
+        Only files that are new or have changed since they were last
+        ingested are parsed.
+
+        Args:
+            directory:
+                The directory containing the Fortio JSON results.
+            istio_version:
+                The version of Istio the results were measured against.
+
+        Returns:
+            A two-element tuple containing the number of ingested files
+            and the number of unchanged files that were skipped.
+        """
+        known = dict(
+            ((path, (mtime_ns, size)) for path, mtime_ns, size in
+             self.connection.execute('SELECT path, mtime_ns, size FROM files'))
+        )
+
+        ingested = 0
+        skipped = 0
+        with self.connection:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if not entry.is_file() or not entry.name.endswith('.json'):
+                        continue
+
+                    path = os.path.abspath(entry.path)
+                    stat = entry.stat()
+                    if known.get(path) == (stat.st_mtime_ns, stat.st_size):
+                        skipped += 1
+                        continue
+
+                    self._ingest_file(path, stat, istio_version)
+                    ingested += 1
+
+        return ingested, skipped
+
+    def trend(
+            self,
+            label,
+            metric='p99',
+            qps=None,
+            clients=None,
+            istio_version=None,
+            last=30,
+    ):
+        """
+        Get the value of a metric for a label across recent runs.
+
+        Args:
+            label:
+                The label of the runs to query.
+            metric:
+                The name of the metric to return.
+            qps:
+                An optional requested QPS to filter runs by.
+            clients:
+                An optional client count to filter runs by.
+            istio_version:
+                An optional Istio version to filter runs by.
+            last:
+                The number of most recent runs to return.
+
+        Returns:
+            A list of tuples containing the start time, requested QPS,
+            client count, Istio version, and metric value of each run,
+            oldest first.
+        """
+        if metric not in METRIC_STORE_COLUMNS:
+            raise ValueError(f"Unknown metric: {metric}")
+
+        conditions = ['label = ?']
+        parameters = [label]
+        for column, value in (
+                ('qps', qps),
+                ('clients', clients),
+                ('istio_version', istio_version),
+        ):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                parameters.append(value)
+
+        rows = self.connection.execute(
+            f"""
+            SELECT start_time, qps, clients, istio_version,
+                   {METRIC_STORE_COLUMNS[metric]}
+            FROM runs
+            WHERE {' AND '.join(conditions)}
+            ORDER BY start_time DESC, id DESC
+            LIMIT ?
+            """,
+            parameters + [last],
+        ).fetchall()
+
+        return list(reversed(rows))
+
+    def _ingest_file(self, path, stat, istio_version):
+        with open(path) as f:
+            data = json.load(f)
+
+        row = dict(zip(COLUMNS, parse_result(data)))
+
+        previous = self.connection.execute(
+            'SELECT run_id FROM files WHERE path = ?', (path,)
+        ).fetchone()
+        if previous:
+            self.connection.execute(
+                'DELETE FROM runs WHERE id = ?', (previous[0],)
+            )
+
+        columns = [
+            'path', 'start_time', 'istio_version', 'label', 'qps',
+            'duration', 'clients', *METRIC_STORE_COLUMNS.values(),
+            'histogram',
+        ]
+        values = [
+            path,
+            normalize_start_time(data.get('StartTime')),
+            istio_version,
+            row['label'],
+            row['qps'],
+            row['duration'],
+            row['clients'],
+            *[row[metric] for metric in METRIC_STORE_COLUMNS],
+            json.dumps(data['DurationHistogram']),
+        ]
+        cursor = self.connection.execute(
+            f"INSERT INTO runs ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' * len(columns))})",
+            values,
+        )
+
+        self.connection.execute(
+            'INSERT OR REPLACE INTO files (path, mtime_ns, size, run_id) '
+            'VALUES (?, ?, ?, ?)',
+            (path, stat.st_mtime_ns, stat.st_size, cursor.lastrowid),
+        )
+
+
+def normalize_start_time(start_time):
+    """
+    Convert a Fortio start time to UTC in :data:`START_TIME_FORMAT`.
+
+    Args:
+        start_time:
+            The ISO 8601 start time of a run, eg
+            ``2019-10-28T18:44:52.123456789-07:00``.
+
+    Returns:
+        The normalized start time, or the original value if it can't be
+        parsed.
+    """
+    if not start_time:
+        return start_time
+
+    # Fortio records nanoseconds, but Python only parses microseconds.
+    value = re.sub(r'(\.\d{6})\d+', r'\1', start_time)
+    value = re.sub(r'Z$', '+00:00', value)
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return start_time
+
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+
+    return parsed.astimezone(datetime.timezone.utc).strftime(
+        START_TIME_FORMAT
+    )
@@ -0,0 +1,213 @@
+import collections
+import concurrent.futures
+import json
+import os
+import re
+import shutil
+import subprocess
+
+from ultideploy import cache
+
+
+Tool = collections.namedtuple(
+    'Tool', ['name', 'command', 'pattern', 'minimum', 'required', 'purpose']
+)
+
+# The tools deployments run, how to find their version, and the oldest
+# version that works.
+TOOLS = {
+    tool.name: tool for tool in [
+        Tool(
+            'terraform',
+            ['terraform', 'version'],
+            re.compile(r'Terraform v(\d+\.\d+\.\d+)'),
+            (0, 12, 0),
+            True,
+            "applies every infrastructure configuration",
+        ),
+        Tool(
+            'gcloud',
+            ['gcloud', 'version'],
+            re.compile(r'Google Cloud SDK (\d+\.\d+\.\d+)'),
+            None,
+            False,
+            "fetches cluster credentials when Terraform doesn't output them",
+        ),
+        Tool(
+            'kubectl',
+            ['kubectl', 'version', '--client', '--output', 'json'],
+            re.compile(r'"gitVersion":\s*"v(\d+\.\d+\.\d+)'),
+            (1, 13, 0),
+            True,
+            "installs Istio",
+        ),
+        Tool(
+            'helm',
+            ['helm', 'version', '--short'],
+            re.compile(r'v(\d+\.\d+\.\d+)'),
+            (3, 0, 0),
+            True,
+            "installs the Istio charts",
+        ),
+    ]
+}
+
+# The number of seconds a tool has to report its version.
+PROBE_TIMEOUT = 30
+
+
+def check_tools(names):
+    """
+    Check that tools are installed and new enough.
+
+    The tools are probed concurrently. Versions are cached by the path
+    of the tool's binary and its modification time, so a tool is only
+    probed again after it is upgraded or moved.
+
+    Args:
+        names:
+            The names of the tools in :data:`TOOLS` to check.
+
+    Returns:
+        A list of dictionaries containing each tool's name, path,
+        version, and an error or warning if there is a problem with it.
+    """
+    tools = [TOOLS[name] for name in names]
+    cache_path = cache.get_cache_location('preflight', 'versions.json')
+    versions = _load_versions(cache_path)
+
+    with concurrent.futures.ThreadPoolExecutor(len(tools)) as executor:
+        checks = list(executor.map(
+            lambda tool: _check_tool(tool, versions), tools
+        ))
+
+    probed = {path: entry for _, path, entry in checks if entry is not None}
+    if probed:
+        versions.update(probed)
+        _save_versions(cache_path, versions)
+
+    return [result for result, _, _ in checks]
+
+
+def print_report(results):
+    """
+    Print the outcome of a tool check.
+
+    Args:
+        results:
+            The results returned by :func:`check_tools`.
+
+    Returns:
+        A boolean indicating if every required tool is usable.
+    """
+    print("Checking tools...")
+    for result in results:
+        version = result['version'] or '-'
+        line = f"  {result['name']:<10} {version:<10} {result['path'] or ''}"
+        print(line.rstrip())
+
+    usable = True
+    for result in results:
+        if result.get('error'):
+            usable = False
+            print(f"\nError: {result['error']}")
+        elif result.get('warning'):
+            print(f"\nWarning: {result['warning']}")
+
+    return usable
+
+
+def _check_tool(tool, versions):
+    result = {'name': tool.name, 'path': None, 'version': None}
+    problem = 'error' if tool.required else 'warning'
+
+    binary = shutil.which(tool.command[0])
+    if binary is None:
+        result[problem] = (
+            f"'{tool.name}' was not found on the PATH. It {tool.purpose}."
+        )
+
+        return result, None, None
+
+    path = os.path.realpath(binary)
+    result['path'] = binary
+    stat = os.stat(path)
+
+    entry = None
+    cached = versions.get(path)
+    if cached and [cached['mtime_ns'], cached['size']] == [
+            stat.st_mtime_ns, stat.st_size
+    ]:
+        version = cached['version']
+    else:
+        version = _probe_version(tool, binary)
+        if version is not None:
+            entry = {
+                'mtime_ns': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'version': version,
+            }
+
+    if version is None:
+        result[problem] = f"Could not determine the version of '{binary}'."
+
+        return result, path, entry
+
+    result['version'] = version
+    if tool.minimum and _parse_version(version) < tool.minimum:
+        minimum = '.'.join(str(part) for part in tool.minimum)
+        result[problem] = (
+            f"'{tool.name}' {version} is too old. Version {minimum} or newer "
+            f"is required since it {tool.purpose}."
+        )
+
+    return result, path, entry
+
+
+def _probe_version(tool, binary):
+    # Terraform would otherwise check for a newer version over the
+    # network.
+    env = dict(os.environ, CHECKPOINT_DISABLE='1')
+
+    try:
+        process = subprocess.run(
+            [binary, *tool.command[1:]],
+            encoding='utf8',
+            env=env,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            timeout=PROBE_TIMEOUT,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+    # Some tools exit with an error after printing their own version,
+    # eg Helm 2 when it can't reach Tiller.
+    match = tool.pattern.search(process.stdout)
+
+    return match.group(1) if match else None
+
+
+def _parse_version(version):
+    return tuple(int(part) for part in version.split('.'))
+
+
+def _load_versions(cache_path):
+    if not cache_path.is_file():
+        return {}
+
+    try:
+        with cache_path.open() as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def _save_versions(cache_path, versions):
+    cache_path.parent.mkdir(exist_ok=True, parents=True)
+
+    temp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+    with temp_path.open('w') as f:
+        json.dump(versions, f, indent=2)
+    os.replace(temp_path, cache_path)
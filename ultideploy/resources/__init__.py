@@ -1,15 +1,22 @@
 import base64
+import concurrent.futures
+import json
 import sys
 import time
 from pprint import pprint
 
-import googleapiclient.discovery
 import googleapiclient.errors
 
-from ultideploy import constants, credentials
+from ultideploy import api, constants, credentials
 from ultideploy.resources import iam
 
 
+# The maximum number of services that can be enabled with one request.
+SERVICE_USAGE_BATCH_SIZE = 20
+
+OPERATION_MAX_POLL_SECONDS = 5
+
+
 def create_terraform_admin_project(service, organization_id):
     """
     Create the Terraform admin project.
@@ -48,8 +55,8 @@ def get_billing_account(google_credentials):
     Returns:
         The billing account to use.
     """
-    service = googleapiclient.discovery.build(
-        "cloudbilling", "v1", credentials=google_credentials
+    service = api.build_service(
+        "cloudbilling", "v1", google_credentials
     )
     print("Retrieving billing account for admin project...")
     request = service.billingAccounts().list()
@@ -71,6 +78,50 @@ def get_billing_account(google_credentials):
     return account
 
 
+def get_terraform_output(
+        bucket_name,
+        prefix,
+        output_name,
+        google_credentials,
+        workspace='default',
+):
+    """
+    Read an output of a Terraform configuration straight from its remote
+    state, without initializing the configuration.
+
+    Args:
+        bucket_name:
+            The name of the bucket the state is stored in.
+        prefix:
+            The prefix of the configuration's GCS backend.
+        output_name:
+            The name of the output to read.
+        google_credentials:
+            The credentials used to authenticate the call.
+        workspace:
+            The Terraform workspace of the state.
+
+    Returns:
+        The value of the output, or ``None`` if the state or the output
+        doesn't exist yet.
+    """
+    service = api.build_service("storage", "v1", google_credentials)
+    request = service.objects().get_media(
+        bucket=bucket_name, object=f'{prefix}/{workspace}.tfstate'
+    )
+
+    try:
+        state = json.loads(request.execute())
+    except googleapiclient.errors.HttpError as e:
+        if e.resp.status == 404:
+            return None
+        raise
+
+    output = state.get('outputs', {}).get(output_name)
+
+    return output['value'] if output else None
+
+
 def get_or_create_service_account(
         project_id,
         account_id,
@@ -95,8 +146,8 @@ def get_or_create_service_account(
     """
     print(f"Searching for existing '{account_id}' service account...")
 
-    service = googleapiclient.discovery.build(
-        "iam", "v1", credentials=google_credentials
+    service = api.build_service(
+        "iam", "v1", google_credentials
     )
     project = f"projects/{project_id}"
     email = f"{account_id}@{project_id}.iam.gserviceaccount.com"
@@ -152,8 +203,8 @@ def get_organization(organization_name, google_credentials):
         An object containing information about the organization.
     """
     print(f"Retrieving organization info for '{organization_name}'...")
-    service = googleapiclient.discovery.build(
-        "cloudresourcemanager", "v1", credentials=google_credentials
+    service = api.build_service(
+        "cloudresourcemanager", "v1", google_credentials
     )
 
     request = service.organizations().get(name=organization_name)
@@ -165,8 +216,8 @@ def get_organization(organization_name, google_credentials):
 
 
 def set_project_billing_account(project_id, billing_account_name, google_credentials):
-    service = googleapiclient.discovery.build(
-        "cloudbilling", "v1", credentials=google_credentials
+    service = api.build_service(
+        "cloudbilling", "v1", google_credentials
     )
 
     print(
@@ -196,8 +247,8 @@ def enable_admin_services(project_number, google_credentials):
     Returns:
         The result of the operation.
     """
-    service = googleapiclient.discovery.build(
-        "serviceusage", "v1", credentials=google_credentials
+    service = api.build_service(
+        "serviceusage", "v1", google_credentials
     )
 
     print(f"Enabling services for '{constants.TERRAFORM_ADMIN_PROJECT_ID}':")
@@ -224,6 +275,106 @@ def enable_admin_services(project_number, google_credentials):
             sys.exit(1)
 
 
+def enable_project_services(project_id, service_names, google_credentials):
+    """
+    Enable services in a project, skipping the ones that are already
+    enabled.
+
+    The services are enabled in batches, and the resulting operations
+    are waited on concurrently.
+
+    Args:
+        project_id:
+            The ID of the project to enable services in.
+        service_names:
+            The full names of the services to enable, eg
+            ``container.googleapis.com``.
+        google_credentials:
+            The credentials to use to authenticate the operation.
+
+    Returns:
+        A list of the names of the services that were enabled.
+    """
+    service = api.build_service(
+        "serviceusage", "v1", google_credentials
+    )
+    parent = f"projects/{project_id}"
+
+    enabled = set()
+    request = service.services().list(
+        filter="state:ENABLED", pageSize=200, parent=parent
+    )
+    while request is not None:
+        response = request.execute()
+        enabled.update(
+            s['config']['name'] for s in response.get('services', [])
+        )
+        request = service.services().list_next(
+            previous_request=request, previous_response=response
+        )
+
+    missing = [name for name in service_names if name not in enabled]
+    if not missing:
+        return []
+
+    operation_refs = []
+    for i in range(0, len(missing), SERVICE_USAGE_BATCH_SIZE):
+        request = service.services().batchEnable(
+            body={'serviceIds': missing[i:i + SERVICE_USAGE_BATCH_SIZE]},
+            parent=parent,
+        )
+        response = request.execute()
+        if not response.get('done', False):
+            operation_refs.append(response['name'])
+
+    # Each thread needs its own client since they are not thread safe.
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(len(operation_refs), 1)
+    ) as executor:
+        futures = [
+            executor.submit(
+                poll_operation, "serviceusage", ref, google_credentials
+            )
+            for ref in operation_refs
+        ]
+        for future in futures:
+            future.result()
+
+    return missing
+
+
+def poll_operation(service_type, operation_ref, google_credentials):
+    """
+    Wait for a long running operation without printing any progress.
+
+    Args:
+        service_type:
+            The name of the API the operation belongs to.
+        operation_ref:
+            The name of the operation.
+        google_credentials:
+            The credentials to use to poll the operation.
+
+    Returns:
+        The response of the completed operation.
+    """
+    service = api.build_service(service_type, 'v1', google_credentials)
+
+    delay = 1
+    while True:
+        status = service.operations().get(name=operation_ref).execute()
+        if status.get('done', False):
+            break
+
+        time.sleep(delay)
+        delay = min(delay * 2, OPERATION_MAX_POLL_SECONDS)
+
+    if status.get('error'):
+        raise RuntimeError(status)
+
+    return status.get('response', {})
+
+
 def bootstrap_credentials(service_account_name, google_credentials):
     """
     Ensure that there are local credentials for the provided service
@@ -249,8 +400,8 @@ def bootstrap_credentials(service_account_name, google_credentials):
 
     print("No credentials found. Creating a new key...")
 
-    service = googleapiclient.discovery.build(
-        "iam", "v1", credentials=google_credentials
+    service = api.build_service(
+        "iam", "v1", google_credentials
     )
 
     request_body = {
@@ -266,7 +417,7 @@ def bootstrap_credentials(service_account_name, google_credentials):
     decoded = base64.b64decode(key_data.encode())
 
     if not credentials_path.parent.is_dir():
-        credentials_path.parent.mkdir(exists_ok=True, parents=True)
+        credentials_path.parent.mkdir(exist_ok=True, parents=True)
 
     with credentials_path.open('wb') as f:
         f.write(decoded)
@@ -292,8 +443,8 @@ def bootstrap_organization_privileges(
             policy.
     """
     print("Getting current IAM policy for organization...")
-    service = googleapiclient.discovery.build(
-        "cloudresourcemanager", "v1", credentials=google_credentials
+    service = api.build_service(
+        "cloudresourcemanager", "v1", google_credentials
     )
 
     request = service.organizations().getIamPolicy(
@@ -339,8 +490,8 @@ def bootstrap_admin_project_privileges(
             policy.
     """
     print("Getting current IAM policy for admin project...")
-    service = googleapiclient.discovery.build(
-        "cloudresourcemanager", "v1", credentials=google_credentials
+    service = api.build_service(
+        "cloudresourcemanager", "v1", google_credentials
     )
 
     request = service.projects().getIamPolicy(
@@ -386,8 +537,8 @@ def bootstrap_dns_project_privileges(
             policy.
     """
     print("Getting current IAM policy for DNS project...")
-    service = googleapiclient.discovery.build(
-        "cloudresourcemanager", "v1", credentials=google_credentials
+    service = api.build_service(
+        "cloudresourcemanager", "v1", google_credentials
     )
 
     request = service.projects().getIamPolicy(
@@ -432,8 +583,8 @@ def bootstrap_storage_bucket(project_id, bucket_name, google_credentials):
     """
     print(f"Attempting to retrieve existing bucket: {bucket_name}'")
 
-    service = googleapiclient.discovery.build(
-        "storage", "v1", credentials=google_credentials
+    service = api.build_service(
+        "storage", "v1", google_credentials
     )
     request = service.buckets().get(bucket=bucket_name)
 
@@ -473,10 +624,8 @@ def wait_for_operation(service_type, operation_ref):
     spinners = ['|', '/', '-', '\\']
     spinner_index = 0
 
-    service = googleapiclient.discovery.build(
-        service_type,
-        'v1',
-        credentials=credentials.default_google_credentials()
+    service = api.build_service(
+        service_type, 'v1', credentials.default_google_credentials()
     )
 
     status_request = service.operations().get(name=operation_ref)
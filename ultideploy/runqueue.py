@@ -0,0 +1,381 @@
+import fcntl
+import getpass
+import hashlib
+import json
+import os
+import pathlib
+import socket
+import stat
+import threading
+import time
+
+from ultideploy import cache
+
+
+# Setting this environment variable moves the run queue, eg to a
+# directory shared by every operator on a deployment host.
+DIRECTORY_VARIABLE = 'ULTIDEPLOY_RUN_DIR'
+
+# How often, in seconds, a queued run checks if it can start.
+POLL_SECONDS = 1
+
+# How often, in seconds, a run refreshes its ticket to show that it's
+# still alive.
+HEARTBEAT_SECONDS = 30
+
+# A ticket from another host that hasn't been refreshed for this many
+# seconds belongs to a run that crashed. It's much longer than the
+# heartbeat so small clock differences between hosts don't matter.
+TICKET_TTL = 5 * 60
+
+# The permission bits added to a queue in a shared directory so every
+# operator in the directory's group can join it. The setgid bit makes
+# new files inherit the directory's group.
+SHARED_DIRECTORY_MODE = stat.S_ISGID | stat.S_IRWXG
+SHARED_FILE_MODE = stat.S_IRGRP | stat.S_IWGRP
+
+# Results are kept this many seconds for runs waiting on them.
+RESULT_MAX_AGE = 24 * 60 * 60
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+
+
+class RunQueue:
+    """
+    A first come, first served queue of runs that must not overlap,
+    such as deployments of the same organization.
+
+    Each run adds a ticket file to the queue and waits until every
+    ticket ahead of it is gone. The run at the head of the queue then
+    takes an exclusive lock on the lease file, which the operating
+    system releases even if the run crashes. A coalescable run whose
+    inputs are identical to a coalescable run that is still queued ahead
+    of it doesn't run at all, and shares the other run's exit status
+    instead.
+    """
+
+    def __init__(self, directory, shared=False):
+        """
+        Args:
+            directory:
+                The directory containing the queue's lease, tickets, and
+                results.
+            shared:
+                A boolean indicating if operators other than the current
+                user join the queue, in which case everything it creates
+                is writable by the directory's group.
+        """
+        self.directory = pathlib.Path(directory)
+        self.shared = shared
+        self.tickets_directory = self.directory / 'tickets'
+        self.results_directory = self.directory / 'results'
+        self.lease_path = self.directory / 'lease'
+
+        # Guards tickets against the heartbeat writing them concurrently.
+        self._ticket_lock = threading.Lock()
+
+    @classmethod
+    def for_name(cls, name):
+        """
+        Get the queue of runs with a given name.
+
+        Args:
+            name:
+                The name of the queue, eg the organization being
+                deployed.
+
+        Returns:
+            The queue, shared with every operator who can write to
+            ``ULTIDEPLOY_RUN_DIR`` if it's set, or private to the
+            current user in their cache directory otherwise.
+        """
+        root = os.environ.get(DIRECTORY_VARIABLE)
+        if root:
+            return cls(pathlib.Path(root) / name, shared=True)
+
+        return cls(cache.get_cache_location('runs', name))
+
+    def run(self, inputs, func, coalesce=False):
+        """
+        Run a function once every run ahead of it has finished.
+
+        Args:
+            inputs:
+                A JSON serializable description of everything that
+                determines what the run does. Runs with identical inputs
+                are coalesced.
+            func:
+                The function to run while holding the lease. It exits
+                by returning or raising :class:`SystemExit`.
+            coalesce:
+                A boolean indicating if the run may share the result of
+                an identical run. Only runs whose outcome doesn't depend
+                on a person's answers should be coalesced.
+
+        Returns:
+            The exit status of the run, or of the identical run it was
+            coalesced with.
+        """
+        for directory in [
+                self.directory, self.tickets_directory, self.results_directory
+        ]:
+            directory.mkdir(exist_ok=True, parents=True)
+            if self.shared:
+                _add_mode(directory, SHARED_DIRECTORY_MODE)
+        self._remove_old_results()
+
+        ticket = {
+            'id': f'{time.time_ns():020d}-{os.getpid()}',
+            'key': _inputs_key(inputs),
+            'coalesce': coalesce,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'user': getpass.getuser(),
+            'queued': time.time(),
+            'status': STATUS_QUEUED,
+        }
+        self._update_ticket(ticket)
+
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(ticket, stop_heartbeat), daemon=True
+        )
+        heartbeat.start()
+
+        # Locking a file only needs read access, so operators can take a
+        # lease created by somebody else.
+        lease_fd = os.open(self.lease_path, os.O_RDONLY | os.O_CREAT, 0o644)
+        if self.shared:
+            _add_mode(self.lease_path, stat.S_IRGRP)
+        try:
+            with os.fdopen(lease_fd) as lease:
+                exit_status = self._wait(ticket, lease)
+                if exit_status is not None:
+                    # Runs coalesced with this one share the result too.
+                    self._write_result(ticket, exit_status)
+
+                    return exit_status
+
+                return self._run_leased(ticket, func)
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+            self._ticket_path(ticket['id']).unlink(missing_ok=True)
+
+    def _wait(self, ticket, lease):
+        last_message = None
+        while True:
+            tickets = self._live_tickets()
+            ahead = [t for t in tickets if t['id'] < ticket['id']]
+            runs_ahead = [t for t in ahead if not t.get('following')]
+
+            # A run that already started may have planned before this
+            # run was queued, so only queued runs are followed.
+            leader = next(
+                (
+                    t for t in runs_ahead
+                    if t['key'] == ticket['key']
+                    and t.get('coalesce')
+                    and t['status'] == STATUS_QUEUED
+                ),
+                None,
+            )
+            if ticket['coalesce'] and leader is not None:
+                exit_status = self._follow(ticket, leader)
+                if exit_status is not None:
+                    return exit_status
+
+                # The identical run was interrupted before finishing, so
+                # this run takes its own place in the queue again.
+                continue
+
+            if not runs_ahead and _try_lock(lease):
+                return None
+
+            if runs_ahead:
+                message = (
+                    f"Waiting for {len(runs_ahead)} earlier run(s) to "
+                    f"finish. This run is number {len(runs_ahead) + 1} in "
+                    f"the queue. Current run: {_describe(runs_ahead[0])}"
+                )
+            else:
+                message = "Waiting for the previous run to release its lease."
+            if message != last_message:
+                print(message)
+                last_message = message
+
+            time.sleep(POLL_SECONDS)
+
+    def _follow(self, ticket, leader):
+        print(
+            f"An identical run is ahead in the queue, {_describe(leader)}. "
+            f"Waiting to share its result instead of running again."
+        )
+
+        self._update_ticket(ticket, following=leader['id'])
+
+        leader_path = self._ticket_path(leader['id'])
+        while True:
+            current = self._read_ticket(leader_path)
+            if current is None or not _is_alive(current):
+                break
+
+            time.sleep(POLL_SECONDS)
+
+        self._update_ticket(ticket, following=None)
+
+        result_path = self.results_directory / f"{leader['id']}.json"
+        try:
+            with result_path.open() as f:
+                exit_status = json.load(f)['exit_status']
+        except (OSError, KeyError, ValueError):
+            print("The identical run stopped without a result.")
+
+            return None
+
+        print(f"The identical run finished with exit status {exit_status}.")
+
+        return exit_status
+
+    def _run_leased(self, ticket, func):
+        self._update_ticket(
+            ticket, status=STATUS_RUNNING, started=time.time()
+        )
+
+        # Interruptions aren't recorded, so runs waiting on this one run
+        # themselves rather than sharing an exit status nobody chose.
+        try:
+            func()
+            exit_status = 0
+        except SystemExit as e:
+            exit_status = _exit_status(e.code)
+        except Exception:
+            exit_status = 1
+            self._write_result(ticket, exit_status)
+            raise
+
+        self._write_result(ticket, exit_status)
+
+        return exit_status
+
+    def _heartbeat(self, ticket, stop):
+        while not stop.wait(HEARTBEAT_SECONDS):
+            self._update_ticket(ticket)
+
+    def _live_tickets(self):
+        tickets = []
+        for path in sorted(self.tickets_directory.glob('*.json')):
+            ticket = self._read_ticket(path)
+            if ticket is None:
+                continue
+
+            if not _is_alive(ticket):
+                path.unlink(missing_ok=True)
+                continue
+
+            tickets.append(ticket)
+
+        return tickets
+
+    def _read_ticket(self, path):
+        try:
+            with path.open() as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _remove_old_results(self):
+        cutoff = time.time() - RESULT_MAX_AGE
+        for path in self.results_directory.glob('*.json'):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _ticket_path(self, ticket_id):
+        return self.tickets_directory / f'{ticket_id}.json'
+
+    def _update_ticket(self, ticket, **changes):
+        with self._ticket_lock:
+            ticket.update(changes, heartbeat=time.time())
+            self._write_json(self._ticket_path(ticket['id']), ticket)
+
+    def _write_json(self, path, data):
+        temp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        with temp_path.open('w') as f:
+            json.dump(data, f, indent=2)
+        if self.shared:
+            _add_mode(temp_path, SHARED_FILE_MODE)
+        os.replace(temp_path, path)
+
+    def _write_result(self, ticket, exit_status):
+        self._write_json(
+            self.results_directory / f"{ticket['id']}.json",
+            {'exit_status': exit_status, 'finished': time.time()},
+        )
+
+
+def _add_mode(path, mode):
+    # Only the owner can change a file's mode, and whoever created the
+    # file already added the bits.
+    status = path.stat()
+    if status.st_uid == os.getuid() and status.st_mode & mode != mode:
+        path.chmod(stat.S_IMODE(status.st_mode) | mode)
+
+
+def _describe(ticket):
+    since = ticket.get('started', ticket['queued'])
+    minutes = int((time.time() - since) // 60)
+    state = 'running' if ticket['status'] == STATUS_RUNNING else 'queued'
+
+    return (
+        f"{ticket['user']}@{ticket['host']} (pid {ticket['pid']}), "
+        f"{state} for {minutes} minute(s)"
+    )
+
+
+def _exit_status(code):
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+
+    # Like Python itself, treat any other exit value as a failure.
+    return 1
+
+
+def _inputs_key(inputs):
+    return hashlib.sha256(
+        json.dumps(inputs, sort_keys=True).encode()
+    ).hexdigest()
+
+
+def _is_alive(ticket):
+    # Processes on other hosts sharing the directory can't be checked,
+    # so their tickets expire unless they're refreshed.
+    if ticket['host'] != socket.gethostname():
+        heartbeat = ticket.get('heartbeat', ticket['queued'])
+
+        return time.time() - heartbeat < TICKET_TTL
+
+    try:
+        os.kill(ticket['pid'], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process belongs to another operator.
+        pass
+
+    return True
+
+
+def _try_lock(lease):
+    try:
+        fcntl.flock(lease, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+
+    return True
+
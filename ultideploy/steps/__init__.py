@@ -1,3 +1,4 @@
 from .istio import InstallIstio
 from .link_github import LinkGithub
+from .project_services import EnableProjectServices
 from .terraform_step import TerraformStep
@@ -1,28 +1,90 @@
-import json
+import concurrent.futures
+import contextlib
+import datetime
+import functools
 import os
 import pathlib
 import subprocess
-import tempfile
+import threading
 import time
 
-from ultideploy import credentials, constants
+from ultideploy import cache, credentials, constants, helm, kubernetes
 from .base import BaseStep
 
 
+# The keys every cluster descriptor must have.
+CLUSTER_DESCRIPTOR_KEYS = [
+    'address',
+    'api_domain',
+    'name',
+    'project_id',
+    'region',
+    'root_domain',
+]
+
+
 class InstallIstio(BaseStep):
     """
-    Step to install Istio in a cluster.
+    Step to install Istio in one or more clusters.
     """
     ISTIO_VERSION = '1.3.4'
 
+    # The maximum number of clusters Istio is installed in at once.
+    MAX_WORKERS = 4
+
+    # The number of seconds the cluster has to become reachable in.
+    CLUSTER_TIMEOUT = 60
+
+    # The number of seconds the Istio CRDs have to be created in.
+    CRD_TIMEOUT = 60
+
+    # Helm's default timeout for each chart's hooks, in seconds.
+    HELM_TIMEOUT = 300
+
+    # The number of seconds the rollout has to be verified in.
+    VERIFY_TIMEOUT = 600
+
+    # The static token in a cluster's kubeconfig has to outlive the
+    # slowest possible installation, plus some slack, or kubectl and
+    # Helm would start failing with 401s partway through.
+    TOKEN_MIN_VALIDITY = datetime.timedelta(
+        seconds=(
+            CLUSTER_TIMEOUT
+            + CRD_TIMEOUT
+            + 2 * HELM_TIMEOUT
+            + VERIFY_TIMEOUT
+            + 300
+        )
+    )
+
     name = 'istio'
 
-    def __init__(self):
-        self._previous_gcloud_user = None
+    def __init__(self, clusters=None, max_workers=None):
+        """
+        Args:
+            clusters:
+                An optional list of descriptors of clusters to install
+                Istio in, in addition to the cluster created by the
+                cluster step. Each descriptor is a dictionary with the
+                cluster's ``name``, ``project_id``, ``region``, ingress
+                ``address``, ``api_domain``, and ``root_domain``, and
+                optionally its ``host`` and ``ca_certificate``.
+            max_workers:
+                The maximum number of clusters to install Istio in at
+                once. Defaults to :attr:`MAX_WORKERS`.
+        """
+        self.clusters = clusters or []
+        self.max_workers = max_workers or self.MAX_WORKERS
+
+        self._print_lock = threading.Lock()
 
     def run(self, destroy=False, previous_step_results=None):
         """
-        Either add or remove Istio from the cluster.
+        Either add or remove Istio from the clusters.
+
+        When there are several clusters, Istio is installed in them
+        concurrently and the output of each cluster's commands is
+        written to a log file in the cluster's cache directory.
 
         Args:
             destroy:
@@ -31,6 +93,11 @@ class InstallIstio(BaseStep):
             previous_step_results:
                 The results of the previous steps in the deployment
                 process.
+
+        Returns:
+            A tuple whose first item is a boolean indicating if Istio was
+            installed in every cluster and whose second item is a
+            dictionary containing the result of each cluster.
         """
         # A destroy is a no-op since we just let the cluster destruction
         # do the removal.
@@ -38,102 +105,195 @@ class InstallIstio(BaseStep):
             return True, None
 
         previous_step_results = previous_step_results or {}
+        clusters = self._get_clusters(previous_step_results)
+
+        start_time = time.time()
+        if len(clusters) == 1:
+            results = [self._install_cluster(clusters[0], log_output=False)]
+        else:
+            workers = min(self.max_workers, len(clusters))
+            self.print_log(
+                f"Installing Istio in {len(clusters)} clusters, {workers} at "
+                f"a time..."
+            )
+            with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+                results = list(executor.map(self._install_cluster, clusters))
+
+        self._print_report(results, time.time() - start_time)
+
+        all_installed = all(result['installed'] for result in results)
+
+        return all_installed, {
+            'clusters': {result['cluster']: result for result in results},
+        }
+
+    def _get_clusters(self, previous_step_results):
+        """
+        Get the descriptors of the clusters to install Istio in.
+
+        Args:
+            previous_step_results:
+                The results of the previous steps in the deployment
+                process.
+
+        Returns:
+            A list of cluster descriptors, starting with the cluster
+            created by the cluster step.
+        """
         project_results = previous_step_results['project']
         cluster_results = previous_step_results['cluster']
 
-        project_id = project_results['root_project_id']
-        address = cluster_results['cluster_address_address']
-        api_domain = cluster_results['api_domain']
-        root_domain = cluster_results['root_domain']
-
-        try:
-            self._gcloud_login()
+        clusters = [
+            {
+                'address': cluster_results['cluster_address_address'],
+                'api_domain': cluster_results['api_domain'],
+                'ca_certificate': cluster_results.get(
+                    'cluster_auth_ca_certificate'
+                ),
+                'host': cluster_results.get('cluster_host'),
+                'name': cluster_results['cluster_name'],
+                'project_id': project_results['root_project_id'],
+                'region': cluster_results['cluster_region'],
+                'root_domain': cluster_results['root_domain'],
+            },
+            *self.clusters,
+        ]
 
-            with tempfile.TemporaryDirectory() as temp_dir:
-                config = self._write_cluster_auth(
-                    project_id, cluster_results, temp_dir
+        keys = set()
+        for cluster in clusters:
+            missing = [
+                key for key in CLUSTER_DESCRIPTOR_KEYS if key not in cluster
+            ]
+            if missing:
+                raise ValueError(
+                    f"Cluster descriptor {cluster} is missing: "
+                    f"{', '.join(missing)}"
                 )
-                self._install_istio(config, address, root_domain, api_domain)
-        finally:
-            self._gcloud_logout()
 
-        return True, None
+            key = self._cluster_key(cluster)
+            if key in keys:
+                raise ValueError(f"Cluster '{key}' is listed more than once.")
+            keys.add(key)
 
-    def _gcloud_login(self):
-        current_user_result = subprocess.run(
-            ['gcloud', 'config', 'get-value', 'account'],
-            check=True,
-            encoding='utf8',
-            stdout=subprocess.PIPE,
-        )
-        user = current_user_result.stdout.strip()
-        self._previous_gcloud_user = user if user != '(unset)' else None
-
-        service_account = ''.join([
-            constants.TERRAFORM_SERVICE_ACCOUNT_ID,
-            '@',
-            constants.TERRAFORM_ADMIN_PROJECT_ID,
-            '.iam.gserviceaccount.com',
-        ])
-        credentials_path = credentials.google_service_account_credentials_path(
-            constants.TERRAFORM_SERVICE_ACCOUNT_ID,
-        )
+        return clusters
 
-        subprocess.run(
-            [
-                'gcloud',
-                'auth',
-                'activate-service-account',
-                service_account,
-                '--key-file',
-                credentials_path,
-            ],
-            check=True,
-        )
+    def _install_cluster(self, cluster, log_output=True):
+        """
+        Install Istio in a cluster and verify the rollout.
 
-    def _gcloud_logout(self):
-        service_account = ''.join([
-            constants.TERRAFORM_SERVICE_ACCOUNT_ID,
-            '@',
-            constants.TERRAFORM_ADMIN_PROJECT_ID,
-            '.iam.gserviceaccount.com',
-        ])
+        Failures are reported in the result rather than raised so that
+        one cluster failing doesn't stop the others.
 
-        subprocess.run(
-            [
-                'gcloud',
-                'auth',
-                'revoke',
-                service_account,
-            ],
-            check=True,
-        )
+        Args:
+            cluster:
+                The descriptor of the cluster.
+            log_output:
+                A boolean indicating if the output of commands should be
+                written to the cluster's log file instead of the
+                terminal.
 
-        if self._previous_gcloud_user is not None:
-            subprocess.run(
-                [
-                    'gcloud',
-                    'config',
-                    'set',
-                    'account',
-                    self._previous_gcloud_user,
-                ],
-                check=True,
+        Returns:
+            A dictionary containing the cluster's name, whether Istio was
+            installed, how long it took, and the log file or error if
+            there was one.
+        """
+        cluster_key = self._cluster_key(cluster)
+        log = functools.partial(self._print_cluster_log, cluster['name'])
+
+        result = {
+            'cluster': cluster['name'],
+            'installed': False,
+            'seconds': 0,
+        }
+
+        log_path = None
+        if log_output:
+            log_path = cache.get_cache_location(
+                'clusters', cluster_key
+            ) / 'istio.log'
+            log_path.parent.mkdir(exist_ok=True, parents=True)
+            result['log'] = str(log_path)
+            log(f"Writing output to {log_path}")
+
+        start_time = time.time()
+        try:
+            log_file = (
+                log_path.open('w') if log_path else contextlib.nullcontext()
             )
+            with log_file as output:
+                subprocess_env = kubernetes.kube_cache_environment(
+                    cluster_key,
+                    self._write_cluster_auth(cluster, cluster_key, output),
+                )
+                result['installed'] = (
+                    self._install_istio(
+                        subprocess_env, cluster_key, cluster, log, output
+                    )
+                    and self._verify_installation(
+                        subprocess_env, cluster['address'], log
+                    )
+                )
+        except Exception as e:
+            log(f"Error: {e}")
+            result['error'] = str(e)
 
-    def _write_cluster_auth(self, project, cluster_results, dest_dir):
-        cluster_name = cluster_results['cluster_name']
-        region = cluster_results['cluster_region']
+        result['seconds'] = round(time.time() - start_time, 1)
 
-        config_file = os.path.join(dest_dir, 'config')
-        with open(config_file, 'w') as f:
-            pass
+        return result
 
-        subprocess_env = os.environ.copy()
-        subprocess_env['GOOGLE_APPLICATION_CREDENTIALS'] = credentials.google_service_account_credentials_path(
+    def _write_cluster_auth(self, cluster, cluster_key, output=None):
+        """
+        Get the environment used to run ``kubectl`` and ``helm`` against
+        a cluster.
+
+        The kubeconfig is generated directly from the cluster's host and
+        CA certificate. If those are not available, the credentials are
+        fetched with ``gcloud`` instead. Either way, each cluster gets its
+        own kubeconfig.
+
+        Args:
+            cluster:
+                The descriptor of the cluster.
+            cluster_key:
+                The key identifying the cluster in the cache.
+            output:
+                An optional file to write the output of ``gcloud`` to.
+
+        Returns:
+            A copy of the current environment with ``KUBECONFIG``
+            pointing at the cluster's credentials.
+        """
+        host = cluster.get('host')
+        ca_certificate = cluster.get('ca_certificate')
+
+        if host and ca_certificate:
+            subprocess_env = os.environ.copy()
+            subprocess_env['GOOGLE_APPLICATION_CREDENTIALS'] = str(
+                credentials.google_service_account_credentials_path(
+                    constants.TERRAFORM_SERVICE_ACCOUNT_ID
+                )
+            )
+            subprocess_env['KUBECONFIG'] = str(kubernetes.cluster_kubeconfig(
+                cluster_key,
+                host,
+                ca_certificate,
+                credentials.google_service_account_credentials(
+                    constants.TERRAFORM_SERVICE_ACCOUNT_ID
+                ),
+                min_validity=self.TOKEN_MIN_VALIDITY,
+            ))
+
+            return subprocess_env
+
+        config_file = cache.get_cache_location(
+            'clusters', cluster_key
+        ) / 'kubeconfig-gcloud'
+        config_file.parent.mkdir(exist_ok=True, parents=True)
+
+        subprocess_env = credentials.gcloud_environment(
             constants.TERRAFORM_SERVICE_ACCOUNT_ID
         )
-        subprocess_env['KUBECONFIG'] = config_file
+        subprocess_env['KUBECONFIG'] = str(config_file)
 
         subprocess.run(
             [
@@ -141,57 +301,58 @@ class InstallIstio(BaseStep):
                 'container',
                 'clusters',
                 'get-credentials',
-                cluster_name,
+                cluster['name'],
                 '--region',
-                region,
+                cluster['region'],
                 '--project',
-                project,
+                cluster['project_id'],
             ],
             check=True,
             env=subprocess_env,
+            stderr=subprocess.STDOUT if output else None,
+            stdout=output,
         )
 
-        return config_file
+        return subprocess_env
 
-    def _install_istio(self, config, address, root_domain, api_domain):
+    def _install_istio(
+            self, subprocess_env, cluster_key, cluster, log, output
+    ):
         istio_root = self._get_istio_directory()
-
-        subprocess_env = os.environ.copy()
-        subprocess_env['GOOGLE_APPLICATION_CREDENTIALS'] = credentials.google_service_account_credentials_path(
-            constants.TERRAFORM_SERVICE_ACCOUNT_ID
-        )
-        subprocess_env['KUBECONFIG'] = config
+        output_args = {
+            'stderr': subprocess.STDOUT if output else None,
+            'stdout': output,
+        }
 
         # Wait for Kubernetes to be available
-        print("\nWaiting for cluster to become available...")
-        timeout = 60
+        log("Waiting for cluster to become available...")
+        timeout = self.CLUSTER_TIMEOUT
         start_time = time.time()
         while True:
             try:
                 subprocess.check_call(
-                    ['kubectl', 'cluster-info'],
+                    kubernetes.kubectl_command(subprocess_env, 'cluster-info'),
                     cwd=istio_root,
                     env=subprocess_env,
+                    **output_args,
                 )
-                print("Successfully pinged cluster.")
+                log("Successfully pinged cluster.")
                 break
             except subprocess.CalledProcessError:
                 pass
 
             if time.time() - start_time > timeout:
-                print(f"Exceeded {timeout} second timeout. Exiting.")
+                log(f"Exceeded {timeout} second timeout. Exiting.")
 
-                return False, None
+                return False
 
-            print(
+            log(
                 f"Cluster not available, sleeping for 5 seconds. ("
                 f"{timeout - (time.time() - start_time):.0f} seconds "
                 f"remaining until timeout)"
             )
             time.sleep(5)
 
-        print("\n\n")
-
         cert_namespace = {
             'apiVersion': 'v1',
             'kind': 'Namespace',
@@ -206,54 +367,49 @@ class InstallIstio(BaseStep):
                 'name': 'istio-system',
             },
         }
-        with tempfile.TemporaryDirectory() as temp_dir:
-            cert_namespace_manifest = os.path.join(temp_dir, 'cert-namespace.json')
-            with open(cert_namespace_manifest, 'w') as f:
-                json.dump(cert_namespace, f)
-
-            istio_namespace_manifest = os.path.join(temp_dir, 'istio-namespace.json')
-            with open(istio_namespace_manifest, 'w') as f:
-                json.dump(istio_namespace, f)
-
-            subprocess.run(
-                [
-                    'kubectl',
-                    'apply',
-                    '-f',
-                    cert_namespace_manifest,
-                    '-f',
-                    istio_namespace_manifest,
-                ],
-                check=True,
-                cwd=istio_root,
-                env=subprocess_env,
-            )
-
-        subprocess.run(
-            [
-                'helm',
-                'upgrade',
-                '--install',
-                '--namespace',
-                'istio-system',
-                '-f',
-                istio_root.parents[0] / 'values.yaml',
-                'istio-init',
-                istio_root / 'install' / 'kubernetes' / 'helm' / 'istio-init',
-            ],
-            check=True,
+        kubernetes.apply_manifests(
+            [cert_namespace, istio_namespace],
+            env=subprocess_env,
             cwd=istio_root,
+            output=output,
+        )
+
+        values_files = [istio_root.parents[0] / 'values.yaml']
+        charts_root = istio_root / 'install' / 'kubernetes' / 'helm'
+        deployed_digests = helm.release_digests(
+            'istio-system', env=subprocess_env, cwd=istio_root
+        )
+
+        log("Installing the istio-init chart...")
+        helm.upgrade_install(
+            'istio-init',
+            charts_root / 'istio-init',
+            'istio-system',
             env=subprocess_env,
+            values_files=values_files,
+            deployed_digests=deployed_digests,
+            cwd=istio_root,
+            output=output,
         )
 
         attempts = 0
-        timeout = 60
+        timeout = self.CRD_TIMEOUT
         start_time = time.time()
-        expected_crds = 23
-        print("\n\nWaiting for Istio CRDs to become available...")
+        expected_crds = helm.count_crd_groups(
+            helm.render_chart(
+                'istio-init',
+                charts_root / 'istio-init',
+                'istio-system',
+                env=subprocess_env,
+                values_files=values_files,
+                cwd=istio_root,
+            ),
+            'istio.io',
+        )
+        log("Waiting for Istio CRDs to become available...")
         while True:
             crd_result = subprocess.run(
-                ['kubectl', 'get', 'crds'],
+                kubernetes.kubectl_command(subprocess_env, 'get', 'crds'),
                 check=True,
                 cwd=istio_root,
                 encoding='utf8',
@@ -266,116 +422,209 @@ class InstallIstio(BaseStep):
             ]
 
             if len(istio_crds) == expected_crds:
-                print(f"Found all {expected_crds} CRDs.")
+                log(f"Found all {expected_crds} CRDs.")
                 break
             if len(istio_crds) > expected_crds:
-                print(
+                log(
                     f"Found {len(istio_crds)} CRDs instead of the expected "
                     f"{expected_crds}. Consider adjusting the expected number."
                 )
                 break
 
             if time.time() - start_time > timeout:
-                print(f"Timed out after {timeout} seconds, exiting.")
-                return False, None
+                log(f"Timed out after {timeout} seconds, exiting.")
+                return False
 
             attempts += 1
-            print(f"Attempt #{attempts} - Sleeping for five seconds...")
+            log(f"Attempt #{attempts} - Sleeping for five seconds...")
             time.sleep(5)
 
-        print("\n\n")
-
-        subprocess.run(
-            [
-                'helm',
-                'upgrade',
-                '--install',
-                '--namespace',
-                'istio-system',
-                '-f',
-                istio_root.parents[0] / 'values.yaml',
-                '--set',
-                f'certmanager.email={constants.LETSENCRYPT_EMAIL}',
-                '--set',
-                f'gateways.istio-ingressgateway.loadBalancerIP={address}',
-                'istio',
-                istio_root / 'install' / 'kubernetes' / 'helm' / 'istio'
-            ],
-            check=True,
-            cwd=istio_root,
+        log("Installing the istio chart...")
+        helm.upgrade_install(
+            'istio',
+            charts_root / 'istio',
+            'istio-system',
             env=subprocess_env,
+            values_files=values_files,
+            set_values={
+                'certmanager.email': constants.LETSENCRYPT_EMAIL,
+                'gateways.istio-ingressgateway.loadBalancerIP': (
+                    cluster['address']
+                ),
+            },
+            deployed_digests=deployed_digests,
+            cwd=istio_root,
+            output=output,
         )
 
         subprocess.run(
-            [
-                'kubectl',
+            kubernetes.kubectl_command(
+                subprocess_env,
                 'label',
                 'namespace',
                 'default',
                 '--overwrite',
                 'istio-injection=enabled',
-            ],
+            ),
             check=True,
             cwd=istio_root,
             env=subprocess_env,
+            **output_args,
         )
 
-        with tempfile.TemporaryDirectory() as temp_dir:
-            api_gateway_manifest = os.path.join(temp_dir, 'api-gateway.json')
-            with open(api_gateway_manifest, 'w') as f:
-                manifest = self.gateway_manifest('api-ingress', api_domain, cert_name='api-cert')
-                json.dump(manifest, f)
+        api_domain = cluster['api_domain']
+        root_domain = cluster['root_domain']
+        manifests = [
+            self.gateway_manifest(
+                'default-ingress', root_domain, cert_name='root-cert'
+            ),
+            self.gateway_manifest(
+                'api-ingress', api_domain, cert_name='api-cert'
+            ),
+            self.certificate_manifest('root-cert', root_domain),
+            self.certificate_manifest('api-cert', api_domain),
+            *self.https_redirect_config(api_domain, root_domain),
+            self.domains_config(api_domain=api_domain, root_domain=root_domain),
+        ]
+        kubernetes.apply_changed_manifests(
+            manifests,
+            env=subprocess_env,
+            cluster_key=cluster_key,
+            cwd=istio_root,
+            output=output,
+        )
+
+        return True
+
+    def _verify_installation(self, subprocess_env, address, log):
+        """
+        Verify that the Istio rollout actually finished.
+
+        The ingress deployments, the ingress gateway's load balancer
+        address, and the TLS certificates are all watched concurrently
+        under a single deadline.
+
+        Args:
+            subprocess_env:
+                The environment used to run ``kubectl``.
+            address:
+                The IP address the ingress gateway should be bound to.
+            log:
+                The function used to print progress for the cluster.
+
+        Returns:
+            A boolean indicating if every check passed before the
+            deadline.
+        """
+        deadline = time.time() + self.VERIFY_TIMEOUT
+        checks = {
+            'deployment/istio-ingressgateway': functools.partial(
+                kubernetes.wait_for_rollout,
+                subprocess_env,
+                'istio-system',
+                'istio-ingressgateway',
+            ),
+            'deployment/https-redirect': functools.partial(
+                kubernetes.wait_for_rollout,
+                subprocess_env,
+                'istio-system',
+                'https-redirect',
+            ),
+            'service/istio-ingressgateway': functools.partial(
+                kubernetes.wait_for_load_balancer_ip,
+                subprocess_env,
+                'istio-system',
+                'istio-ingressgateway',
+                address,
+            ),
+            'certificate/api-cert': functools.partial(
+                kubernetes.wait_for_condition,
+                subprocess_env,
+                'istio-system',
+                'certificate/api-cert',
+                'Ready',
+            ),
+            'certificate/root-cert': functools.partial(
+                kubernetes.wait_for_condition,
+                subprocess_env,
+                'istio-system',
+                'certificate/root-cert',
+                'Ready',
+            ),
+        }
 
-            default_gateway_manifest = os.path.join(
-                temp_dir, 'default-gateway.json'
+        def timed(check):
+            # Each check gets whatever is left of the shared deadline.
+            start_time = time.time()
+            passed, detail = check(deadline - start_time)
+
+            return passed, detail, time.time() - start_time
+
+        log(
+            f"Verifying the installation. Waiting up to "
+            f"{self.VERIFY_TIMEOUT} seconds for {len(checks)} objects..."
+        )
+        with concurrent.futures.ThreadPoolExecutor(len(checks)) as executor:
+            futures = {
+                name: executor.submit(timed, check)
+                for name, check in checks.items()
+            }
+            results = {name: future.result() for name, future in futures.items()}
+
+        all_passed = True
+        for name, (passed, detail, elapsed) in results.items():
+            status = "ready" if passed else "NOT READY"
+            log(f"{name:<36} {status:<10} {elapsed:6.1f}s")
+
+            if not passed:
+                all_passed = False
+                for line in detail.splitlines():
+                    log(f"    {line}")
+
+        return all_passed
+
+    def _print_report(self, results, elapsed):
+        """
+        Print the outcome and duration of the installation in each
+        cluster.
+
+        Args:
+            results:
+                The results of each cluster as returned by
+                :meth:`_install_cluster`.
+            elapsed:
+                The total number of seconds the installations took.
+        """
+        self.print_section("Report")
+
+        for result in results:
+            status = "installed" if result['installed'] else "FAILED"
+            self.print_log(
+                f"{result['cluster']:<36} {status:<10} "
+                f"{result['seconds']:8.1f}s"
             )
-            with open(default_gateway_manifest, 'w') as f:
-                manifest = self.gateway_manifest('default-ingress', root_domain, cert_name='root-cert')
-                json.dump(manifest, f)
-
-            api_certificate_manifest = os.path.join(temp_dir, 'api-certificate.json')
-            with open(api_certificate_manifest, 'w') as f:
-                manifest = self.certificate_manifest('api-cert', api_domain)
-                json.dump(manifest, f)
-
-            root_certificate_manifest = os.path.join(temp_dir, 'root-certificate.json')
-            with open(root_certificate_manifest, 'w') as f:
-                manifest = self.certificate_manifest('root-cert', root_domain)
-                json.dump(manifest, f)
-
-            https_redirect_shenanigans = os.path.join(temp_dir, 'redirect.json')
-            with open(https_redirect_shenanigans, 'w') as f:
-                f.write(self.https_redirect_config(api_domain, root_domain))
-
-            domains_config_manifest = os.path.join(temp_dir, 'domains.json')
-            with open(domains_config_manifest, 'w') as f:
-                manifest = self.domains_config(
-                    api_domain=api_domain, root_domain=root_domain
-                )
-                json.dump(manifest, f)
-
-            subprocess.run(
-                [
-                    'kubectl',
-                    'apply',
-                    '-f',
-                    default_gateway_manifest,
-                    '-f',
-                    api_gateway_manifest,
-                    '-f',
-                    root_certificate_manifest,
-                    '-f',
-                    api_certificate_manifest,
-                    '-f',
-                    https_redirect_shenanigans,
-                    '-f',
-                    domains_config_manifest,
-                ],
-                check=True,
-                cwd=istio_root,
-                env=subprocess_env,
+            if not result['installed'] and result.get('log'):
+                self.print_log(f"    See {result['log']}")
+
+        if len(results) > 1:
+            self.print_log(
+                f"Finished {len(results)} clusters in {elapsed:.1f}s, "
+                f"compared to {sum(r['seconds'] for r in results):.1f}s one "
+                f"at a time."
             )
 
+    def _print_cluster_log(self, cluster_name, message):
+        # Clusters are installed from several threads, so lines are
+        # printed whole.
+        with self._print_lock:
+            self.print_log(f"[{cluster_name}] {message}")
+
+    @staticmethod
+    def _cluster_key(cluster):
+        return kubernetes.cluster_cache_key(
+            cluster['project_id'], cluster['region'], cluster['name']
+        )
+
     def _get_istio_directory(self):
         project_root = pathlib.Path(__file__).parents[2]
         istio_root = project_root / 'istio' / f'istio-{self.ISTIO_VERSION}'
@@ -482,9 +731,11 @@ class InstallIstio(BaseStep):
 
         Args:
             *redirected_hosts:
+                The host names that should be redirected to HTTPS.
 
         Returns:
-
+            A list of dictionaries representing the objects that make up
+            the redirect service.
         """
         manifests = [
             # NGINX config for the redirect
@@ -615,6 +866,5 @@ class InstallIstio(BaseStep):
             },
         ]
 
-        # If there are multiple JSON objects in a K8s manifest, they are placed
-        # back-to-back with no separators (except a newline).
-        return "\n".join([json.dumps(manifest) for manifest in manifests])
+        return manifests
+
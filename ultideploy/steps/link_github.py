@@ -1,3 +1,4 @@
+from ultideploy import approval
 from .base import BaseStep
 
 
@@ -8,6 +9,16 @@ class LinkGithub(BaseStep):
     """
     name = "link-github"
 
+    def __init__(self, approver=None):
+        """
+        Args:
+            approver:
+                An optional :class:`ultideploy.approval.Approver` that
+                decides if the step waits for a person. Defaults to
+                waiting.
+        """
+        self.approver = approver or approval.Approver()
+
     def run(self, destroy=False, previous_step_results=None):
         # This manual step is a no-op if destroying.
         if destroy:
@@ -23,13 +34,12 @@ class LinkGithub(BaseStep):
         project_id = project_step_results['root_project_id']
         url = f"https://console.cloud.google.com/cloud-build/triggers/connect?project={project_id}"
 
-        print(
-            f"\n\nPlease link your GitHub repositories to your GCP project. "
+        instructions = (
+            f"Please link your GitHub repositories to your GCP project. "
             f"Do NOT create any triggers for the repositories:\n\n"
             f"    {url}"
-            f"\n\nPress enter to continue..."
         )
-
-        input()
+        if not self.approver.confirm_manual_step(self, instructions):
+            return False, None
 
         return True, None
@@ -0,0 +1,85 @@
+import json
+
+from ultideploy import constants, credentials, resources
+from .base import BaseStep
+
+
+class EnableProjectServices(BaseStep):
+    """
+    Enable the root project's services in bulk before Terraform manages
+    them.
+
+    Terraform enables each service with its own operation, one after the
+    other. Enabling them in batches beforehand means Terraform only has
+    to find them already enabled. The root project's ID is read straight
+    from the project configuration's remote state, so the configuration
+    doesn't have to be initialized first.
+
+    On the first deployment the root project doesn't exist yet, so the
+    step is skipped and Terraform enables the services itself.
+    """
+    name = "project-services"
+
+    def __init__(self, configuration_directory, state_prefix, env=None):
+        """
+        Args:
+            configuration_directory:
+                The directory containing the Terraform configuration
+                that creates the root project and lists its services.
+            state_prefix:
+                The prefix of the remote state of the Terraform
+                configuration that creates the root project.
+            env:
+                The environment Terraform is run with, which selects
+                the workspace with ``TF_WORKSPACE``.
+        """
+        self.configuration_directory = configuration_directory
+        self.state_prefix = state_prefix
+        self.env = env or {}
+
+    def run(self, destroy=False, previous_step_results=None):
+        # Terraform disables the services when destroying.
+        if destroy:
+            return True, None
+
+        google_credentials = credentials.google_service_account_credentials(
+            constants.TERRAFORM_SERVICE_ACCOUNT_ID
+        )
+
+        root_project = resources.get_terraform_output(
+            constants.TERRAFORM_BUCKET_NAME,
+            self.state_prefix,
+            'root_project',
+            google_credentials,
+            workspace=self.env.get('TF_WORKSPACE') or 'default',
+        )
+        if not root_project:
+            self.print_log(
+                "The root project doesn't exist yet. Terraform will enable "
+                "its services."
+            )
+            return True, None
+
+        project_id = root_project['project_id']
+        service_names = self._service_names()
+        enabled = resources.enable_project_services(
+            project_id, service_names, google_credentials
+        )
+
+        if enabled:
+            self.print_log(f"Enabled services in '{project_id}':")
+            for name in enabled:
+                print(f"  - {name}")
+        else:
+            self.print_log(
+                f"All services are already enabled in '{project_id}'."
+            )
+
+        return True, None
+
+    def _service_names(self):
+        services_path = (
+            self.configuration_directory / constants.PROJECT_SERVICES_FILE_NAME
+        )
+        with services_path.open() as f:
+            return json.load(f)['project_services']
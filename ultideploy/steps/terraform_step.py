@@ -1,57 +1,172 @@
+import datetime
+import hashlib
 import json
+import os
 import pathlib
+import shutil
 import subprocess
+import sys
 import tempfile
+import time
 
+from ultideploy import approval, cache, timings
 from .base import BaseStep
 
 
+# Saved plans older than this are discarded so that changes made outside
+# of Terraform are picked up by a fresh plan.
+PLAN_CACHE_TTL = datetime.timedelta(hours=1)
+
+# Written to a configuration's .terraform directory after it has been
+# initialized, recording what the initialization was for.
+INIT_STAMP = 'ultideploy-init'
+
+
 class TerraformStep(BaseStep):
     """
     Apply a set of Terraform configurations.
     """
 
-    def __init__(self, name, configuration_directory, env=None, outputs=None):
+    def __init__(
+            self,
+            name,
+            configuration_directory,
+            env=None,
+            outputs=None,
+            inputs=None,
+            approver=None,
+    ):
+        """
+        Args:
+            name:
+                The name of the step.
+            configuration_directory:
+                The directory containing the Terraform configuration.
+            env:
+                The environment to run Terraform with.
+            outputs:
+                A list of the Terraform outputs to return from the step.
+                Attributes of an output are given as ``output.attr``.
+            inputs:
+                An optional dictionary mapping the names of previous
+                steps to dictionaries mapping Terraform variables to the
+                outputs of that step to pass in. Variables are only
+                passed from a step if all of its outputs are available.
+            approver:
+                An optional :class:`ultideploy.approval.Approver` that
+                decides if plans are applied. Defaults to asking a
+                person.
+        """
         self.name = name
         self.configuration_directory = configuration_directory
         self.env = env or {}
         self.outputs = outputs or []
+        self.inputs = inputs or {}
+        self.approver = approver or approval.Approver()
 
-    def run(self, destroy=False, **kwargs):
+    def run(self, destroy=False, previous_step_results=None):
         self.print_section("Initialize Terraform")
         self._init()
 
         with tempfile.TemporaryDirectory() as temp_dir:
             plan_file = pathlib.Path(temp_dir) / 'plan'
 
+            # Previous steps have not run yet when destroying, so their
+            # outputs are read from the remote state instead.
+            var_file = None
+            variables = {} if destroy else self._input_variables(
+                previous_step_results or {}
+            )
+            if variables:
+                var_file = pathlib.Path(temp_dir) / 'inputs.tfvars.json'
+                self._write_var_file(var_file, variables)
+
             self.print_section("Plan Terraform Changes")
-            self._plan(plan_file, destroy)
+            saved_plan_file = self._saved_plan_path(destroy, variables)
+            plan = self._load_saved_plan(saved_plan_file)
+            if plan is None:
+                self._plan(plan_file, destroy, var_file)
+                plan = self._show_plan(plan_file)
+                self._save_plan(plan_file, plan, saved_plan_file)
 
-            if not self._plan_has_changes(plan_file):
+            if not self._plan_has_changes(plan):
                 # If the plan has no changes, there's no need to prompt.
                 self.print_log("No changes to apply. Continuing.")
-            elif not self._prompt():
+            elif not self._prompt(plan):
+                self.print_log(
+                    "The plan was saved and will be reused if the "
+                    "configuration, variables, and state are unchanged."
+                )
                 return False, None
             else:
                 self.print_section("Applying Terraform Changes")
-                self._apply(plan_file)
+                try:
+                    self._apply(saved_plan_file, plan, destroy)
+                finally:
+                    # Applying changes the state, so the plan can't be
+                    # reused either way.
+                    self._discard_saved_plans(saved_plan_file.parent)
 
         outputs = self._get_outputs() if not destroy else {}
 
         return True, outputs
 
     def _init(self):
+        if is_initialized(self.configuration_directory):
+            self.print_log(
+                "Already initialized for the current configuration and "
+                "dependency lock file."
+            )
+            return
+
         subprocess.run(
-            ['terraform', 'init'],
+            ['terraform', 'init', *self._input_args()],
             check=True,
             cwd=self.configuration_directory,
             env=self.env,
         )
+        mark_initialized(self.configuration_directory)
+
+    def _input_args(self):
+        # Terraform must not wait for input when nobody can answer.
+        return [] if self.approver.interactive else ['-input=false']
+
+    def _input_variables(self, previous_step_results):
+        variables = {}
+        for step_name, step_inputs in self.inputs.items():
+            step_outputs = previous_step_results.get(step_name, {})
+
+            missing = [
+                output for output in step_inputs.values()
+                if output not in step_outputs
+            ]
+            if missing:
+                self.print_log(
+                    f"Outputs of '{step_name}' are not available. Reading "
+                    f"them from the remote state."
+                )
+                continue
+
+            for variable, output in step_inputs.items():
+                variables[variable] = step_outputs[output]
+
+        return variables
 
-    def _plan(self, plan_file, destroy):
-        plan_args = ['terraform', 'plan', '-out', plan_file]
+    @staticmethod
+    def _write_var_file(var_file, variables):
+        # The variables may include secrets such as database passwords.
+        fd = os.open(var_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(variables, f)
+
+    def _plan(self, plan_file, destroy, var_file=None):
+        plan_args = [
+            'terraform', 'plan', *self._input_args(), '-out', plan_file
+        ]
         if destroy:
             plan_args.append('-destroy')
+        if var_file:
+            plan_args += ['-var-file', var_file]
 
         subprocess.run(
             plan_args,
@@ -60,15 +175,108 @@ class TerraformStep(BaseStep):
             env=self.env,
         )
 
-    def _plan_has_changes(self, plan_file):
+    def _saved_plan_path(self, destroy, variables):
+        # The path is derived from everything that determines the plan's
+        # content, so a saved plan is only found while it's still valid.
+        digest = hashlib.sha256()
+
+        for root, dirs, files in os.walk(self.configuration_directory):
+            dirs[:] = sorted(d for d in dirs if d != '.terraform')
+            for file_name in sorted(files):
+                path = pathlib.Path(root) / file_name
+                digest.update(
+                    str(path.relative_to(self.configuration_directory)).encode()
+                )
+                digest.update(path.read_bytes())
+
+        for key, value in sorted(self.env.items()):
+            if key.startswith('TF_VAR_'):
+                digest.update(f'{key}={value}'.encode())
+        digest.update(json.dumps(variables, sort_keys=True).encode())
+
+        lineage, serial = self._state_version()
+        digest.update(f'{lineage}:{serial}'.encode())
+        digest.update(b'destroy' if destroy else b'apply')
+
+        return (
+            cache.get_cache_location('plans', self.name)
+            / f'{digest.hexdigest()}.tfplan'
+        )
+
+    def _state_version(self):
+        result = subprocess.run(
+            ['terraform', 'state', 'pull'],
+            check=True,
+            cwd=self.configuration_directory,
+            encoding='utf8',
+            env=self.env,
+            stdout=subprocess.PIPE,
+        )
+        if not result.stdout.strip():
+            return None, None
+
+        state = json.loads(result.stdout)
+
+        return state.get('lineage'), state.get('serial')
+
+    def _load_saved_plan(self, saved_plan_file):
+        shown_file = saved_plan_file.with_suffix('.json')
+        if not saved_plan_file.is_file() or not shown_file.is_file():
+            return None
+
+        age = time.time() - saved_plan_file.stat().st_mtime
+        if age > PLAN_CACHE_TTL.total_seconds():
+            self._discard_saved_plans(saved_plan_file.parent)
+
+            return None
+
+        self.print_log(
+            f"Reusing the plan saved {int(age // 60)} minute(s) ago."
+        )
+        subprocess.run(
+            ['terraform', 'show', saved_plan_file],
+            check=True,
+            cwd=self.configuration_directory,
+            env=self.env,
+        )
+
+        with shown_file.open() as f:
+            return json.load(f)
+
+    def _save_plan(self, plan_file, plan, saved_plan_file):
+        # Only the latest plan of a step can be applied, and plans
+        # contain the values of sensitive variables.
+        self._discard_saved_plans(saved_plan_file.parent)
+        saved_plan_file.parent.mkdir(mode=0o700, exist_ok=True, parents=True)
+
+        fd = os.open(
+            saved_plan_file.with_suffix('.json'),
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+            0o600,
+        )
+        with os.fdopen(fd, 'w') as f:
+            json.dump(plan, f)
+
+        shutil.copyfile(plan_file, saved_plan_file)
+        os.chmod(saved_plan_file, 0o600)
+
+    @staticmethod
+    def _discard_saved_plans(plan_dir):
+        if plan_dir.is_dir():
+            shutil.rmtree(plan_dir)
+
+    def _show_plan(self, plan_file):
         result = subprocess.check_output(
             ['terraform', 'show', '-json', plan_file],
             cwd=self.configuration_directory,
             encoding='utf8',
             env=self.env,
         )
-        plan = json.loads(result)
 
+        return json.loads(result)
+
+    @staticmethod
+    def _plan_has_changes(plan):
         for resource in plan['resource_changes']:
             for action in resource['change']['actions']:
                 if action != 'no-op':
@@ -76,16 +284,37 @@ class TerraformStep(BaseStep):
 
         return False
 
-    def _prompt(self):
-        return self.prompt_yes_no("Would you like to apply the above plan?")
+    def _prompt(self, plan):
+        return self.approver.approve_plan(self, plan)
 
-    def _apply(self, plan_file):
-        subprocess.run(
+    def _apply(self, plan_file, plan, destroy):
+        recorder = timings.ApplyRecorder(
+            self.name,
+            destroy,
+            timings.plan_dependencies(plan),
+        )
+
+        # Terraform's output is echoed as it arrives so the start and
+        # finish of each resource can be timed.
+        process = subprocess.Popen(
             ['terraform', 'apply', plan_file],
-            check=True,
             cwd=self.configuration_directory,
+            encoding='utf8',
             env=self.env,
+            stdout=subprocess.PIPE,
         )
+        try:
+            for line in process.stdout:
+                recorder.feed(line)
+                sys.stdout.write(line)
+                sys.stdout.flush()
+        finally:
+            process.stdout.close()
+            return_code = process.wait()
+            recorder.save()
+
+        if return_code:
+            raise subprocess.CalledProcessError(return_code, process.args)
 
     def _get_outputs(self):
         results = subprocess.run(
@@ -113,3 +342,56 @@ class TerraformStep(BaseStep):
                 )
 
         return outputs
+
+
+def is_initialized(configuration_directory):
+    """
+    Check if a Terraform configuration was initialized with its current
+    dependency lock file and configuration files, which declare the
+    backend, providers, and modules that initializing sets up.
+
+    Args:
+        configuration_directory:
+            The directory containing the configuration.
+
+    Returns:
+        A boolean indicating if initializing the configuration again
+        can be skipped.
+    """
+    stamp_path = _init_stamp_path(configuration_directory)
+    try:
+        stamp = stamp_path.read_text()
+    except OSError:
+        return False
+
+    return stamp == _init_digest(configuration_directory)
+
+
+def mark_initialized(configuration_directory):
+    """
+    Record that a Terraform configuration was just initialized.
+
+    Args:
+        configuration_directory:
+            The directory containing the configuration.
+    """
+    _init_stamp_path(configuration_directory).write_text(
+        _init_digest(configuration_directory)
+    )
+
+
+def _init_digest(configuration_directory):
+    directory = pathlib.Path(configuration_directory)
+
+    digest = hashlib.sha256()
+    for path in sorted(
+            [*directory.glob('*.tf'), *directory.glob('.terraform.lock.hcl')]
+    ):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+
+    return digest.hexdigest()
+
+
+def _init_stamp_path(configuration_directory):
+    return pathlib.Path(configuration_directory) / '.terraform' / INIT_STAMP
@@ -0,0 +1,353 @@
+import json
+import re
+import statistics
+import time
+
+from ultideploy import cache
+
+
+# The number of recorded runs to keep for each step.
+MAX_RECORDED_RUNS = 20
+
+ANSI_ESCAPE_PATTERN = re.compile(r'\x1b\[[0-9;]*m')
+
+# Terraform reports the progress of each resource as lines such as
+# "google_sql_database_instance.db: Creating..." followed by
+# "google_sql_database_instance.db: Creation complete after 9m2s [id=db]".
+START_PATTERN = re.compile(
+    r'^(?P<address>[^\s:][^:]*): '
+    r'(?P<action>Creating|Modifying|Destroying|Reading)\.\.\.'
+)
+FINISH_PATTERN = re.compile(
+    r'^(?P<address>[^\s:][^:]*): '
+    r'(?:Creation|Modifications|Destruction|Read) complete after '
+)
+
+INDEX_PATTERN = re.compile(r'\[[^\]]*\]')
+
+
+class ApplyRecorder:
+    """
+    Record when each resource starts and finishes from the output of
+    ``terraform apply``.
+    """
+
+    def __init__(self, step_name, destroy, dependencies):
+        """
+        Args:
+            step_name:
+                The name of the step running the apply.
+            destroy:
+                A boolean indicating if the apply destroys resources.
+            dependencies:
+                A dictionary mapping resource addresses to the addresses
+                they depend on as returned by :func:`plan_dependencies`.
+        """
+        self.step_name = step_name
+        self.destroy = destroy
+        self.dependencies = dependencies
+        self.started = time.time()
+        self.finished = None
+        self.resources = {}
+
+    def feed(self, line, timestamp=None):
+        """
+        Record the resource progress reported by a line of output.
+
+        Args:
+            line:
+                A line of output from Terraform.
+            timestamp:
+                An optional time the line was received. Defaults to the
+                current time.
+        """
+        timestamp = timestamp or time.time()
+        line = ANSI_ESCAPE_PATTERN.sub('', line).strip()
+
+        start_match = START_PATTERN.match(line)
+        if start_match:
+            self.resources[start_match.group('address')] = {
+                'action': start_match.group('action').lower(),
+                'start': timestamp,
+                'finish': None,
+            }
+            return
+
+        finish_match = FINISH_PATTERN.match(line)
+        if finish_match:
+            resource = self.resources.get(finish_match.group('address'))
+            if resource:
+                resource['finish'] = timestamp
+
+    def save(self):
+        """
+        Persist the recorded timings and discard the oldest recorded runs
+        of the step.
+
+        Returns:
+            The path the timings were written to.
+        """
+        self.finished = time.time()
+
+        timings_dir = cache.get_cache_location('timings', self.step_name)
+        timings_dir.mkdir(exist_ok=True, parents=True)
+
+        path = timings_dir / f'{int(self.started * 1000)}.json'
+        with path.open('w') as f:
+            json.dump(
+                {
+                    'step': self.step_name,
+                    'destroy': self.destroy,
+                    'started': self.started,
+                    'finished': self.finished,
+                    'resources': self.resources,
+                    'dependencies': self.dependencies,
+                },
+                f,
+                indent=2,
+            )
+
+        for stale in sorted(timings_dir.glob('*.json'))[:-MAX_RECORDED_RUNS]:
+            stale.unlink()
+
+        return path
+
+
+def plan_dependencies(plan):
+    """
+    Extract the dependencies between resources from a plan.
+
+    Args:
+        plan:
+            The plan as returned by ``terraform show -json``.
+
+    Returns:
+        A dictionary mapping the configuration address of each resource
+        to a sorted list of the configuration addresses it depends on.
+    """
+    dependencies = {}
+    _module_dependencies(
+        plan.get('configuration', {}).get('root_module', {}),
+        '',
+        dependencies,
+    )
+
+    return dependencies
+
+
+def load_runs(step_name, destroy=False):
+    """
+    Load the recorded timings of a step.
+
+    Args:
+        step_name:
+            The name of the step.
+        destroy:
+            A boolean indicating if timings of destroys should be loaded
+            instead of timings of applies.
+
+    Returns:
+        A list of the recorded runs, oldest first.
+    """
+    timings_dir = cache.get_cache_location('timings', step_name)
+
+    runs = []
+    for path in sorted(timings_dir.glob('*.json')):
+        with path.open() as f:
+            run = json.load(f)
+
+        if run['destroy'] == destroy:
+            runs.append(run)
+
+    return runs
+
+
+def recorded_steps():
+    """
+    Get the names of the steps with recorded timings.
+
+    Returns:
+        A sorted list of step names.
+    """
+    timings_dir = cache.CACHE_DIRECTORY / 'timings'
+    if not timings_dir.is_dir():
+        return []
+
+    return sorted(path.name for path in timings_dir.iterdir() if path.is_dir())
+
+
+def slowest_resources(runs, limit=10):
+    """
+    Rank resources by how long they took across recorded runs.
+
+    Args:
+        runs:
+            The recorded runs of a step as returned by :func:`load_runs`.
+        limit:
+            The maximum number of resources to return.
+
+    Returns:
+        A list of tuples containing a resource's address, its median
+        duration, its duration in the most recent run it appeared in, and
+        the number of runs it appeared in, slowest first.
+    """
+    durations = {}
+    for run in runs:
+        for address, resource in run['resources'].items():
+            duration = _duration(resource)
+            if duration is not None:
+                durations.setdefault(address, []).append(duration)
+
+    ranked = [
+        (address, statistics.median(values), values[-1], len(values))
+        for address, values in durations.items()
+    ]
+    ranked.sort(key=lambda item: item[1], reverse=True)
+
+    return ranked[:limit]
+
+
+def critical_path(run):
+    """
+    Find the chain of dependent resources that took the longest in a
+    recorded run.
+
+    Resources with several instances, such as those using ``count``, are
+    weighted by their slowest instance. Resources that were not changed
+    by the run contribute no time but still connect their dependencies.
+
+    Args:
+        run:
+            A recorded run as returned by :func:`load_runs`.
+
+    Returns:
+        A two-element tuple containing the list of configuration
+        addresses on the critical path, in the order they ran, and the
+        total duration of the path in seconds.
+    """
+    weights = {}
+    for address, resource in run['resources'].items():
+        duration = _duration(resource)
+        if duration is not None:
+            config_address = config_resource_address(address)
+            weights[config_address] = max(
+                weights.get(config_address, 0),
+                duration,
+            )
+
+    # Destroys run in the reverse order of the dependency graph.
+    predecessors = {}
+    for address, targets in run['dependencies'].items():
+        for target in targets:
+            if run['destroy']:
+                predecessors.setdefault(target, set()).add(address)
+            else:
+                predecessors.setdefault(address, set()).add(target)
+
+    longest = {}
+
+    def longest_to(address, visiting=frozenset()):
+        if address in longest:
+            return longest[address]
+
+        best = (0, [])
+        for predecessor in predecessors.get(address, ()):
+            if predecessor in visiting:
+                continue
+
+            candidate = longest_to(predecessor, visiting | {address})
+            if candidate[0] > best[0]:
+                best = candidate
+
+        result = (
+            best[0] + weights.get(address, 0),
+            best[1] + [address],
+        )
+        longest[address] = result
+
+        return result
+
+    nodes = set(weights) | set(run['dependencies']) | set(predecessors)
+    if not nodes:
+        return [], 0
+
+    total, path = max((longest_to(node) for node in sorted(nodes)),
+                      key=lambda item: item[0])
+
+    return [address for address in path if address in weights], total
+
+
+def config_resource_address(address):
+    """
+    Strip instance keys from a resource address.
+
+    Args:
+        address:
+            A resource instance address, eg
+            ``module.a["x"].google_dns_record_set.b[0]``.
+
+    Returns:
+        The address of the resource in the configuration, eg
+        ``module.a.google_dns_record_set.b``.
+    """
+    return INDEX_PATTERN.sub('', address)
+
+
+def _duration(resource):
+    if resource['finish'] is None:
+        return None
+
+    return resource['finish'] - resource['start']
+
+
+def _module_dependencies(module, prefix, dependencies):
+    addresses = {
+        resource['address'] for resource in module.get('resources', [])
+    }
+
+    for resource in module.get('resources', []):
+        targets = set()
+
+        references = list(resource.get('depends_on', []))
+        for expression in _expressions(resource.get('expressions', {})):
+            references += expression.get('references', [])
+
+        for reference in references:
+            target = _reference_address(reference, addresses)
+            if target and target != resource['address']:
+                targets.add(prefix + target)
+
+        dependencies[prefix + resource['address']] = sorted(targets)
+
+    for name, call in module.get('module_calls', {}).items():
+        _module_dependencies(
+            call.get('module', {}),
+            f'{prefix}module.{name}.',
+            dependencies,
+        )
+
+
+def _expressions(expressions):
+    # Expressions are nested for blocks within a resource.
+    if isinstance(expressions, list):
+        for item in expressions:
+            yield from _expressions(item)
+    elif isinstance(expressions, dict):
+        if 'references' in expressions:
+            yield expressions
+        else:
+            for value in expressions.values():
+                yield from _expressions(value)
+
+
+def _reference_address(reference, addresses):
+    # References may point at an attribute of a resource, such as
+    # "google_compute_network.vpc.self_link", so find the longest prefix
+    # that is a resource address.
+    parts = config_resource_address(reference).split('.')
+    for length in range(len(parts), 1, -1):
+        candidate = '.'.join(parts[:length])
+        if candidate in addresses:
+            return candidate
+
+    return None